@@ -0,0 +1,135 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Toxine project: Benchmarks
+#
+# Copyright (C) 2019-present by Sergei Ternovykh
+# License: BSD, see LICENSE for details
+"""
+Latency benchmark of the Toxine pipeline for the interactive use. Each of the
+short synthetic messages (see ``corpus_gen.py``) is processed by the function
+that ``TextPreprocessor.make_interactive()`` returns, and the percentiles of
+the per-call time are reported.
+
+Usage:
+    python benchmarks/bench_latency.py [-n NUM] [-k KIND] [--norm-punct]
+                                       [--slo MSECS] [-o result.json]
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import sys
+import time
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(SCRIPT_DIR))
+sys.path.insert(0, SCRIPT_DIR)
+
+from corpus_gen import KINDS, generate
+from toxine import TextPreprocessor
+from toxine._version import __version__
+
+PERCENTILES = [50, 95, 99]
+
+
+def get_messages(kind, num, min_len, max_len):
+    """Return *num* messages of the *kind* with lengths in the given range"""
+    size = num * max_len
+    while True:
+        msgs = [x for x in generate(kind, size) if min_len <= len(x) <= max_len]
+        if len(msgs) >= num or size > num * max_len * 64:
+            return msgs[:num]
+        size *= 4
+
+
+def percentile(vals, pct):
+    """Nearest-rank percentile of the sorted *vals*"""
+    return vals[max(0, min(len(vals) - 1,
+                           int(math.ceil(pct / 100 * len(vals))) - 1))]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Toxine latency benchmark')
+    parser.add_argument('-n', '--num', type=int, default=2000,
+                        help='number of messages')
+    parser.add_argument('-k', '--kind', choices=sorted(KINDS), default='chat',
+                        help='kind of the messages')
+    parser.add_argument('--min-len', type=int, default=50,
+                        help='min length of the message, in characters')
+    parser.add_argument('--max-len', type=int, default=300,
+                        help='max length of the message, in characters')
+    parser.add_argument('--norm-punct', action='store_true',
+                        help='normalize punctuation')
+    parser.add_argument('--slo', type=float, metavar='MSECS',
+                        help='target p{} latency; exit with code 1 if it is '
+                             'exceeded'.format(PERCENTILES[-1]))
+    parser.add_argument('-o', '--output', metavar='PATH',
+                        help='path to save results in JSON format')
+    args = parser.parse_args(argv)
+
+    msgs = get_messages(args.kind, args.num, args.min_len, args.max_len)
+    tp = TextPreprocessor()
+    try:
+        time0 = time.perf_counter()
+        process = tp.make_interactive(norm_punct=args.norm_punct)
+        warm_up = time.perf_counter() - time0
+    except Exception as e:
+        msg = [x for x in str(e).split('\n') if x.strip(' *')]
+        print('ERROR: {}: {}'.format(type(e).__name__,
+                                     msg[0].strip() if msg else ''))
+        return 2
+
+    secs = []
+    for msg in msgs:
+        time0 = time.perf_counter()
+        process(msg)
+        secs.append(time.perf_counter() - time0)
+    secs.sort()
+
+    res = {
+        'kind': args.kind, 'messages': len(msgs),
+        'chars': sum(len(x) for x in msgs), 'norm_punct': args.norm_punct,
+        'warm_up_ms': warm_up * 1000,
+        'mean_ms': sum(secs) / len(secs) * 1000 if secs else None,
+        'max_ms': secs[-1] * 1000 if secs else None
+    }
+    for pct in PERCENTILES:
+        res['p{}_ms'.format(pct)] = percentile(secs, pct) * 1000 \
+                                        if secs else \
+                                    None
+    print('{} messages of kind "{}", {}-{} chars'
+              .format(len(msgs), args.kind, args.min_len, args.max_len))
+    print('warm-up: {:.1f} ms'.format(res['warm_up_ms']))
+    if secs:
+        print('   mean: {:.3f} ms'.format(res['mean_ms']))
+        for pct in PERCENTILES:
+            print('    p{}: {:.3f} ms'.format(pct,
+                                              res['p{}_ms'.format(pct)]))
+        print('    max: {:.3f} ms'.format(res['max_ms']))
+
+    if args.output:
+        with open(args.output, 'wt', encoding='utf-8') as f:
+            json.dump({
+                'meta': {
+                    'toxine_version': __version__,
+                    'python': platform.python_version(),
+                    'platform': platform.platform(),
+                    'time': time.strftime('%Y-%m-%dT%H:%M:%S')
+                },
+                'results': res
+            }, f, ensure_ascii=False, indent=2)
+
+    if args.slo is not None and secs:
+        p_last = res['p{}_ms'.format(PERCENTILES[-1])]
+        if p_last > args.slo:
+            print('SLO FAILED: p{} {:.3f} ms > {:.3f} ms'
+                      .format(PERCENTILES[-1], p_last, args.slo))
+            return 1
+        print('SLO passed: p{} {:.3f} ms <= {:.3f} ms'
+                  .format(PERCENTILES[-1], p_last, args.slo))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,233 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Toxine project: Benchmarks
+#
+# Copyright (C) 2019-present by Sergei Ternovykh
+# License: BSD, see LICENSE for details
+"""
+Stage-level benchmark of the Toxine pipeline. Each stage of
+``TextPreprocessor.process_text()`` is timed separately on the output of
+the previous stage; also end-to-end ``do_all()``, ``brat_to_conllu()`` and
+``renew_ann()`` are timed. All the inputs are synthetic (see
+``corpus_gen.py``), so the benchmark runs offline.
+
+Usage:
+    python benchmarks/bench_stages.py [-s SIZE ...] [-k KIND ...]
+                                      [-o result.json] [--compare old.json]
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(SCRIPT_DIR))
+sys.path.insert(0, SCRIPT_DIR)
+
+from corpus_gen import KINDS, edit_text, generate, generate_brat
+from toxine import TextPreprocessor
+from toxine._version import __version__
+
+SIZES = [10000, 100000]
+
+
+def timeit(func, repeat=3):
+    """Run *func* *repeat* times and return the best time and the result of
+    the last run"""
+    best, res = None, None
+    for _ in range(repeat):
+        time0 = time.perf_counter()
+        res = func()
+        time1 = time.perf_counter() - time0
+        if best is None or time1 < best:
+            best = time1
+    return best, res
+
+
+class Bench:
+
+    def __init__(self, repeat=3):
+        self.repeat = repeat
+        self.results = []
+
+    def run(self, name, kind, size, func, units=None):
+        """Time *func*. If the stage fails (e.g. NLTK data is absent), the
+        error is stored in the result instead of the time"""
+        item = {'stage': name, 'kind': kind, 'size': size}
+        try:
+            secs, res = timeit(func, self.repeat)
+        except Exception as e:
+            msg = [x for x in str(e).split('\n') if x.strip(' *')]
+            item['error'] = '{}: {}'.format(type(e).__name__,
+                                            msg[0].strip() if msg else '')
+            res = None
+            print('{:>10} {:>8} {:<24} ERROR: {}'
+                      .format(kind, size, name, item['error']))
+        else:
+            item['secs'] = secs
+            item['chars_per_sec'] = size / secs if secs else None
+            if units is not None:
+                item['units'] = units
+            print('{:>10} {:>8} {:<24} {:9.4f} sec'
+                      .format(kind, size, name, secs))
+        self.results.append(item)
+        return res
+
+
+def bench_stages(bench, tp, kind, size):
+    pars = generate(kind, size)
+    text = '\n'.join(pars)
+    size = len(text)
+
+    def each(func, pars_):
+        return lambda: [func(x) for x in pars_]
+
+    pars_ = bench.run('unescape_html', kind, size,
+                      each(tp._unescape_html, pars)) or pars
+    pars_ = bench.run('remove_delims', kind, size,
+                      each(tp._remove_delims, pars_)) or pars_
+    for tagger in ['emoji', 'xml', 'email', 'uri', 'phone', 'date',
+                   'hashtag', 'nametag', 'quotation']:
+        pars_ = bench.run('tag_' + tagger, kind, size,
+                          each(getattr(tp, '_tag_' + tagger), pars_)) \
+             or pars_
+
+    def process_tags():
+        tags = {}
+        return [tp._process_tags(x, tags) for x in pars_], tags
+    pars_, tags = bench.run('process_tags', kind, size, process_tags) \
+               or (pars_, {})
+
+    chars_allowed = r'\s' + tp.CHARS_ALLOWED
+    def process_nospace():
+        tags_ = {x: y.copy() for x, y in tags.items()}
+        return [tp._process_nospace(x, chars_allowed, False, True, tags_)
+                    for x in pars_], tags_
+    pars_, tags = bench.run('process_nospace', kind, size, process_nospace) \
+               or (pars_, tags)
+
+    bench.run('norm_punct', kind, size, each(tp.norm_punct, pars_))
+
+    sents = bench.run('sent_tokenize', kind, size,
+                      each(tp.sent_tokenize, pars_))
+    sents = [x for x in sents for x in x] if sents else \
+            [x.strip() for x in pars_ if x.strip()]
+    wforms = bench.run('word_tokenize', kind, size,
+                       each(tp.word_tokenize, sents), units=len(sents))
+    if wforms:
+        bench.run('make_sent', kind, size,
+                  each(lambda x: tp._make_sent(x, tags), wforms),
+                  units=len(wforms))
+
+
+def bench_do_all(bench, tp, kind, size, is_tokenized=False):
+    pars = generate(kind, size)
+    size = sum(len(x) + 1 for x in pars)
+    name_suffix = '_fast' if is_tokenized == 'fast' else \
+                  '_tokenized' if is_tokenized else \
+                  ''
+
+    def do_all():
+        tp.clear_corpus()
+        tp.new_pars(pars)
+        tp.do_all(silent=True, is_tokenized=is_tokenized)
+        return True
+    if bench.run('do_all' + name_suffix, kind, size, do_all,
+                 units=len(pars)):
+        bench.run('save' + name_suffix, kind, size, lambda: list(tp.save()))
+    tp.clear_corpus()
+
+
+def bench_brat(bench, size, work_dir):
+    text, ann = generate_brat(size)
+    size = len(text)
+    txt_fn = os.path.join(work_dir, 'bench.txt')
+    ann_fn = os.path.join(work_dir, 'bench.ann')
+    with open(txt_fn, 'wt', encoding='utf-8', newline='') as f:
+        f.write(text)
+    with open(ann_fn, 'wt', encoding='utf-8', newline='') as f:
+        f.write(ann)
+    from toxine.brat import brat_to_conllu, renew_ann
+    bench.run('brat_to_conllu', 'brat', size,
+              lambda: list(brat_to_conllu(txt_fn, ann_fn, silent=True)))
+    new_txt_fn = os.path.join(work_dir, 'bench_new.txt')
+    with open(new_txt_fn, 'wt', encoding='utf-8', newline='') as f:
+        f.write(edit_text(text))
+    bench.run('renew_ann', 'brat', size,
+              lambda: renew_ann(txt_fn, ann_fn, new_txt_fn,
+                                os.path.join(work_dir, 'bench_new.ann')))
+
+
+def compare(old_fn, results):
+    """Print the relative change of times against the *old_fn* results"""
+    with open(old_fn, 'rt', encoding='utf-8') as f:
+        old = {(x['stage'], x['kind'], x['size']): x
+                   for x in json.load(f)['results']}
+    print('\n{:>10} {:>8} {:<24} {:>9} {:>9} {:>8}'
+              .format('kind', 'size', 'stage', 'old', 'new', 'change'))
+    for item in results:
+        old_item = old.get((item['stage'], item['kind'], item['size']))
+        if not old_item or 'secs' not in old_item or 'secs' not in item:
+            continue
+        print('{:>10} {:>8} {:<24} {:9.4f} {:9.4f} {:+7.1%}'
+                  .format(item['kind'], item['size'], item['stage'],
+                          old_item['secs'], item['secs'],
+                          item['secs'] / old_item['secs'] - 1
+                              if old_item['secs'] else 0.))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Toxine stage benchmark')
+    parser.add_argument('-s', '--size', type=int, nargs='+', default=SIZES,
+                        help='sizes of the corpora, in characters')
+    parser.add_argument('-k', '--kind', nargs='+', choices=sorted(KINDS),
+                        default=sorted(KINDS), help='kinds of the corpora')
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+                        help='number of runs of each stage (the best time '
+                             'is taken)')
+    parser.add_argument('--no-brat', action='store_true',
+                        help="don't run brat benchmarks")
+    parser.add_argument('-o', '--output', metavar='PATH',
+                        help='path to save results in JSON format')
+    parser.add_argument('--compare', metavar='PATH',
+                        help='results of the previous run to compare with')
+    args = parser.parse_args(argv)
+
+    bench = Bench(repeat=args.repeat)
+    tp = TextPreprocessor()
+    for size in args.size:
+        for kind in args.kind:
+            bench_stages(bench, tp, kind, size)
+            bench_do_all(bench, tp, kind, size)
+            bench_do_all(bench, tp, kind, size, is_tokenized=True)
+            bench_do_all(bench, tp, kind, size, is_tokenized='fast')
+        if not args.no_brat:
+            work_dir = tempfile.mkdtemp(prefix='toxine_bench_')
+            try:
+                bench_brat(bench, size, work_dir)
+            finally:
+                shutil.rmtree(work_dir, ignore_errors=True)
+
+    res = {
+        'meta': {
+            'toxine_version': __version__,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'repeat': args.repeat
+        },
+        'results': bench.results
+    }
+    if args.output:
+        with open(args.output, 'wt', encoding='utf-8') as f:
+            json.dump(res, f, ensure_ascii=False, indent=2)
+    if args.compare:
+        compare(args.compare, bench.results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,195 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# Toxine project: Benchmarks
+#
+# Copyright (C) 2019-present by Sergei Ternovykh
+# License: BSD, see LICENSE for details
+"""
+Seeded generator of synthetic Russian texts for benchmarks. Three kinds of
+corpora are supported: "chat" (short noisy messages), "news" (long correct
+sentences) and "entities" (texts overloaded with urls, emails, phones etc.).
+"""
+import random
+
+WORDS = (
+    'я ты он она мы вы они это что как так все уже еще только когда если '
+    'было будет может можно нужно очень просто тоже даже потом сегодня '
+    'завтра вчера время день год человек работа дело жизнь город страна '
+    'компания рынок цена рубль деньги закон проект решение вопрос ответ '
+    'правительство президент министр директор сотрудник житель эксперт '
+    'новый большой последний главный российский московский первый второй '
+    'сказал сообщил заявил отметил получил сделал пришел написал сказала '
+    'знаю думаю хочу могу надо понял спасибо привет пока ладно хорошо '
+    'плохо круто норм ок вообще короче кстати блин конечно наверное'
+).split()
+NAMES = ('Иван Петр Анна Мария Сергей Ольга Дмитрий Елена Алексей Наталья '
+         'Иванов Петров Смирнова Кузнецов Попова Соколов Лебедева').split()
+CITIES = 'Москва Петербург Казань Новосибирск Екатеринбург Самара'.split()
+SHORTCUTS = ['т.е.', 'т.к.', 'и т.д.', 'и т.п.', 'м.б.', 'г-н', 'г-жа']
+EMOJIS = [':)', ':-)', ':(', ';)', ':D', '))', '((', '\U0001F600',
+          '\U0001F44D', '❤']
+DOMAINS = ['ru', 'com', 'org', 'net', 'рф']
+PUNCT_CHAT = ['', '', '!', '!!!', '?', '??', '...', ')', '.']
+
+
+def _word(rnd):
+    return rnd.choice(WORDS)
+
+
+def _url(rnd):
+    host = '{}.{}'.format(rnd.choice(['example', 'test', 'news', 'shop',
+                                      'portal', 'сайт']),
+                          rnd.choice(DOMAINS))
+    return rnd.choice(['http://', 'https://', 'www.', '']) + host \
+         + rnd.choice(['', '/', '/news/{}'.format(rnd.randint(1, 99999)),
+                       '/page?id={}&lang=ru'.format(rnd.randint(1, 999))])
+
+
+def _email(rnd):
+    return '{}{}@{}.{}'.format(rnd.choice(['ivan', 'info', 'support',
+                                           'anna.p', 'user_']),
+                               rnd.randint(1, 999),
+                               rnd.choice(['mail', 'yandex', 'gmail']),
+                               rnd.choice(['ru', 'com']))
+
+
+def _phone(rnd):
+    d = [rnd.randint(0, 9) for _ in range(10)]
+    return rnd.choice([
+        '8 ({}{}{}) {}{}{}-{}{}-{}{}',
+        '+7{}{}{}{}{}{}{}{}{}{}',
+        '8-{}{}{}-{}{}{}-{}{}-{}{}',
+        '+7 {}{}{} {}{}{} {}{} {}{}'
+    ]).format(*d)
+
+
+def _date(rnd):
+    return '{:02}.{:02}.{}'.format(rnd.randint(1, 28), rnd.randint(1, 12),
+                                   rnd.randint(1995, 2025))
+
+
+def _entity(rnd):
+    return rnd.choice([_url, _email, _phone, _date,
+                       lambda x: '#' + _word(x),
+                       lambda x: '@' + rnd.choice(['user', 'admin', 'bot'])
+                                     + str(x.randint(1, 99)),
+                       lambda x: '<b>{}</b>'.format(_word(x))])(rnd)
+
+
+def chat_par(rnd):
+    sents = []
+    for _ in range(rnd.randint(1, 3)):
+        words = [_word(rnd) for _ in range(rnd.randint(1, 10))]
+        if rnd.random() < .2:
+            words.insert(rnd.randint(0, len(words)), rnd.choice(EMOJIS))
+        if rnd.random() < .1:
+            words.insert(rnd.randint(0, len(words)), rnd.choice(SHORTCUTS))
+        if rnd.random() < .1:
+            words.insert(rnd.randint(0, len(words)), _entity(rnd))
+        sent = ' '.join(words)
+        if rnd.random() < .3:
+            sent = sent.capitalize()
+        sents.append(sent + rnd.choice(PUNCT_CHAT))
+    return ' '.join(sents)
+
+
+def news_par(rnd):
+    sents = []
+    for _ in range(rnd.randint(2, 6)):
+        words = [_word(rnd) for _ in range(rnd.randint(6, 25))]
+        for _ in range(rnd.randint(0, 2)):
+            words.insert(rnd.randint(0, len(words)),
+                         rnd.choice([rnd.choice(NAMES), rnd.choice(CITIES),
+                                     str(rnd.randint(2, 2000)),
+                                     '«{}»'.format(_word(rnd).capitalize()),
+                                     '{} {}.'.format(_word(rnd),
+                                                     rnd.choice(['г', 'см']))
+                                     ]))
+        if rnd.random() < .3:
+            words.insert(rnd.randint(1, len(words)), '—')
+        if rnd.random() < .3:
+            words[rnd.randint(0, len(words) - 1)] += ','
+        sents.append(' '.join(words).capitalize()
+                   + rnd.choice(['.', '.', '.', '!', '?', '…']))
+    return ' '.join(sents)
+
+
+def entities_par(rnd):
+    words = []
+    for _ in range(rnd.randint(5, 30)):
+        words.append(_entity(rnd) if rnd.random() < .35 else _word(rnd))
+    return ' '.join(words).capitalize() + '.'
+
+
+KINDS = {'chat': chat_par, 'news': news_par, 'entities': entities_par}
+
+
+def generate(kind, size, seed=42):
+    """Generate the corpus of the given *kind*.
+
+    :param kind: one of "chat", "news", "entities"
+    :param size: approximate size of the corpus in characters
+    :param seed: seed of the random generator
+    :return: list of paragraphs
+    :rtype: list(str)
+    """
+    assert kind in KINDS, 'ERROR: Unknown kind of corpus "{}"'.format(kind)
+    rnd = random.Random('{}:{}'.format(kind, seed))
+    gen_par = KINDS[kind]
+    pars, len_ = [], 0
+    while len_ < size:
+        par = gen_par(rnd)
+        pars.append(par)
+        len_ += len(par) + 1
+    return pars
+
+
+def generate_brat(size, seed=42):
+    """Generate the text and the annotation in brat format.
+
+    :param size: approximate size of the text in characters
+    :return: text, annotation
+    :rtype: tuple(str, str)
+    """
+    rnd = random.Random('brat:{}'.format(seed))
+    text = '\n'.join(news_par(rnd) for _ in range(max(1, size // 500)))
+    ann, tid = [], 0
+    pos = 0
+    while True:
+        pos = text.find(' ', pos + rnd.randint(10, 60))
+        if pos < 0:
+            break
+        start = pos + 1
+        end = start
+        while end < len(text) and text[end].isalpha():
+            end += 1
+        if end > start:
+            tid += 1
+            ann.append('T{}\t{} {} {}\t{}'.format(
+                tid, rnd.choice(['Person', 'Location', 'Organization']),
+                start, end, text[start:end]
+            ))
+            if tid > 1 and rnd.random() < .2:
+                ann.append('R{}\tRel Arg1:T{} Arg2:T{}'
+                               .format(tid, tid - 1, tid))
+            if rnd.random() < .1:
+                ann.append('A{}\tNegated T{}'.format(tid, tid))
+        pos = end
+    return text, '\n'.join(ann) + '\n'
+
+
+def edit_text(text, ratio=.01, seed=42):
+    """Make random edits of the *text* for ``renew_ann()`` benchmark"""
+    rnd = random.Random('edit:{}'.format(seed))
+    chars = list(text)
+    for _ in range(int(len(chars) * ratio)):
+        i = rnd.randint(0, len(chars) - 1)
+        op = rnd.random()
+        if op < .4:
+            chars.insert(i, rnd.choice('абвгд '))
+        elif op < .8:
+            if chars[i] != '\n':
+                del chars[i]
+        elif chars[i] != '\n':
+            chars[i] = rnd.choice('еёжз')
+    return ''.join(chars)
@@ -46,9 +46,12 @@ setup(
     # What does your project relate to?
     keywords='natural-language-processing nlp preprocessing',
 
-    packages=find_packages(exclude=['data', 'doc', 'examples', 'scripts',
-                                    'tests']),
+    packages=find_packages(exclude=['benchmarks', 'data', 'doc', 'examples',
+                                    'scripts', 'tests']),
     install_requires=['corpuscula', 'nltk', 'pymorphy2'],
     include_package_data=True,
+    entry_points={
+        'console_scripts': ['toxine=toxine.cli:main'],
+    },
     python_requires='>=3.5',
 )
@@ -0,0 +1,44 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import json
+import os
+
+###
+import sys
+sys.path.append('../')
+sys.path.append('../benchmarks')
+###
+
+from tests._test_support import WORK_DIR, WORK_FNAME, \
+                                bprint, eprint, safe_run, check_res
+from bench_stages import main
+from corpus_gen import KINDS, edit_text, generate, generate_brat
+
+def f ():
+    pars = {x: generate(x, 5000) for x in KINDS}
+    text, ann = generate_brat(5000)
+    return all(generate(x, 5000) == y and generate(x, 5000, seed=1) != y
+               and sum(len(x) + 1 for x in y) >= 5000
+                   for x, y in pars.items()) \
+       and generate_brat(5000) == (text, ann) \
+       and all(text[int(x[2]):int(x[3])] == x[4]
+                   for x in (x.replace('\t', ' ').split(' ', 4)
+                                 for x in ann.splitlines())
+                       if x[0].startswith('T')) \
+       and edit_text(text) == edit_text(text) != text
+check_res(safe_run(f, 'Testing corpus_gen'))
+
+def f ():
+    main(['--size', '2000', '--repeat', '1', '--output', WORK_FNAME])
+    with open(WORK_FNAME, 'rt', encoding='utf-8') as f:
+        res = json.load(f)['results']
+    # the run compared with itself
+    main(['--size', '2000', '--repeat', '1', '--kind', 'chat', '--no-brat',
+          '--compare', WORK_FNAME])
+    os.remove(WORK_FNAME)
+    return all('secs' in x for x in res) \
+       and {x['kind'] for x in res} == set(KINDS) | {'brat'} \
+       and {x['stage'] for x in res if x['kind'] == 'brat'} \
+               == {'brat_to_conllu', 'renew_ann'}
+check_res(safe_run(f, 'Testing bench_stages'))
@@ -0,0 +1,57 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import os
+import struct
+
+###
+import sys
+sys.path.append('../')
+###
+
+from collections import OrderedDict
+from corpuscula import Conllu
+from tests._test_support import WORK_DIR, WORK_FNAME, \
+                                bprint, eprint, safe_run, check_res
+from toxine.binary import BinaryConllu, save_binary
+
+CONLLU_FNAME = os.path.join(WORK_DIR, 'test3.conllu')
+
+corpus = list(Conllu.load(CONLLU_FNAME, log_file=None))
+
+def f ():
+    save_binary(CONLLU_FNAME, WORK_FNAME, log_file=None)
+    with BinaryConllu(WORK_FNAME) as corpus_:
+        return len(corpus_) == len(corpus) and list(corpus_) == corpus
+check_res(safe_run(f, 'Testing binary save/load round-trip'))
+
+def f ():
+    sent_ids = [x[1]['sent_id'] for x in corpus]
+    doc_id = corpus[0][1]['newdoc id']
+    with BinaryConllu(WORK_FNAME) as corpus_:
+        return corpus_.get_sent(sent_ids[3]) == corpus[3] \
+           and corpus_.get_sent('absent') is None \
+           and list(corpus_.doc_ids()) == [doc_id] \
+           and list(corpus_.get_doc(doc_id)) == corpus \
+           and list(corpus_.get_range(sent_ids[2], sent_ids[5])) \
+                == corpus[2:6] \
+           and list(corpus_.get_range(2, 5)) == corpus[2:6] \
+           and list(corpus_.get_range(sent_ids[2], 5)) == corpus[2:6] \
+           and list(corpus_.get_range(len(corpus) - 2, 10 ** 6)) \
+                == corpus[-2:] \
+           and list(corpus_.get_range()) == corpus
+check_res(safe_run(f, 'Testing binary random access'))
+
+def f ():
+    corpus_ = [(tokens, OrderedDict(list(meta.items()) + [('flag', None)]))
+                   for tokens, meta in corpus]
+    save_binary(corpus_, WORK_FNAME, log_file=None)
+    with BinaryConllu(WORK_FNAME) as corpus__:
+        num_strs, = struct.unpack_from('<Q', corpus__._mm, corpus__._str_pos)
+        strs = {corpus__._get_str_(x) for x in range(num_strs)}
+        return list(corpus__) == corpus_ \
+           and corpus__.get_sent(corpus[1][1]['sent_id']) == corpus_[1] \
+           and not any(x[1]['text'] in strs for x in corpus)
+check_res(safe_run(f, 'Testing binary metadata'))
+
+os.remove(WORK_FNAME)
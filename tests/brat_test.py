@@ -0,0 +1,166 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+
+###
+import sys
+sys.path.append('../')
+###
+
+from corpuscula import Conllu
+from tests._test_support import WORK_DIR, WORK_FNAME, \
+                                bprint, eprint, safe_run, check_res
+from toxine import TextPreprocessor
+from toxine.brat import BratDocument, brat_dir_to_conllu, brat_to_conllu, \
+                        embed_brat_annotations, renew_ann
+
+BRAT_DIR = os.path.join(WORK_DIR, 'brat')
+BRAT_FNAMES = [os.path.join(BRAT_DIR, 'doc1.txt'),
+               os.path.join(BRAT_DIR, 'sub', 'doc2.txt')]
+WORK_DNAME = WORK_FNAME + '_dir'
+TXT_FNAME = WORK_FNAME + '.txt'
+ANN_FNAME = WORK_FNAME + '.ann'
+
+def get_tokens(corpus):
+    # the order of MISC items is not kept by Conllu.load()
+    return [[(x['FORM'], dict(x['MISC'])) for x in sent]
+                for sent, _ in corpus]
+
+def write(fname, text):
+    with open(fname, 'wt', encoding='utf-8') as f:
+        f.write(text)
+
+def get_sources(corpus):
+    return [meta['source'] for _, meta in corpus if 'newdoc id' in meta]
+
+def f ():
+    errors = brat_dir_to_conllu(BRAT_DIR, WORK_FNAME, silent=True)
+    corpus = list(Conllu.load(WORK_FNAME, log_file=None))
+    corpus_ = [x for fn in BRAT_FNAMES
+                     for x in brat_to_conllu(fn, silent=True)]
+    return errors == [] and get_tokens(corpus) == get_tokens(corpus_) \
+       and get_sources(corpus) == ['doc1.txt', 'doc1.txt',
+                                   os.path.join('sub', 'doc2.txt')]
+check_res(safe_run(f, 'Testing brat_dir_to_conllu'))
+
+def f ():
+    errors = brat_dir_to_conllu(BRAT_DIR, WORK_DNAME, per_file=True,
+                                workers=2, silent=True)
+    corpus = [x for fn in ['doc1.conllu', os.path.join('sub', 'doc2.conllu')]
+                  for x in Conllu.load(os.path.join(WORK_DNAME, fn),
+                                       log_file=None)]
+    corpus_ = list(Conllu.load(WORK_FNAME, log_file=None))
+    return errors == [] and get_tokens(corpus) == get_tokens(corpus_) \
+       and get_sources(corpus) == get_sources(corpus_)
+check_res(safe_run(f, 'Testing brat_dir_to_conllu per file with workers'))
+
+def f ():
+    doc1_txt, doc1_ann = BRAT_FNAMES[0], BRAT_FNAMES[0][:-4] + '.ann'
+    write(TXT_FNAME, 'Пишите: a@b.ru[1] или Ивану\n')
+    # the end mark of T1 and the start mark of T2 are adjacent
+    write(ANN_FNAME, 'T1\tEmail 8 14\ta@b.ru\nT2\tNote 14 17\t[1]\n'
+                     'T3\tPerson 22 27\tИвану\n')
+    sents = list(brat_to_conllu(TXT_FNAME, ANN_FNAME, silent=True))
+    return list(embed_brat_annotations(doc1_txt, doc1_ann)) == [
+        '[T1/Person!!R1/WorksAt/Arg1>>]Иван Петров[<<T1] живет в '
+        '[T2/Location>>]Москве[<<T2].',
+        'Он работает в [T3/Organization!!R1/WorksAt/Arg2>>]ООО «Ромашка»'
+        '[<<T3] с 2010 года.'
+    ] and list(embed_brat_annotations(doc1_txt, doc1_ann,
+                                      keep_tokens=True))[0] \
+              .endswith('[T2/Location>>]Москве.[<<T2]') \
+       and [[(x['FORM'], dict(x['MISC'])) for x in sent]
+                for sent, _ in sents] \
+               == [[('Пишите:', {}),
+                    ('адрес', {'EntityEmail': 'a@b.ru', 'bratT1': 'Email'}),
+                    ('(1)', {'bratT2': 'Note'}), ('или', {}),
+                    ('Ивану', {'bratT3': 'Person'})]]
+check_res(safe_run(f, 'Testing embed_brat_annotations'))
+
+def f ():
+    lines = ['T1\tPerson 0 4\tИван', 'T2\tPerson 5 11\tПетров',
+             'T3\tLocation 20 26;27 28\tМосква .',
+             'R1\tRel Arg1:T1 Arg2:T2', '*\tEquiv T1 T2',
+             'E1\tEvent:T2 Agent:T1', 'A1\tNegated E1',
+             'A2\tLevel T1 High', 'N1\tReference T1 Wikipedia:123\tИван',
+             '#1\tAnnotatorNotes T1\tnote text']
+    write(ANN_FNAME, '\n'.join(lines) + '\n')
+    doc = BratDocument(ANN_FNAME)
+    res = [doc.format_ann(x) for x in doc] == lines \
+      and len(doc) == len(lines) and '*1' in doc and 'T4' not in doc \
+      and [x.id for x in doc.entities()] == ['T1', 'T2', 'T3'] \
+      and doc['T3'].spans == ((20, 26), (27, 28)) \
+      and doc['E1'].refs == (('', 'T2'), ('Agent', 'T1')) \
+      and [(x.id, y) for x, y in doc.referrers('T1')] \
+              == [('R1', 'Arg1'), ('*1', ''), ('E1', 'Agent'), ('A2', ''),
+                  ('N1', ''), ('#1', '')] \
+      and [x.id for x in doc.find(3, 28)] == ['T1', 'T2', 'T3'] \
+      and doc.find(26) == [] and [x.id for x in doc.find(27)] == ['T3']
+    for lines_ in [lines + ['R2\tRel Arg1:T1 Arg2:T4'], lines + lines[:1]]:
+        write(ANN_FNAME, '\n'.join(lines_) + '\n')
+        try:
+            BratDocument(ANN_FNAME)
+            res = False
+        except ValueError:
+            pass
+    return res
+check_res(safe_run(f, 'Testing BratDocument'))
+
+def f ():
+    tp = TextPreprocessor()
+    with open(BRAT_FNAMES[0], 'rt', encoding='utf-8') as f:
+        sents_ = [x for line in f
+                    for x in tp.process_text(line, silent=True)]
+    sents = list(brat_to_conllu(BRAT_FNAMES[0], use_offsets=True,
+                                silent=True))
+    # the annotation of the part of the token is moved to the whole token
+    write(TXT_FNAME, 'Пишите Анне Ивановой на a@b.ru до пятницы.\n')
+    write(ANN_FNAME, 'T1\tPerson 7 18\tАнне Иванов\n'
+                     'T2\tEmail 24 27\ta@b\n')
+    ne = [dict(x['MISC']).get('NE')
+              for sent in brat_to_conllu(TXT_FNAME, use_offsets=True,
+                                         make_ne=True, keep_originals=False,
+                                         silent=True)
+              for x in sent[0]]
+    person = {'bratT1': 'Person', 'bratR1': 'T1:WorksAt:Arg1'}
+    org = {'bratT3': 'Organization', 'bratR1': 'T3:WorksAt:Arg2'}
+    return [[x['FORM'] for x in sent] for sent, _ in sents] \
+               == [[x['FORM'] for x in sent] for sent, _ in sents_] \
+       and [[{x: y for x, y in x['MISC'].items() if x != 'SpaceAfter'}
+                 for x in sent] for sent, _ in sents] \
+               == [[person, person, {}, {}, {'bratT2': 'Location'}, {}],
+                   [{}, {}, {}, org, org, org, org, {}, {}, {}, {}]] \
+       and ne == [None, 'Person', 'Person', None, 'Email', None, None, None]
+check_res(safe_run(f, 'Testing brat_to_conllu with offsets'))
+
+def f ():
+    doc1_ann = BRAT_FNAMES[0][:-4] + '.ann'
+    res = []
+    for text in [
+        'Вчера Иван Петров переехал в Москве.\n'
+        'Он работает в ООО «Ромашка» с 2010 года.\n',
+        'Иван Петров живет.\nОн работает в ООО «Ромашка» с 2010 года.\n',
+        'Петров живет в Москве.\nОн работает в ООО с 2010 года.\n'
+    ]:
+        write(TXT_FNAME, text)
+        renew_ann(BRAT_FNAMES[0], doc1_ann, TXT_FNAME, ANN_FNAME)
+        with open(ANN_FNAME, 'rt', encoding='utf-8') as f:
+            res.append(f.read().splitlines())
+    return res == [
+        ['T1\tPerson 6 17\tИван Петров', 'T2\tLocation 29 35\tМоскве',
+         'T3\tOrganization 51 64\tООО «Ромашка»',
+         'R1\tWorksAt Arg1:T1 Arg2:T3'],
+        ['T1\tPerson 0 11\tИван Петров',
+         'T3\tOrganization 33 46\tООО «Ромашка»',
+         'R1\tWorksAt Arg1:T1 Arg2:T3'],
+        ['T1\tPerson 0 6\tПетров', 'T2\tLocation 15 21\tМоскве',
+         'T3\tOrganization 37 40\tООО', 'R1\tWorksAt Arg1:T1 Arg2:T3']
+    ]
+check_res(safe_run(f, 'Testing renew_ann'))
+
+os.remove(TXT_FNAME)
+os.remove(ANN_FNAME)
+os.remove(WORK_FNAME)
+shutil.rmtree(WORK_DNAME)
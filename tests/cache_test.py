@@ -0,0 +1,110 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import os
+import time
+
+###
+import sys
+sys.path.append('../')
+###
+
+from tests._test_support import WORK_DIR, WORK_FNAME, \
+                                bprint, eprint, safe_run, check_res
+from toxine import TextPreprocessor
+from toxine.cache import DiskCache, MemoryCache
+
+TEXT = 'Пишите на a@b.ru или c@d.ru. Спасибо!'
+DB_FNAME = WORK_FNAME + '.sqlite'
+
+def ext_tag(text, delim):
+    return text
+
+def f ():
+    tp = TextPreprocessor()
+    cache = MemoryCache()
+    tags = {}
+    sents = tp.process_text(TEXT, cache=cache, tags=tags, silent=True)
+    sents_ = tp.process_text(TEXT, cache=cache, tags=tags, silent=True)
+    return cache.hits == 1 and cache.misses == 1 and sents_ == sents \
+       and sents == tp.process_text(TEXT, silent=True)
+check_res(safe_run(f, 'Testing cache hit'))
+
+def f ():
+    # the found tags continue the numeration of the caller's storage
+    tp = TextPreprocessor()
+    cache = MemoryCache()
+    tp.process_text(TEXT, cache=cache, silent=True)
+    tags, tags_ = {'EntityEmail': ['x@y.ru']}, {'EntityEmail': ['x@y.ru']}
+    sents = tp.process_text(TEXT, cache=cache, tags=tags, silent=True)
+    sents_ = tp.process_text(TEXT, tags=tags_, silent=True)
+    return cache.hits == 1 and sents == sents_ and tags == tags_ \
+       and tags['EntityEmail'] == ['x@y.ru', 'a@b.ru', 'c@d.ru']
+check_res(safe_run(f, 'Testing tags on cache hit'))
+
+def f ():
+    tp = TextPreprocessor()
+    cache = MemoryCache()
+    tp.process_text(TEXT, cache=cache, silent=True)
+    tp.process_text(TEXT, cache=cache, tag_email=False, silent=True)
+    tp.process_text(TEXT, cache=cache, post_tag=ext_tag, silent=True)
+    tp.register_tag('EntityThanks', mask='спасибо')
+    tp.process_text(TEXT, cache=cache, silent=True)
+    tp.CHARS_ALLOWED += 'є'
+    tp.process_text(TEXT, cache=cache, silent=True)
+    with open(WORK_FNAME, 'wt', encoding='utf-8') as f:
+        print('1\tСпасибо\tспасибо\tINTJ\t_\t_\t_\t_\t_\tSpaceAfter=No',
+              file=f)
+        print('2\t!\t!\tPUNCT\t_\t_\t_\t_\t_\t_\n', file=f)
+    tp = TextPreprocessor(cdict_corpus=WORK_FNAME)
+    tp.process_text(TEXT, cache=cache, silent=True)
+    # the same config as the first one
+    tp = TextPreprocessor()
+    tp.process_text(TEXT, cache=cache, silent=True)
+    return cache.hits == 1 and cache.misses == 6
+check_res(safe_run(f, 'Testing cache miss on config change'))
+
+def f ():
+    tp = TextPreprocessor()
+    try:
+        tp.process_text(TEXT, cache=MemoryCache(),
+                        post_tag=lambda text, delim: text, silent=True)
+    except ValueError:
+        return True
+    return False
+check_res(safe_run(f, 'Testing anonymous tagger with cache'))
+
+def f ():
+    cache = MemoryCache(maxsize=2)
+    for key in 'abc':
+        cache.put(key, key)
+    res = cache.get('a') is None and cache.get('c') == 'c' \
+      and cache.evictions == 1 and len(cache) == 2
+    cache = MemoryCache(ttl=.05)
+    cache.put('a', 'a')
+    res = res and cache.get('a') == 'a'
+    time.sleep(.1)
+    return res and cache.get('a') is None and cache.expirations == 1 \
+       and len(cache) == 0
+check_res(safe_run(f, 'Testing MemoryCache eviction and ttl'))
+
+def f ():
+    def process(cache):
+        tp = TextPreprocessor()
+        tp.load_pars(os.path.join(WORK_DIR, 'test.txt'), eop=r'\n')
+        tp.do_all(cache=cache, silent=True)
+        return list(tp.save())
+    with DiskCache(DB_FNAME) as cache:
+        sents = process(cache)
+        misses = cache.misses
+    with DiskCache(DB_FNAME) as cache:
+        sents_ = process(cache)
+        res = cache.hits == misses and cache.misses == 0 \
+          and len(cache) == misses
+    # doc ids are random, so compare the tokens only
+    return res and misses > 0 \
+       and [x[0] for x in sents] == [x[0] for x in sents_]
+check_res(safe_run(f, 'Testing DiskCache persistence'))
+
+os.remove(WORK_FNAME)
+os.remove(DB_FNAME)
@@ -0,0 +1,69 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import json
+import os
+
+###
+import sys
+sys.path.append('../')
+###
+
+from corpuscula import Conllu
+from tests._test_support import WORK_DIR, WORK_FNAME, \
+                                bprint, eprint, safe_run, check_res
+from toxine import TextPreprocessor
+from toxine.cli import main
+from toxine.utils import open_file
+
+TXT_FNAME = os.path.join(WORK_DIR, 'test.txt')
+JSONL_FNAME = WORK_FNAME + '.jsonl'
+GZ_FNAME = WORK_FNAME + '.gz'
+
+def get_sents(corpus):
+    return [(meta['text'], [x['FORM'] for x in sent]) for sent, meta in corpus]
+
+def get_ids(corpus):
+    return [meta['sent_id'].split('-p', 1)[1] for _, meta in corpus]
+
+tp = TextPreprocessor()
+tp.load_pars(TXT_FNAME, eop=r'\n')
+tp.do_all(silent=True)
+corpus = list(tp.save())
+
+def f ():
+    main([TXT_FNAME, '--format', 'lines', '--output', WORK_FNAME])
+    corpus_ = list(Conllu.load(WORK_FNAME, log_file=None))
+    return get_sents(corpus_) == get_sents(corpus) \
+       and get_ids(corpus_) == get_ids(corpus) \
+       and corpus_[0][1]['newdoc id'] == 'test.txt'
+check_res(safe_run(f, 'Testing CLI'))
+
+def f ():
+    with open(WORK_FNAME, 'rt', encoding='utf-8') as f:
+        text = f.read()
+    main([TXT_FNAME, '--format', 'lines', '--output', WORK_FNAME,
+          '--workers', '2', '--batch-size', '3'])
+    with open(WORK_FNAME, 'rt', encoding='utf-8') as f:
+        return f.read() == text
+check_res(safe_run(f, 'Testing CLI with workers'))
+
+def f ():
+    with open(TXT_FNAME, 'rt', encoding='utf-8-sig') as f_in, \
+         open(JSONL_FNAME, 'wt', encoding='utf-8') as f_out:
+        pars = [x.strip() for x in f_in if x.strip()]
+        for i in range(0, len(pars), 5):
+            print(json.dumps({'id': i, 'text': '\n'.join(pars[i:i + 5])},
+                             ensure_ascii=False),
+                  file=f_out)
+    main([JSONL_FNAME, '--format', 'jsonl', '--output', GZ_FNAME])
+    with open_file(GZ_FNAME, 'rt') as f:
+        corpus_ = list(Conllu.load(f, log_file=None))
+    return get_sents(corpus_) == get_sents(corpus) \
+       and [x[1]['newdoc id'] for x in corpus_ if 'newdoc id' in x[1]] \
+               == [str(x) for x in range(0, len(pars), 5)]
+check_res(safe_run(f, 'Testing CLI with jsonl'))
+
+os.remove(WORK_FNAME)
+os.remove(JSONL_FNAME)
+os.remove(GZ_FNAME)
@@ -0,0 +1,82 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import os
+
+###
+import sys
+sys.path.append('../')
+###
+
+from tests._test_support import WORK_DIR, WORK_FNAME, \
+                                bprint, eprint, safe_run, check_res
+from toxine import TextPreprocessor
+from toxine.entity_index import EntityIndex
+
+DOCS = [('d1', ['Звоните 8 (999) 123-45-67.', 'Пишите на Info@Example.com.']),
+        ('d2', ['Мой телефон +7 999 123 45 67, почта a@b.ru.']),
+        ('d3', ['Пишите на info@example.com или на a@b.ru.'])]
+
+def process(docs, index):
+    tp = TextPreprocessor()
+    for doc_id, pars in docs:
+        tp.new_doc(doc_id=doc_id)
+        tp.new_pars(pars, doc_id=doc_id)
+    tp.do_all(index=index, silent=True)
+    return tp
+
+def get_values(index):
+    return list(index.values())
+
+def f ():
+    index = EntityIndex()
+    tp = process(DOCS, index)
+    positions = index.find('EntityPhone', '89991234567')
+    sents = {x[1]['sent_id']: x[0] for x in tp.save()}
+    res = all(
+        sents['{}-p{}-s{}'.format(*x[:3])][int(x[3]) - 1]['MISC']
+             ['EntityPhone'] is not None
+            for x in positions
+    )
+    values = get_values(index)
+    # the document processed again replaces its previous entries
+    tp.do_all(doc_id='d1', index=index, silent=True)
+    return res and [x[0] for x in positions] == ['d1', 'd2'] \
+       and index.find_docs('EntityEmail', 'INFO@example.com') \
+               == {'d1', 'd3'} \
+       and index.docs_all(('EntityEmail', 'a@b.ru'),
+                          ('EntityPhone', '+79991234567')) == {'d2'} \
+       and index.docs_any(('EntityEmail', 'a@b.ru'),
+                          ('EntityPhone', '+79991234567')) \
+               == {'d1', 'd2', 'd3'} \
+       and get_values(index) == values \
+       and ('EntityPhone', '79991234567', 2) in values
+check_res(safe_run(f, 'Testing EntityIndex'))
+
+def f ():
+    index = EntityIndex()
+    process(DOCS, index)
+    index.remove_doc('d2')
+    return index.find_docs('EntityEmail', 'a@b.ru') == {'d3'} \
+       and index.find_docs('EntityPhone', '89991234567') == {'d1'}
+check_res(safe_run(f, 'Testing EntityIndex.remove_doc'))
+
+def f ():
+    index = EntityIndex()
+    process(DOCS, index)
+    values = get_values(index)
+    index1, index2 = EntityIndex(), EntityIndex()
+    process(DOCS[:2], index1)
+    process(DOCS[1:], index2)
+    index1.merge(index2)
+    index3 = EntityIndex()
+    process(DOCS[:2], index3)
+    with EntityIndex(WORK_FNAME) as index4:
+        process(DOCS[1:], index4)
+    index3.merge(WORK_FNAME)
+    os.remove(WORK_FNAME)
+    return all(get_values(x) == values
+           and x.find('EntityEmail', 'a@b.ru')
+                   == index.find('EntityEmail', 'a@b.ru')
+                   for x in [index1, index3])
+check_res(safe_run(f, 'Testing EntityIndex.merge'))
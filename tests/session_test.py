@@ -0,0 +1,51 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+###
+import sys
+sys.path.append('../')
+###
+
+from tests._test_support import WORK_DIR, WORK_FNAME, \
+                                bprint, eprint, safe_run, check_res
+from toxine import TextPreprocessor
+from toxine.session import IncrementalSession
+
+MESSAGES = ['Привет! Как', ' дела?\n', 'Все хорошо, спасибо.', ' А у тебя?\n',
+            'Пиши на a@b.ru\tили звони', ' 8 800 123-45-67\n', 'Пока :)']
+
+tp = TextPreprocessor()
+
+def f ():
+    session = IncrementalSession(tp)
+    sents, res = [], True
+    for msg in MESSAGES:
+        for sent_no, tokens, text in session.append(msg):
+            if tokens is None:
+                del sents[sent_no:]
+            elif sent_no < len(sents):
+                sents[sent_no] = (tokens, text)
+            else:
+                res = res and sent_no == len(sents)
+                sents.append((tokens, text))
+    sents_ = tp.process_text(''.join(MESSAGES), silent=True)
+    return res and sents == sents_ and session.sents == sents_
+check_res(safe_run(f, 'Testing IncrementalSession'))
+
+def f ():
+    session = IncrementalSession(tp)
+    session.append('Привет.\nОк...(')
+    res = session.append(')')
+    sents_ = tp.process_text('Привет.\nОк...()', silent=True)
+    return session.sents == sents_ \
+       and res[-1] == (len(sents_), None, None)
+check_res(safe_run(f, 'Testing IncrementalSession removed sentences'))
+
+def f ():
+    session = IncrementalSession(tp, max_tail=100)
+    text = 'и ' * 100
+    session.append(text)
+    res = session.append(text)
+    return len(session._pending) == 0 and len(session.sents) == 2 \
+       and [x[0] for x in res] == [1]
+check_res(safe_run(f, 'Testing IncrementalSession max_tail'))
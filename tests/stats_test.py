@@ -0,0 +1,52 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import os
+
+###
+import sys
+sys.path.append('../')
+###
+
+from tests._test_support import WORK_DIR, WORK_FNAME, \
+                                bprint, eprint, safe_run, check_res
+from toxine import TextPreprocessor
+from toxine.stats import ProcessingStats
+
+TXT_FNAME = os.path.join(WORK_DIR, 'test.txt')
+
+def process(**kwargs):
+    tp = TextPreprocessor()
+    tp.load_pars(TXT_FNAME, eop=r'\n')
+    tp.do_all(silent=True, **kwargs)
+    return [x[0] for x in tp.save()], next(iter(tp._corpus.values()))
+
+def f ():
+    pars = []
+    stats = ProcessingStats(top_slowest=3, callback=pars.append)
+    sents, doc = process(norm_punct=True, stats=stats)
+    sents_, _ = process(norm_punct=True)
+    res = stats.snapshot()
+    return sents == sents_ and res['pars'] == len(doc['pars']) == len(pars) \
+       and res['sents'] == len(sents) == sum(x['sents'] for x in pars) \
+       and res['tokens'] == sum(x['tokens'] for x in pars) \
+       and res['chars'] == sum(len(x['text']) for x in doc['pars']) \
+       and all(res['matches'][x] == len(doc['tags'].get(y, []))
+                   for x, y in [('emoji', 'EntityEmoji'), ('xml', 'EntityXml'),
+                                ('email', 'EntityEmail'), ('uri', 'EntityUri'),
+                                ('phone', 'EntityPhone'),
+                                ('date', 'EntityDate')]) \
+       and res['calls'].get('wform_isknown', 0) > 0 \
+       and len(res['slowest']) == 3 \
+       and res['slowest'][0]['secs'] >= res['slowest'][-1]['secs'] \
+       and 'word_tokenize' in res['stages']
+check_res(safe_run(f, 'Testing ProcessingStats'))
+
+def f ():
+    stats = ProcessingStats()
+    tp = TextPreprocessor()
+    tp.process_text('Пишите на a@b.ru', stats=stats, silent=True)
+    res = stats.snapshot()['pars'] == 1
+    stats.reset()
+    return res and stats.snapshot()['pars'] == 0
+check_res(safe_run(f, 'Testing ProcessingStats reset'))
@@ -0,0 +1,140 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import os
+
+###
+import sys
+sys.path.append('../')
+###
+
+from corpuscula import Conllu
+from tests._test_support import WORK_DIR, WORK_FNAME, \
+                                bprint, eprint, safe_run, check_res
+from toxine import TextPreprocessor
+from toxine.utils import open_file
+
+tp = TextPreprocessor()
+with open(os.path.join(WORK_DIR, 'test.txt'), 'rt', encoding='utf-8-sig') as f:
+    texts = [x.strip() for x in f if x.strip()]
+
+def f ():
+    process = tp.make_interactive(norm_punct=True)
+    return all(process(x) == tp.process_text(x, norm_punct=True, silent=True)
+                   for x in texts)
+check_res(safe_run(f, 'Testing make_interactive'))
+
+def f ():
+    tp = TextPreprocessor()
+    tp.load_pars(os.path.join(WORK_DIR, 'test.txt'), eop=r'\n')
+    tp.do_all(silent=True)
+    sents = list(tp.save())
+    fname = WORK_FNAME + '.gz'
+    tp.save(fname)
+    tp.save(fname, append=True)
+    with open_file(fname, 'rt') as f:
+        sents_ = list(Conllu.load(f, log_file=None))
+    os.remove(fname)
+    return sents_ == sents + sents
+check_res(safe_run(f, 'Testing save with compression and append'))
+
+def f ():
+    tp = TextPreprocessor()
+    tp.new_par('Пишите на a@b.ru или на http://example.com до 01.02.2020')
+    tp.do_all(silent=True)
+    tp.save(WORK_FNAME)
+    # unmask_tokens() changes the sentences inplace
+    load = lambda: list(Conllu.load(WORK_FNAME, log_file=None))
+    kwargs = {'keep_tags': False,
+              'entity_map': {'EntityEmail': ('NE', 'Email')}}
+    sents, res = load(), list(tp.unmask_tokens(load(), **kwargs))
+    res_ = tp.unmask_tokens(load(), save_to=WORK_FNAME, **kwargs)
+    # the file is written before the result is read
+    res__ = load()
+    res_ = list(res_)
+    fname = WORK_FNAME + '.gz'
+    res___ = list(tp.unmask_tokens(load(), save_to=fname, **kwargs))
+    os.remove(WORK_FNAME)
+    os.remove(fname)
+    forms = [x['FORM'] for x in res[0][0]]
+    return res_ == res and res__ == res and res___ == res \
+       and 'a@b.ru' in forms and 'http://example.com' in forms \
+       and [x['FORM'] for x in sents[0][0]] != forms \
+       and not any('EntityEmail' in x['MISC'] for x in res[0][0]) \
+       and any(x['MISC'].get('NE') == 'Email' for x in res[0][0])
+check_res(safe_run(f, 'Testing unmask_tokens'))
+
+def f ():
+    res = True
+    for text in texts:
+        if '&' in text:  # HTML entities are not unescaped
+            continue
+        entities = tp.extract_entities(text)
+        tags = [(x, y) for sent, _ in tp.process_text(text, silent=True)
+                           for token in sent
+                           for x, y in token['MISC'].items()
+                               if tp.CHAR_DELIM + x in tp.TAG_MASKS
+                              and x != 'EntityUnk']
+        res = res and sorted(x[2:] for x in entities) == sorted(tags) \
+                  and all(text[x[0]:x[1]].strip() for x in entities)
+    text = 'Пишите на a@b.ru или звоните 8 800 123-45-67'
+    return res and tp.extract_entities(text)[0] == (10, 16, 'EntityEmail',
+                                                    'a@b.ru') \
+       and tp.redact(text) == 'Пишите на адрес или звоните номер' \
+       and tp.redact(text, masks={'EntityEmail': '<EMAIL>',
+                                  'EntityPhone': ''}) \
+               == 'Пишите на <EMAIL> или звоните 8 800 123-45-67' \
+       and tp.redact(text, tag_phone=False) \
+               == 'Пишите на адрес или звоните 8 800 123-45-67'
+check_res(safe_run(f, 'Testing extract_entities and redact'))
+
+def f ():
+    res = True
+    for text in texts:
+        sents = tp.segment_text(text, norm_punct=True)
+        sents_ = tp.process_text(text, norm_punct=True, silent=True)
+        ends = [x[1] for x in sents]
+        res = res and len(sents) == len(sents_) and ends == sorted(ends)
+    text = 'Привет! Я живу в г. Москве, пишите на a@b.ru. Пока...'
+    return res and tp.segment_text(text) == [
+        (0, 7, 'Привет!'),
+        (8, 45, 'Я живу в г. Москве, пишите на a@b.ru.'),
+        (46, 53, 'Пока...')
+    ]
+check_res(safe_run(f, 'Testing segment_text'))
+
+def f ():
+    text = 'Привет , мир !\n' \
+           'Пишите на a@b.ru или на http://example.com/x?y=1 .\n' \
+           'Я 01.02.2020 был в г. Москве :)\n' \
+           'Он ( тихо ) сказал [ мне ] .\n'
+    sents = tp.process_text(text, is_tokenized=True, silent=True)
+    sents_ = tp.process_text(text, is_tokenized='fast', silent=True)
+    text = 'Звоните 8 800 123-45-67'
+    return sents_ == sents \
+       and [len(x[0]) for x in sents] == [4, 7, 7, 9] \
+       and not any('EntityEmoji' in x['MISC'] for x in sents[3][0]) \
+       and sents[1][1] == 'Пишите на a@b.ru или на http://example.com/x?y=1.' \
+       and sents[1][0][2]['MISC']['EntityEmail'] == 'a@b.ru' \
+       and len(tp.process_text(text, is_tokenized=True,
+                               silent=True)[0][0]) == 2 \
+       and len(tp.process_text(text, is_tokenized='fast',
+                               silent=True)[0][0]) == 4
+check_res(safe_run(f, "Testing is_tokenized='fast'"))
+
+def f ():
+    res = True
+    for kwargs in [{}, {'norm_punct': True}]:
+        tags, tags_ = {}, {}
+        sents = tp.process_batch(texts, tags=tags, silent=True, **kwargs)
+        sents_ = [tp.process_text(x, tags=tags_, silent=True, **kwargs)
+                      for x in texts]
+        res = res and sents == sents_ and tags == tags_ and bool(tags)
+    # the separator inside of a text turns the batch into per-text calls
+    texts_ = ['a@b.ru', tp.CHAR_SEP + ' c@d.ru']
+    tags, tags_ = {}, {}
+    return res and tp.process_batch(texts_, tags=tags, silent=True) \
+                       == [tp.process_text(x, tags=tags_, silent=True)
+                               for x in texts_] \
+               and tags == tags_
+check_res(safe_run(f, 'Testing process_batch'))
@@ -0,0 +1,195 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+from bz2 import compress
+from html import escape
+import json
+import os
+import shutil
+
+###
+import sys
+sys.path.append('../')
+###
+
+from tests._test_support import WORK_DIR, WORK_FNAME, \
+                                bprint, eprint, safe_run, check_res
+from toxine.utils import open_file
+from toxine.wikipedia_utils import TokenizedWikipedia
+
+WORK_DNAME = WORK_FNAME + '_dir'
+DUMP_FNAME = os.path.join(WORK_DNAME, 'ruwiki-multistream.xml.bz2')
+INDEX_FNAME = os.path.join(WORK_DNAME, 'ruwiki-multistream-index.txt.bz2')
+CONLLU_FNAME = os.path.join(WORK_DNAME, 'wiki.conllu')
+CHECKPOINT_FNAME = os.path.join(WORK_DNAME, 'wiki.json')
+SHARDS_DNAME = os.path.join(WORK_DNAME, 'shards')
+
+HEADER = '''<mediawiki xml:lang="ru">
+  <siteinfo>
+    <namespaces>
+      <namespace key="10" case="first-letter">Шаблон</namespace>
+    </namespaces>
+  </siteinfo>
+'''
+PAGE = '''  <page>
+    <title>{1}</title>
+    <ns>0</ns>
+    <id>{0}</id>
+    <revision>
+      <id>9{0}</id>
+      <text bytes="1" xml:space="preserve">{2}</text>
+    </revision>
+  </page>
+'''
+ARTICLES_PER_STREAM = 2
+
+def make_dump():
+    """Write the multistream dump of the paragraphs of test.txt, 2 per
+    article, and its index"""
+    with open(os.path.join(WORK_DIR, 'test.txt'), 'rt',
+              encoding='utf-8-sig') as f:
+        pars = [x.strip() for x in f if x.strip()]
+    pages = [(str(100 + i), 'Статья {}'.format(i),
+              '\n\n'.join(pars[i * 2:i * 2 + 2]))
+                 for i in range((len(pars) + 1) // 2)]
+    data, index = compress(HEADER.encode('utf-8')), []
+    for i in range(0, len(pages), ARTICLES_PER_STREAM):
+        stream = pages[i:i + ARTICLES_PER_STREAM]
+        offset = len(data)
+        chunk = ''.join(PAGE.format(id_, escape(title, quote=False),
+                                    escape(text, quote=False))
+                            for id_, title, text in stream)
+        if i + ARTICLES_PER_STREAM >= len(pages):
+            chunk += '</mediawiki>\n'
+        data += compress(chunk.encode('utf-8'))
+        index.extend('{}:{}:{}'.format(offset, id_, title)
+                         for id_, title, _ in stream)
+    os.makedirs(WORK_DNAME)
+    with open(DUMP_FNAME, 'wb') as f:
+        f.write(data)
+    with open_file(INDEX_FNAME, 'wt') as f:
+        f.write('\n'.join(index) + '\n')
+    return pages
+
+def read(fname):
+    with open(fname, 'rt', encoding='utf-8') as f:
+        return f.read()
+
+def get_doc_id(sent):
+    return sent[1]['sent_id'].split('-p', 1)[0]
+
+def get_ids(sents):
+    return [x[1]['newdoc id'] for x in sents if 'newdoc id' in x[1]]
+
+if os.path.exists(WORK_DNAME):
+    shutil.rmtree(WORK_DNAME)
+pages = make_dump()
+wiki = TokenizedWikipedia(fpath=DUMP_FNAME, silent=True, index_fpath=False)
+sents = list(wiki.articles())
+
+def f ():
+    sents_ = list(wiki.articles(workers=2, limit=2))
+    return get_ids(sents) == [x[0] for x in pages] \
+       and list(wiki.articles(workers=2, max_pending=1)) == sents \
+       and get_ids(sents_) == get_ids(sents)[:2] \
+       and sents_ == sents[:len(sents_)]
+check_res(safe_run(f, 'Testing TokenizedWikipedia with workers'))
+
+def f ():
+    wiki.save(CONLLU_FNAME)
+    text = read(CONLLU_FNAME)
+    wiki.save(CONLLU_FNAME, limit=2, checkpoint=CHECKPOINT_FNAME)
+    with open(CHECKPOINT_FNAME, 'rt', encoding='utf-8') as f:
+        checkpoint = json.load(f)
+    # the run is interrupted after the checkpoint
+    wiki.save(CONLLU_FNAME, limit=3)
+    with open(CONLLU_FNAME, 'at', encoding='utf-8') as f:
+        f.write('# newdoc id = ')
+    wiki.save(CONLLU_FNAME, checkpoint=CHECKPOINT_FNAME,
+              resume_from=CHECKPOINT_FNAME)
+    with open(CHECKPOINT_FNAME, 'rt', encoding='utf-8') as f:
+        checkpoint_ = json.load(f)
+    return read(CONLLU_FNAME) == text \
+       and checkpoint['articles'] == 2 \
+       and checkpoint['article_id'] == pages[1][0] \
+       and checkpoint_ == {'article_id': pages[-1][0],
+                           'articles': len(pages),
+                           'sentences': len(sents),
+                           'offset': len(text.encode('utf-8'))}
+check_res(safe_run(f, 'Testing TokenizedWikipedia.save with checkpoints'))
+
+def f ():
+    text = read(CONLLU_FNAME)
+    manifest = wiki.save_shards(SHARDS_DNAME, max_articles=3,
+                                compression='gz', workers=2)
+    with open(os.path.join(SHARDS_DNAME, 'manifest.json'), 'rt',
+              encoding='utf-8') as f:
+        manifest_ = json.load(f)
+    texts = []
+    for shard in manifest['shards']:
+        with open_file(os.path.join(SHARDS_DNAME, shard['file']), 'rt') as f:
+            texts.append(f.read())
+    fname = os.path.join(SHARDS_DNAME, manifest['shards'][1]['file'])
+    os.remove(fname)
+    res = wiki.regenerate_shard(SHARDS_DNAME, 1)
+    with open_file(fname, 'rt') as f:
+        text_ = f.read()
+    return manifest_ == manifest and ''.join(texts) == text \
+       and [x['file'] for x in manifest['shards']] \
+               == ['wiki-00000.conllu.gz', 'wiki-00001.conllu.gz',
+                   'wiki-00002.conllu.gz'] \
+       and [x['articles'] for x in manifest['shards']] == [3, 3, 1] \
+       and [x['first_article'] for x in manifest['shards']] == [1, 4, 7] \
+       and [(x['first_id'], x['last_id']) for x in manifest['shards']] \
+               == [(pages[0][0], pages[2][0]), (pages[3][0], pages[5][0]),
+                   (pages[6][0], pages[6][0])] \
+       and manifest['articles'] == len(pages) \
+       and manifest['sentences'] == len(sents) \
+       and res and text_ == texts[1]
+check_res(safe_run(f, 'Testing TokenizedWikipedia.save_shards'))
+
+def f ():
+    text = read(CONLLU_FNAME)
+    wiki_ = TokenizedWikipedia(fpath=DUMP_FNAME, silent=True)
+    # the index is found next to the dump
+    res = wiki_._get_index_fpath() == INDEX_FNAME \
+      and list(wiki_.articles()) == sents \
+      and list(wiki_.articles(workers=2, limit=3)) \
+              == [x for x in sents if get_doc_id(x) in get_ids(sents)[:3]]
+    # the resume locates the last saved article by the index
+    wiki_.save(CONLLU_FNAME, limit=3, checkpoint=CHECKPOINT_FNAME)
+    wiki_.save(CONLLU_FNAME, workers=2, resume_from=CHECKPOINT_FNAME)
+    sents_ = list(wiki_.get_articles(ids=[pages[4][0], pages[0][0]],
+                                     titles=[pages[3][1]], workers=2))
+    return res and read(CONLLU_FNAME) == text \
+       and get_ids(sents_) == [pages[0][0], pages[3][0], pages[4][0]] \
+       and sents_ == [x for x in sents if get_doc_id(x) in get_ids(sents_)]
+check_res(safe_run(f, 'Testing TokenizedWikipedia with multistream index'))
+
+def is_even(id_, title, article):
+    return not int(id_) % 2
+
+def f ():
+    sents_ = list(TokenizedWikipedia(fpath=DUMP_FNAME, silent=True,
+                                     index_fpath=False,
+                                     article_filter=is_even).articles())
+    ids = [TokenizedWikipedia(fpath=DUMP_FNAME, silent=True,
+                              index_fpath=index_fpath, sample_rate=.5)
+               .articles(workers=workers)
+               for index_fpath, workers in [(False, None), (None, 2)]]
+    ids = [get_ids(x) for x in ids]
+    pars = [x[1]['sent_id'].split('-s', 1)[0]
+                for x in TokenizedWikipedia(fpath=DUMP_FNAME, silent=True,
+                                            max_pars=1).articles()]
+    sents__ = list(TokenizedWikipedia(fpath=DUMP_FNAME, silent=True,
+                                      max_sents=1).articles(workers=2))
+    return get_ids(sents_) == [x[0] for x in pages if is_even(*x)] \
+       and sents_ == [x for x in sents if get_doc_id(x) in get_ids(sents_)] \
+       and ids[0] == ids[1] and 0 < len(ids[0]) < len(pages) \
+       and list(TokenizedWikipedia(fpath=DUMP_FNAME, silent=True,
+                                   sample_rate=0).articles()) == [] \
+       and sorted(set(pars)) == [x[0] + '-p1' for x in pages] \
+       and [get_doc_id(x) for x in sents__] == get_ids(sents)
+check_res(safe_run(f, 'Testing TokenizedWikipedia filters'))
+
+shutil.rmtree(WORK_DNAME)
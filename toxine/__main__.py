@@ -0,0 +1,12 @@
+# -*- coding: utf-8 -*-
+# Toxine project: Command-line interface
+#
+# Copyright (C) 2019-present by Sergei Ternovykh
+# License: BSD, see LICENSE for details
+"""
+Entry point for ``python -m toxine``.
+"""
+from toxine.cli import main
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,395 @@
+# -*- coding: utf-8 -*-
+# Toxine project: Binary corpus format
+#
+# Copyright (C) 2019-present by Sergei Ternovykh
+# License: BSD, see LICENSE for details
+"""
+Compact binary format for the corpora in Parsed CoNLL-U format with random
+access to the sentences by their ids.
+
+The strings of the tokens are stored once in the string table, and the
+sentences refer to them by number. The *FEATS* and *MISC* dicts are stored
+in the dict table the same way. Each sentence is a block of its metadata
+followed by the columns of its tokens as arrays of the string (or dict)
+numbers. Each array uses the minimal sufficient width of numbers (1, 2 or 4
+bytes); the columns that are empty in the whole sentence take no space. The
+values of the metadata (e.g., the text of the sentence) are nearly always
+unique, so they are written inline, in the sentence block; only their names
+are placed in the string table. The index of the sentence offsets, the sorted
+index of *sent_id* values and the index of documents are placed at the end of
+the file.
+
+File layout (all the numbers are little-endian):
+
+    MAGIC
+    sentence blocks: number of meta, meta names (string numbers), lengths
+                     of meta values in bytes (0xFFFFFFFF for None), utf-8
+                     meta values, number of columns, number of tokens,
+                     column names, widths of the column arrays (uint8),
+                     column arrays
+    string table: N, offsets[N + 1] (uint64), utf-8 data
+    dict table: N, offsets[N + 1] (uint64), pairs of string numbers
+    sentence index: N, offsets[N] (uint64)
+    sent_id index: N, pairs (string number, sentence number) sorted by
+                   sent_id
+    document index: N, triples (string number, first sentence, number of
+                    sentences)
+    footer: offsets of the 5 tables above (uint64), MAGIC
+"""
+from bisect import bisect_left
+from collections import OrderedDict
+from corpuscula.utils import LOG_FILE, print_progress
+from functools import lru_cache
+import mmap
+import struct
+
+MAGIC = b'TOXINEB1'
+_NONE = 0  # number of None in the string and dict tables
+_NONE_LEN = 0xFFFFFFFF  # length of None meta value
+_DICT_COLUMNS = ('FEATS', 'MISC')
+_FOOTER = struct.Struct('<5Q')
+_WIDTHS = {0: '', 1: 'B', 2: 'H', 4: 'I'}
+
+
+def _get_width(vals):
+    max_val = max(vals) if vals else 0
+    return 0 if max_val == 0 else \
+           1 if max_val < 0x100 else \
+           2 if max_val < 0x10000 else \
+           4
+
+
+def _pack_ints(fmt_char, vals):
+    return struct.pack('<{}{}'.format(len(vals), fmt_char), *vals)
+
+
+def save_binary(corpus, path, log_file=LOG_FILE):
+    """Save the *corpus* in Parsed CoNLL-U format to the binary file. The
+    sentences are written as soon as they are read from the *corpus*, but the
+    tables of unique strings and dicts of the tokens and the indexes are kept
+    in memory until the end. So, the memory grows with the size of the
+    vocabulary (including the unique values of *MISC*, e.g., the entities
+    found) and with the number of sentences (their *sent_id* values are kept
+    for the index). The metadata values are written inline and are not kept.
+
+    :param corpus: corpus in Parsed CoNLL-U format or a path to the CoNLL-U
+                   file
+    :param path: a path to the resulting binary file
+    :param log_file: stream for messages
+    :return: number of sentences saved
+    """
+    if isinstance(corpus, str):
+        from corpuscula import Conllu
+        corpus = Conllu.load(corpus, log_file=log_file)
+
+    strings, dicts = {None: _NONE}, {None: _NONE}
+    sent_offsets, sent_ids, docs = [], [], []
+
+    def get_str(val):
+        idx = strings.get(val)
+        if idx is None:
+            idx = strings[val] = len(strings)
+        return idx
+
+    def get_dict(val):
+        if val is None:
+            return _NONE
+        key = tuple((get_str(x), get_str(y)) for x, y in val.items())
+        idx = dicts.get(key)
+        if idx is None:
+            idx = dicts[key] = len(dicts)
+        return idx
+
+    if log_file:
+        print('Save corpus', file=log_file)
+    with open(path, 'wb') as f:
+        f.write(MAGIC)
+        pos = len(MAGIC)
+        for sent_no, sent in enumerate(corpus):
+            if log_file and not sent_no % 100:
+                print_progress(sent_no, end_value=None, step=1000,
+                               file=log_file)
+            tokens, meta = sent if isinstance(sent, tuple) else \
+                           (sent, OrderedDict())
+            doc_id = meta.get('newdoc id')
+            if doc_id is not None:
+                docs.append([get_str(doc_id), sent_no, 0])
+            if docs:
+                docs[-1][2] += 1
+            sent_id = meta.get('sent_id')
+            if sent_id is not None:
+                sent_ids.append((sent_id, sent_no))
+            columns = list(tokens[0].keys()) if tokens else []
+            meta_vals = [None if x is None else x.encode('utf-8')
+                             for x in meta.values()]
+            data = [_pack_ints('I', [len(meta)]),
+                    _pack_ints('I', [get_str(x) for x in meta]),
+                    _pack_ints('I', [_NONE_LEN if x is None else len(x)
+                                         for x in meta_vals]),
+                    b''.join(x for x in meta_vals if x),
+                    _pack_ints('I', [len(columns), len(tokens)]),
+                    _pack_ints('I', [get_str(x) for x in columns])]
+            widths, arrays = [], []
+            for column in columns:
+                get_val = get_dict if column in _DICT_COLUMNS else get_str
+                vals = [get_val(x.get(column)) for x in tokens]
+                width = _get_width(vals)
+                widths.append(width)
+                if width:
+                    arrays.append(_pack_ints(_WIDTHS[width], vals))
+            data.append(_pack_ints('B', widths))
+            data = b''.join(data + arrays)
+            sent_offsets.append(pos)
+            f.write(data)
+            pos += len(data)
+        sent_cnt = len(sent_offsets)
+        # the index refers to the sent_id values by their string numbers
+        for sent_id, _ in sent_ids:
+            get_str(sent_id)
+
+        offsets = []
+
+        def write_table(items, encode):
+            nonlocal pos
+            offsets.append(pos)
+            data = [encode(x) for x in items]
+            item_offsets, item_pos = [], pos + 8 + 8 * (len(data) + 1)
+            for item in data:
+                item_offsets.append(item_pos)
+                item_pos += len(item)
+            item_offsets.append(item_pos)
+            f.write(_pack_ints('Q', [len(data)]))
+            f.write(_pack_ints('Q', item_offsets))
+            for item in data:
+                f.write(item)
+            pos = item_pos
+
+        strings = sorted(strings.items(), key=lambda x: x[1])
+        write_table((x[0] for x in strings),
+                    lambda x: b'' if x is None else x.encode('utf-8'))
+        str_ids = {x: y for x, y in strings}
+        del strings
+        dicts = sorted(dicts.items(), key=lambda x: x[1])
+        write_table((x[0] for x in dicts),
+                    lambda x: b'' if x is None else
+                              _pack_ints('I', [x for x in x for x in x]))
+        del dicts
+
+        def write_ints(fmt_char, vals, num):
+            nonlocal pos
+            offsets.append(pos)
+            data = _pack_ints('Q', [num]) + _pack_ints(fmt_char, vals)
+            f.write(data)
+            pos += len(data)
+
+        write_ints('Q', sent_offsets, sent_cnt)
+        sent_ids.sort()
+        write_ints('I', [y for x in sent_ids for y in (str_ids[x[0]], x[1])],
+                   len(sent_ids))
+        write_ints('I', [x for x in docs for x in x], len(docs))
+        f.write(_FOOTER.pack(*offsets))
+        f.write(MAGIC)
+
+    if log_file:
+        print_progress(sent_cnt, end_value=0, step=1000, file=log_file)
+        print('Corpus has been saved', file=log_file)
+    return sent_cnt
+
+
+class BinaryConllu:
+    """Reader of the corpus saved by ``save_binary()``. The file is
+    memory-mapped, so only the requested sentences are read and decoded.
+
+    Usage:
+        with BinaryConllu(path) as corpus:
+            sent = corpus.get_sent('doc-p1-s1')
+            doc = list(corpus.get_doc('doc'))
+    """
+
+    def __init__(self, path, cache_size=65536):
+        """
+        :param path: a path to the binary file
+        :param cache_size: number of decoded strings and dicts to keep
+        """
+        self._f = open(path, 'rb')
+        self._mm = mmap.mmap(self._f.fileno(), 0, access=mmap.ACCESS_READ)
+        mm = self._mm
+        len_magic = len(MAGIC)
+        assert mm[:len_magic] == MAGIC and mm[-len_magic:] == MAGIC, \
+            'ERROR: {} is not a binary Toxine corpus'.format(path)
+        (self._str_pos, self._dict_pos, sents_pos, ids_pos,
+         docs_pos) = _FOOTER.unpack_from(mm, len(mm) - len_magic
+                                                     - _FOOTER.size)
+        self._num_sents, = struct.unpack_from('<Q', mm, sents_pos)
+        self._sents_pos = sents_pos + 8
+        self._num_ids, = struct.unpack_from('<Q', mm, ids_pos)
+        self._ids_pos = ids_pos + 8
+        num_docs, = struct.unpack_from('<Q', mm, docs_pos)
+        vals = struct.unpack_from('<{}I'.format(num_docs * 3), mm,
+                                  docs_pos + 8)
+        self._docs = OrderedDict()
+        for i in range(0, len(vals), 3):
+            self._docs[self._get_str_(vals[i])] = (vals[i + 1],
+                                                   vals[i + 2])
+        self._get_str = lru_cache(maxsize=cache_size)(self._get_str_)
+        self._get_dict_items = \
+            lru_cache(maxsize=cache_size)(self._get_dict_items_)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return self._num_sents
+
+    def __iter__(self):
+        return self.get_range()
+
+    def close(self):
+        if self._mm:
+            self._mm.close()
+            self._f.close()
+            self._mm = self._f = None
+
+    def _get_item(self, table_pos, idx):
+        start, end = struct.unpack_from('<2Q', self._mm,
+                                        table_pos + 8 + 8 * idx)
+        return self._mm[start:end]
+
+    def _get_str_(self, idx):
+        return None if idx == _NONE else \
+               self._get_item(self._str_pos, idx).decode('utf-8')
+
+    def _get_dict_items_(self, idx):
+        if idx == _NONE:
+            return None
+        data = self._get_item(self._dict_pos, idx)
+        vals = struct.unpack('<{}I'.format(len(data) // 4), data)
+        get_str = self._get_str
+        return tuple((get_str(vals[i]), get_str(vals[i + 1]))
+                         for i in range(0, len(vals), 2))
+
+    def _read_sent(self, sent_no):
+        mm, get_str = self._mm, self._get_str
+        pos, = struct.unpack_from('<Q', mm, self._sents_pos + 8 * sent_no)
+        num_meta, = struct.unpack_from('<I', mm, pos)
+        pos += 4
+        vals = struct.unpack_from('<{}I'.format(num_meta * 2), mm, pos)
+        pos += 8 * num_meta
+        meta = OrderedDict()
+        for name, len_ in zip(vals[:num_meta], vals[num_meta:]):
+            if len_ == _NONE_LEN:
+                meta[get_str(name)] = None
+            else:
+                meta[get_str(name)] = mm[pos:pos + len_].decode('utf-8')
+                pos += len_
+        num_columns, num_tokens = struct.unpack_from('<2I', mm, pos)
+        pos += 8
+        columns = [get_str(x) for x in struct.unpack_from(
+            '<{}I'.format(num_columns), mm, pos
+        )]
+        pos += 4 * num_columns
+        widths = struct.unpack_from('<{}B'.format(num_columns), mm, pos)
+        pos += num_columns
+        tokens = [{} for _ in range(num_tokens)]
+        for column, width in zip(columns, widths):
+            if width:
+                vals = struct.unpack_from(
+                    '<{}{}'.format(num_tokens, _WIDTHS[width]), mm, pos
+                )
+                pos += width * num_tokens
+            else:
+                vals = (_NONE,) * num_tokens
+            if column in _DICT_COLUMNS:
+                for token, val in zip(tokens, vals):
+                    items = self._get_dict_items(val)
+                    token[column] = None if items is None else \
+                                    OrderedDict(items)
+            else:
+                for token, val in zip(tokens, vals):
+                    token[column] = get_str(val)
+        return tokens, meta
+
+    def _find_sent(self, sent_id):
+        """Return the number of the sentence with the *sent_id* or ``None``
+        """
+        mm, ids_pos = self._mm, self._ids_pos
+        get_str = self._get_str
+
+        class Keys:
+            def __len__(self_):
+                return self._num_ids
+
+            def __getitem__(self_, i):
+                return get_str(struct.unpack_from('<I', mm,
+                                                  ids_pos + 8 * i)[0])
+
+        i = bisect_left(Keys(), sent_id)
+        if i < self._num_ids:
+            idx, sent_no = struct.unpack_from('<2I', mm, ids_pos + 8 * i)
+            if get_str(idx) == sent_id:
+                return sent_no
+        return None
+
+    def sent_ids(self):
+        """Return all the *sent_id* values in the file order.
+
+        :rtype: iter(str)
+        """
+        for tokens, meta in self.get_range():
+            yield meta.get('sent_id')
+
+    def doc_ids(self):
+        """Return the ids of all the documents.
+
+        :rtype: list(str)
+        """
+        return list(self._docs)
+
+    def get_sent(self, sent_id):
+        """Return the sentence with the *sent_id* in Parsed CoNLL-U format or
+        ``None`` if it's absent"""
+        sent_no = self._find_sent(sent_id)
+        return None if sent_no is None else self._read_sent(sent_no)
+
+    def get_doc(self, doc_id):
+        """Return all the sentences of the document with the *doc_id*.
+
+        :rtype: iter(Parsed CoNLL-U)
+        """
+        assert doc_id in self._docs, \
+            'ERROR: document "{}" has not exist'.format(doc_id)
+        start, num = self._docs[doc_id]
+        for sent_no in range(start, start + num):
+            yield self._read_sent(sent_no)
+
+    def get_range(self, start=None, stop=None):
+        """Return the sentences from *start* to *stop* (inclusive) in the file
+        order.
+
+        :param start: *sent_id* or number of the first sentence. If ``None``,
+                      start from the beginning of the file
+        :type start: str|int
+        :param stop: *sent_id* or number of the last sentence. Note, that the
+                     last sentence is included in the result for both types
+                     of *stop* (unlike ``range()``). If ``None``, continue to
+                     the end of the file
+        :type stop: str|int
+        :rtype: iter(Parsed CoNLL-U)
+        """
+        def get_no(sent_id):
+            sent_no = self._find_sent(sent_id)
+            assert sent_no is not None, \
+                'ERROR: sentence "{}" has not exist'.format(sent_id)
+            return sent_no
+
+        start = 0 if start is None else \
+                get_no(start) if isinstance(start, str) else \
+                start
+        stop = self._num_sents if stop is None else \
+               (get_no(stop) if isinstance(stop, str) else
+                min(stop, self._num_sents - 1)) + 1
+        for sent_no in range(start, stop):
+            yield self._read_sent(sent_no)
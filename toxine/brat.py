@@ -6,13 +6,17 @@
 """
 Provides tools for convertation brat text-bound annotations.
 """
+from bisect import bisect_left
+from collections import OrderedDict, namedtuple
 from corpuscula import Conllu
+from corpuscula.utils import LOG_FILE, print_progress
 import glob
 import io
 import os
 import re
 import sys
 from toxine import TextPreprocessor
+from toxine.utils import imap_ordered, open_file
 import warnings
 
 BRAT_TEXT_BOUND_START_MARK, BRAT_TEXT_BOUND_END_MARK = '[{}>>]', '[<<{}]'
@@ -21,10 +25,227 @@ BRAT_TAG = 'brat'
 TAG_NE = 'NE'
 SEP1, SEP2, SEP3 = '!', '/', ':'
 
-RE_BRAT = re.compile((BRAT_TEXT_BOUND_START_MARK.format(r'(\S+?)') + '|'
-                    + BRAT_TEXT_BOUND_END_MARK.format(r'(\S+?)'))
+# the marks contain the ids of the text-bound annotations; the lazy match
+# of the start mark must not swallow the adjacent end mark or a bracket of
+# the text
+RE_BRAT = re.compile((BRAT_TEXT_BOUND_START_MARK.format(r'(T\w+/\S+?)') + '|'
+                    + BRAT_TEXT_BOUND_END_MARK.format(r'(T\w+)'))
                          .replace('[', r'\['))
 
+# the preprocessor and the params of the worker of brat_dir_to_conllu()
+_tp = None
+_params = None
+
+BratAnnotation = namedtuple('BratAnnotation', ['type', 'id', 'name', 'spans',
+                                               'refs', 'value', 'text',
+                                               'line_no'])
+BratAnnotation.__doc__ = """One annotation of the brat ann file.
+
+*type* is "T", "R", "*", "E", "A" (also for "M"), "N" or "#"; *id* is the id
+of the annotation (equivalences that have no ids are numbered as "*1",
+"*2", etc.); *spans* are the (start, end) offsets of the text-bound
+annotation; *refs* are the (role, id) pairs of the annotations referred to
+(the role of the event trigger and of the single argument of attributes,
+normalizations and notes is ``''``); *value* is the value of the attribute
+or the "service:id" reference of the normalization; *text* is the text of
+the text-bound annotation, the title of the normalization or the note."""
+
+
+class BratDocument:
+    """Annotations of the brat ann file. The file is parsed in one pass;
+    the annotations are indexed by ids, by the annotations they refer to and
+    by the text spans.
+
+    Usage:
+        doc = BratDocument(ann_fn)
+        entity = doc['T1']
+        attrs = [ann for ann, _ in doc.referrers('T1') if ann.type == 'A']
+        entities = doc.find(start, end)
+    """
+
+    def __init__(self, ann_fn=None):
+        """
+        :param ann_fn: a path to the brat ann file. If ``None``, the document
+                       is empty
+        """
+        self._anns = OrderedDict()
+        self._referrers = {}
+        self._spans = None
+        if ann_fn:
+            with open(ann_fn, 'rt', encoding='utf-8') as f:
+                self._parse(f)
+
+    def _parse(self, lines):
+        """Read the annotations from the lines of the ann file and check that
+        all the references are valid"""
+        anns, qid = self._anns, 0
+        for line_no, line in enumerate(lines, start=1):
+            line = line.rstrip('\r\n')
+            if not line.strip():
+                continue
+            ann = self._parse_line(line, line_no)
+            if ann is None:
+                raise ValueError('ERROR: Invalid annotation '
+                                 'in line {}:\n{})'.format(line_no, line))
+            if ann.type == '*':
+                qid += 1
+                ann = ann._replace(id='*' + str(qid))
+            elif ann.id in anns:
+                raise ValueError('ERROR: Invalid annotation '
+                                 'in line {}:\n{})'.format(line_no, line))
+            anns[ann.id] = ann
+        referrers = self._referrers
+        for ann in anns.values():
+            for role, ref_id in ann.refs:
+                if ref_id not in anns:
+                    raise ValueError('ERROR: Unknown annotation id ({}) '
+                                     'in line {}'.format(ref_id, ann.line_no))
+                referrers.setdefault(ref_id, []).append((ann.id, role))
+
+    @staticmethod
+    def _parse_line(line, line_no):
+        """Parse one line of the ann file. Returns ``None`` if the line is
+        invalid"""
+        def parse_arg(arg):
+            arg = tuple(arg.split(':'))
+            return arg if len(arg) == 2 and all(arg) else None
+
+        cols = line.split('\t')
+        ann_type, ann_id = line[0], cols[0]
+        if ann_type == 'M':
+            ann_type = 'A'
+        if ann_type in 'TN#':
+            if len(cols) != 3:
+                return None
+            ann_id, args, text = cols
+        elif ann_type in 'R*EA':
+            if len(cols) != 2:
+                return None
+            ann_id, args = cols
+            text = None
+        else:
+            return None
+        args = args.split()
+        if not args or (ann_type == '*') != (ann_id == '*'):
+            return None
+        name, spans, refs, value = args[0], (), (), None
+
+        if ann_type == 'T':
+            try:
+                spans = tuple(tuple(int(x) for x in span.split())
+                                  for span in ' '.join(args[1:]).split(';'))
+            except ValueError:
+                return None
+            if not all(len(x) == 2 and x[0] <= x[1] for x in spans):
+                return None
+        elif ann_type == 'R':
+            refs = tuple(map(parse_arg, args[1:]))
+            if len(refs) != 2:
+                return None
+        elif ann_type == '*':
+            refs = tuple(('', x) for x in args[1:])
+        elif ann_type == 'E':
+            refs = tuple(map(parse_arg, args))
+            if refs[0]:
+                name, trigger = refs[0]
+                refs = (('', trigger),) + refs[1:]
+        elif ann_type == 'A':
+            if len(args) not in [2, 3]:
+                return None
+            refs, value = (('', args[1]),), (args[2:] or [''])[0]
+        elif ann_type == 'N':
+            if len(args) != 3 or name != 'Reference' \
+                                or not parse_arg(args[2]):
+                return None
+            refs, value = (('', args[1]),), args[2]
+        elif ann_type == '#':
+            if len(args) != 2 or name != 'AnnotatorNotes':
+                return None
+            refs = (('', args[1]),)
+        if not all(refs):
+            return None
+        return BratAnnotation(ann_type, ann_id, name, spans, refs, value,
+                              text, line_no)
+
+    @staticmethod
+    def format_ann(ann):
+        """Return the line of the ann file for the *ann*
+        (``BratAnnotation``)"""
+        ann_id = '*' if ann.type == '*' else ann.id
+        if ann.type == 'T':
+            args = [ann.name + ' ' + ';'.join('{} {}'.format(*x)
+                                                  for x in ann.spans)]
+        elif ann.type == 'E':
+            args = [ann.name + ':' + ann.refs[0][1]] \
+                 + [':'.join(x) for x in ann.refs[1:]]
+        elif ann.type == 'R':
+            args = [ann.name] + [':'.join(x) for x in ann.refs]
+        else:
+            args = [ann.name] + [x[1] for x in ann.refs]
+            if ann.value:
+                args.append(ann.value)
+        cols = [ann_id, ' '.join(args)]
+        if ann.text is not None:
+            cols.append(ann.text)
+        return '\t'.join(cols)
+
+    def __len__(self):
+        return len(self._anns)
+
+    def __iter__(self):
+        """Iterate over the annotations in the order of the ann file"""
+        return iter(self._anns.values())
+
+    def __contains__(self, ann_id):
+        return ann_id in self._anns
+
+    def __getitem__(self, ann_id):
+        return self._anns[ann_id]
+
+    def get(self, ann_id, default=None):
+        return self._anns.get(ann_id, default)
+
+    def referrers(self, ann_id):
+        """Return the annotations that refer to the annotation *ann_id* in
+        the order of the ann file.
+
+        :rtype: list(tuple(BratAnnotation, str)): the annotation and the role
+                of the *ann_id* in it
+        """
+        return [(self._anns[x], role)
+                    for x, role in self._referrers.get(ann_id, [])]
+
+    def entities(self):
+        """Return the text-bound annotations in the order of the ann file"""
+        return [x for x in self._anns.values() if x.type == 'T']
+
+    def find(self, start, end=None):
+        """Return the text-bound annotations that have spans overlapping the
+        [*start*, *end*) range or, if *end* is ``None``, containing the
+        *start* position. The spans are found by binary search; only the ones
+        that start no farther than the longest span before *start* are
+        checked.
+
+        :rtype: list(BratAnnotation)
+        """
+        if self._spans is None:
+            spans = sorted((x, y, ann.id) for ann in self._anns.values()
+                                          for x, y in ann.spans)
+            self._spans = spans, [x[0] for x in spans], \
+                          max([y - x for x, y, _ in spans] or [0])
+        spans, starts, max_len = self._spans
+        if end is None:
+            end = start + 1
+        res, seen = [], set()
+        # no span that starts earlier can reach the *start*
+        for i in range(bisect_left(starts, start - max_len),
+                       bisect_left(starts, end)):
+            x, y, ann_id = spans[i]
+            if y > start and ann_id not in seen:
+                seen.add(ann_id)
+                res.append(self._anns[ann_id])
+        return res
+
 
 def embed_brat_annotations(txt_fn, ann_fn, save_to=None, keep_tokens='smart'):
     """Converts txt and ann files generated by brat to the text file with
@@ -41,176 +262,55 @@ def embed_brat_annotations(txt_fn, ann_fn, save_to=None, keep_tokens='smart'):
                         may be splitted. ``'smart'`` (default) means split
                         tokens only if they really should be splitted.
     """
-    def process_entity(text):
-        text = text.split('\t')
-        assert len(text) == 3
-        tid, ann, _ = text
-        ann = ann.split(' ', maxsplit=1)
-        assert len(ann) == 2
-        name, offs = ann
-        offs = offs.split(';')
-        offsets = []
-        for off in offs:
-            off = tuple(off.split())  # (start, stop)
-            assert len(off) == 2
-            offsets.append(off)
-        return ('T', tid, name, *offsets)
-
-    def process_relation(text):
-        text = text.split('\t')
-        assert len(text) == 2
-        rid, ann = text
-        ann = ann.split()
-        assert len(ann) == 3
-        name, args = ann[0], ann[1:]
-        arguments = []
-        for arg in args:
-            arg = tuple(arg.split(':'))  # (role, tid)
-            assert len(arg) == 2
-            arguments.append(arg)
-        return ('R', rid, name, *arguments)
-
-    def process_equivalence(text):
-        text = text.split('\t')
-        assert len(text) == 2 and text[0] == '*'
-        return ('*', '*', *text[1].split())  # (name, tid, ...)
-
-    def process_event(text):
-        text = text.split('\t')
-        assert len(text) == 2
-        eid, ann = text
-        ann = ann.split()
-        assert len(ann) >= 2
-        arguments = []
-        for arg in ann:
-            arg = tuple(arg.split(':'))  # (name, tid) | (role, tid)
-            assert len(arg) == 2
-            arguments.append(arg)
-        return ('E', eid, *arguments)
-
-    def process_attribute(text):
-        text = text.split('\t')
-        assert len(text) == 2
-        aid, ann = text
-        ann = ann.split() + ['']  # [name, tid, value]
-        assert len(ann) in [3, 4]
-        return ('A', aid, *ann[:3])
-
-    def process_normalization(text):
-        text = text.split('\t')
-        assert len(text) == 3
-        nid, ann, title = text
-        ann = ann.split()
-        assert len(ann) == 3
-        name, tid, src = ann
-        assert name == 'Reference'
-        src = src.split(':')  # [service_name, service_id]
-        assert len(src) == 2
-        return ('N', nid, title, tid, *src)
-
-    def process_note(text):
-        text = text.split('\t')
-        assert len(text) == 3
-        nid, ann, note = text
-        ann = ann.split()
-        assert len(ann) == 2
-        name, tid = ann
-        assert name == 'AnnotatorNotes'
-        return '#', nid, note, tid
-
     def process():
-        anns = {}
-        with open(ann_fn, 'rt', encoding='utf=8') as f:
-            qid = 1
-            for line_no, line in enumerate(f, start=1):
-                line = line.strip()
-                try:
-                    res = process_entity(line) \
-                              if line.startswith('T') else \
-                          process_relation(line) \
-                              if line.startswith('R') else \
-                          process_equivalence(line) \
-                              if line.startswith('*') else \
-                          process_event(line) \
-                              if line.startswith('E') else \
-                          process_attribute(line) \
-                              if line.startswith('A') \
-                              or line.startswith('M') else \
-                          process_normalization(line) \
-                              if line.startswith('N') else \
-                          process_note(line) \
-                              if line.startswith('#') else \
-                          None
-                    assert res
-                    ann_type, ann_id = res[:2]
-                    anns_t = anns.setdefault(ann_type, {})
-                    if ann_type == '*':
-                        ann_id = ann_id + str(qid)
-                        qid += 1
-                    assert ann_id not in anns_t
-                    anns_t[ann_id] = res[2:] + (line_no,)
-                except AssertionError:
-                    raise ValueError('ERROR: Invalid annotation '
-                                     'in line {}:\n{})'.format(line_no, line))
-
+        doc = BratDocument(ann_fn)
         entities = []
-        relations, equivalences, events, attributes, normalizations, notes = \
-            {}, {}, {}, {}, {}, {}
-        for ann_type, ann in anns.items():
-            for ann_id, entity in ann.items():
-                name, line_no = entity[0], entity[-1]
-
-                def check_availability(ann_id):
-                    for _, ann in anns.items():
-                        if ann_id in ann:
-                            break
-                    else:
-                        raise ValueError('ERROR: Unknown annotation id ({}) '
-                                         'in line {}'.format(ann_id, line_no))
-
-                if ann_type == 'T':
-                    for start, end in entity[1:-1]:
-                        try:
-                            start, end = int(start), int(end)
-                        except ValueError:
-                            raise ValueError('ERROR: Invalid offset in line '
-                                             '{}'.format(line_no))
-                        entities.append((start, -end, line_no, name, ann_id))
-                        entities.append((end, -start, -line_no, name, ann_id))
-                elif ann_type == 'R':
-                    for role, tid in entity[1:-1]:
-                        check_availability(tid)
-                        anns_t = relations.setdefault(tid, [])
-                        anns_t.append((ann_id, name, role))
-                elif ann_type == '*':
-                    for tid in entity[1:-1]:
-                        check_availability(tid)
-                        anns_t = equivalences.setdefault(tid, [])
-                        anns_t.append((ann_id, name))
-                elif ann_type == 'E':
-                    name, tid = name
-                    for role, tid in (('', tid),) + entity[1:-1]:
-                        check_availability(tid)
-                        anns_t = events.setdefault(tid, [])
-                        anns_t.append((ann_id, name, role))
-                elif ann_type == 'A':
-                    tid, value = entity[1:-1]
-                    check_availability(tid)
-                    anns_t = attributes.setdefault(tid, [])
-                    anns_t.append((ann_id, name, value))
-                elif ann_type == 'N':
-                    tid, service_name, service_id = entity[1:-1]
-                    check_availability(tid)
-                    anns_t = normalizations.setdefault(tid, [])
-                    anns_t.append((ann_id, service_name, service_id, name))
-                elif ann_type == '#':
-                    tid, = entity[1:-1]
-                    check_availability(tid)
-                    anns_t = notes.setdefault(tid, [])
-                    anns_t.append((ann_id, name))
+        for ann in doc.entities():
+            for start, end in ann.spans:
+                entities.append((start, -end, ann.line_no, ann.name, ann.id))
+                entities.append((end, -start, -ann.line_no, ann.name, ann.id))
         entities.sort()
 
-        done_len = 0
+        def mask(text):
+            return text.replace(BRAT_TEXT_BOUND_START_MARK[-1],
+                                r'\{}'.format(BRAT_TEXT_BOUND_START_MARK[-1])) \
+                       .replace(SEP1, r'\{}'.format(SEP1)) \
+                       .replace('_', r'\_').replace(' ', '__')
+
+        def get_payload(ann, role):
+            fields = (ann.id, ann.name, role) if ann.type in 'RE' else \
+                     (ann.id, ann.name) if ann.type == '*' else \
+                     (ann.id, ann.name, ann.value) if ann.type == 'A' else \
+                     (ann.id,) + tuple(ann.value.split(':')) \
+                   + (mask(ann.text),) if ann.type == 'N' else \
+                     (ann.id, mask(ann.text))
+            return SEP1 + SEP2.join(fields) + SEP1
+
+        # the payload of the start mark is the same for all the fragments of
+        # the entity, so we make it once
+        payloads = {}
+        for entity in doc.entities():
+            referrers = doc.referrers(entity.id)
+            ann_text = ''.join(get_payload(ann, role)
+                                   for ann_type in 'R*EAN#'
+                                   for ann, role in referrers
+                                       if ann.type == ann_type)
+            payloads[entity.id] = BRAT_TEXT_BOUND_START_MARK.format(
+                entity.id + SEP2 + entity.name
+              + (SEP1 + ann_text[:-1] if ann_text else '')
+            )
+
+        def is_same_type(ne_type, c):
+            return (ne_type == 2 and c.isalpha()) \
+                or (ne_type == 1 and c.isdigit()) if keep_tokens == 'smart' else \
+                   ne_type and not c.isspace()
+
+        def get_type(c):
+            return (2 if c.isalpha() else 1 if c.isdigit() else 0) \
+                       if keep_tokens == 'smart' else \
+                   (0 if c.isspace() else 1)
+
+        line_start = 0
         ientities = iter(entities)
         entity = next(ientities, None)
         with io.open(txt_fn, 'rt', encoding='utf-8', newline='') as f_in:
@@ -218,115 +318,37 @@ def embed_brat_annotations(txt_fn, ann_fn, save_to=None, keep_tokens='smart'):
             for line in f_in:
                 if line[-1] != '\n':
                     line += '\n'
-                line_ = ''
-                while entity and entity[0] < done_len + len(line):
+                line_len = len(line)
+                # the output line is made of the pieces of the source line
+                # and the marks; *done* is the end of the part already moved
+                # to the pieces
+                pieces, done = [], 0
+                while entity and entity[0] < line_start + line_len:
                     pos, _, start_flag, name, tid = entity
-                    ann_text = '{}{}{}'.format(tid, SEP2, name)
-                    pos_ = pos - done_len
-
-                    if keep_tokens == 'smart':
-                        if pos_ > 0:
-                            if start_flag > 0:
-                                ne_chr = line[pos_]
-                                ne_type = 2 if ne_chr.isalpha() else \
-                                          1 if ne_chr.isdigit() else \
-                                          0
-                                while pos_ > 0:
-                                    if (ne_type == 2 and line[pos_ - 1]
-                                                             .isalpha()) \
-                                    or (ne_type == 1 and line[pos_ - 1]
-                                                             .isdigit()):
-                                        pos_ -= 1
-                                    else:
-                                        break
-                            else:
-                                ne_chr = line[pos_ - 1]
-                                ne_type = 2 if ne_chr.isalpha() else \
-                                          1 if ne_chr.isdigit() else \
-                                          0
-                                line_len = len(line)
-                                while pos_ < line_len:
-                                    if (ne_type == 2 and line[pos_]
-                                                             .isalpha()) \
-                                    or (ne_type == 1 and line[pos_]
-                                                             .isdigit()):
-                                        pos_ += 1
-                                    else:
-                                        break
-                    elif keep_tokens:
-                        if pos_ > 0:
-                            if start_flag > 0:
-                                ne_chr = line[pos_]
-                                ne_type = 0 if ne_chr.isspace() else \
-                                          1
-                                while pos_ > 0:
-                                    if ne_type and not line[pos_ - 1] \
-                                                           .isspace():
-                                        pos_ -= 1
-                                    else:
-                                        break
-                            else:
-                                ne_chr = line[pos_ - 1]
-                                ne_type = 0 if ne_chr.isspace() else \
-                                          1
-                                line_len = len(line)
-                                while pos_ < line_len:
-                                    if ne_type and not line[pos_].isspace():
-                                        pos_ += 1
-                                    else:
-                                        break
-
-                    line_ += line[:pos_]
-                    line = line[pos_:]
-                    done_len += pos_
-
-                    if start_flag > 0:
-                        mark = BRAT_TEXT_BOUND_START_MARK
-
-                        def mask(text):
-                            return text.replace(mark[-1],
-                                                r'\{}'.format(mark[-1])) \
-                                       .replace(SEP1, r'\{}'.format(SEP1)) \
-                                       .replace('_', r'\_').replace(' ', '__')
-
-                        ann_text_ = ''
-                        for ann_id, name, role in relations.get(tid, []):
-                            ann_text_ += '{}{}{}{}{}{}{}'.format(
-                               SEP1, ann_id, SEP2, name, SEP2, role, SEP1
-                            )
-                        for ann_id, name in equivalences.get(tid, []):
-                            ann_text_ += '{}{}{}{}{}'.format(
-                                SEP1, ann_id, SEP2, name, SEP1
-                            )
-                        for ann_id, name, role in events.get(tid, []):
-                            ann_text_ += '{}{}{}{}{}{}{}'.format(
-                                SEP1, ann_id, SEP2, name, SEP2, role, SEP1
-                            )
-                        for ann_id, name, value in attributes.get(tid, []):
-                            ann_text_ += '{}{}{}{}{}{}{}'.format(
-                                SEP1, ann_id, SEP2, name, SEP2, value, SEP1
-                            )
-                        for ann_id, service_name, service_id, title in \
-                            normalizations.get(tid, []):
-                            ann_text_ += '{}{}{}{}{}{}{}{}{}'.format(
-                                SEP1, ann_id, SEP2, service_name,
-                                SEP2, service_id, SEP2, mask(title), SEP1)
-                        for ann_id, name in notes.get(tid, []):
-                            ann_text_ += '{}{}{}{}{}'.format(
-                                SEP1, ann_id, SEP2, mask(name), SEP1
-                            )
-                        if ann_text_:
-                            ann_text += SEP1 + ann_text_[:-1]
-                    else:
-                        mark = BRAT_TEXT_BOUND_END_MARK
-                        ann_text = tid
-                    sp = ('', '')
-                    #sp = ('' if not line_ or line_[-1].isspace() else ' ',
-                    #      '' if line[0].isspace() else ' ')
-                    line_ += sp[0] + mark.format(ann_text) + sp[1]
+                    # the marks can't be placed before the text that is
+                    # already emitted
+                    pos = max(pos - line_start, done)
+
+                    if keep_tokens and pos > done:
+                        if start_flag > 0:
+                            ne_type = get_type(line[pos])
+                            while pos > done \
+                              and is_same_type(ne_type, line[pos - 1]):
+                                pos -= 1
+                        else:
+                            ne_type = get_type(line[pos - 1])
+                            while pos < line_len \
+                              and is_same_type(ne_type, line[pos]):
+                                pos += 1
+
+                    pieces.append(line[done:pos])
+                    done = pos
+                    pieces.append(payloads[tid] if start_flag > 0 else
+                                  BRAT_TEXT_BOUND_END_MARK.format(tid))
                     entity = next(ientities, None)
-                yield line_ + line.rstrip()
-                done_len += len(line)
+                pieces.append(line[done:].rstrip())
+                yield ''.join(pieces)
+                line_start += line_len
 
     res = process()
     if save_to:
@@ -346,14 +368,54 @@ def postprocess_brat_conllu(corpus, save_to=None):
                     the function returns the result as a generator of Parsed
                     CoNLL-U data.
     """
-    def process():
+    def unmask(text):
+        return text.replace(r'\{}'.format(BRAT_TEXT_BOUND_START_MARK[-1]),
+                            BRAT_TEXT_BOUND_START_MARK[-1]) \
+                   .replace(r'\{}'.format(SEP1), SEP1) \
+                   .replace('__', ' ').replace(r'\_', '_')
 
-        def unmask(text):
-            return text.replace(r'\{}'.format(BRAT_TEXT_BOUND_START_MARK[-1]),
-                                BRAT_TEXT_BOUND_START_MARK[-1]) \
-                       .replace(r'\{}'.format(SEP1), SEP1) \
-                       .replace('__', ' ').replace(r'\_', '_')
+    def parse_payload(payload):
+        """Convert the payload of the start mark to the MISC fields"""
+        ann = payload.split(SEP1 + SEP1)
+        entity, ann_ = ann[0], ann[1:]
+        tid, name = entity.split(SEP2)
+        assert tid.startswith('T'), \
+            'ERROR: Unrecognized annotation {}'.format(ann)
+        res = [(BRAT_TAG + tid, name)]
+        for ann in ann_:
+            if ann.startswith('R'):
+                ann_id, name, role = ann.split(SEP2)
+                val = tid + SEP3 + name + SEP3 + role
+            elif ann.startswith('*'):
+                ann_id, name = ann.split(SEP2)
+                val = tid + SEP3 + name
+            elif ann.startswith('E'):
+                ann_id, name, role = ann.split(SEP2)
+                val = tid + SEP3 + name
+                if role:
+                    val += SEP3 + role
+            elif ann.startswith('A') or ann.startswith('M'):
+                ann_id, name, value = ann.split(SEP2)
+                val = tid + SEP3 + name
+                if value:
+                    val += SEP3 + value
+            elif ann.startswith('N'):
+                ann_id, service_name, service_id, title = \
+                    ann.split(SEP2, maxsplit=3)
+                val = tid + SEP3 + service_name + SEP3 + service_id \
+                    + SEP3 + unmask(title)
+            elif ann.startswith('#'):
+                ann_id, note = ann.split(SEP2, maxsplit=1)
+                val = tid + SEP3 + unmask(note)
+            else:
+                raise ValueError('ERROR: Unknown annotation type')
+            res.append((BRAT_TAG + ann_id, val))
+        return res
 
+    def process():
+        # the payload of the entity is the same for all its tokens, so we
+        # parse it once
+        payloads = {}
         for sent, meta in Conllu.load(corpus) \
                               if isinstance(corpus, str) else \
                           corpus:
@@ -366,69 +428,26 @@ def postprocess_brat_conllu(corpus, save_to=None):
                 misc = token['MISC']
                 if token['FORM'] is None:
                     if BRAT_START_TAG in misc:
-                        assert BRAT_START_TAG not in anns
-                        assert misc[BRAT_START_TAG][0] == 'T', \
+                        payload = misc[BRAT_START_TAG]
+                        assert payload[0] == 'T', \
                             'ERROR: Invalid annotation type "{}"' \
-                                .format(misc[BRAT_START_TAG])
-                        anns.append(misc[BRAT_START_TAG])
+                                .format(payload)
+                        fields = payloads.get(payload)
+                        if fields is None:
+                            fields = payloads[payload] = \
+                                parse_payload(payload)
+                        anns.append((payload.split(SEP2, 1)[0], fields))
                     elif BRAT_END_TAG in misc:
-                        anns_ = []
-                        for ann in anns:
-                            prefix = misc[BRAT_END_TAG] + SEP2
-                            anns = list(filter(
-                                lambda x: not x.startswith(prefix), anns
-                            ))
-                        try:
-                            tags.remove(misc[BRAT_END_TAG])
-                        except:
-                            pass
+                        tid = misc[BRAT_END_TAG]
+                        anns = [x for x in anns if x[0] != tid]
                         if sent_ and 'SpaceAfter' in misc:
                             sent_[-1]['MISC']['SpaceAfter'] = \
                                 misc['SpaceAfter']
                     else:
                         sent_.append(token)
                 else:
-                    for ann in anns:
-                        ann = ann.split(SEP1 + SEP1)
-                        entity, ann_ = ann[0], ann[1:]
-                        tid, name = entity.split(SEP2)
-                        assert tid.startswith('T'), \
-                            'ERROR: Unrecognized annotation {}'.format(ann)
-                        misc[BRAT_TAG + tid] = name
-                        for ann in ann_:
-                            if ann.startswith('R'):
-                                ann_id, name, role = ann.split(SEP2)
-                                misc[BRAT_TAG + ann_id] = \
-                                    tid + SEP3 + name + SEP3 + role
-                            elif ann.startswith('*'):
-                                ann_id, name = ann.split(SEP2)
-                                misc[BRAT_TAG + ann_id] = tid + SEP3 + name
-                            elif ann.startswith('E'):
-                                ann_id, name, role = ann.split(SEP2)
-                                val = tid + SEP3 + name
-                                if role:
-                                    val += SEP3 + role
-                                misc[BRAT_TAG + ann_id] = val
-                            elif ann.startswith('A'):
-                                ann_id, name, value = ann.split(SEP2)
-                                val = tid + SEP3 + name
-                                if value:
-                                    val += SEP3 + value
-                                misc[BRAT_TAG + ann_id] = val
-                            elif ann.startswith('N'):
-                                ann_id, service_name, service_id, title = \
-                                    ann.split(SEP2, maxsplit=3)
-                                misc[BRAT_TAG + ann_id] = \
-                                    tid + SEP3 + service_name \
-                                  + SEP3 + service_id + SEP3 + unmask(title)
-                            elif ann.startswith('#'):
-                                ann_id, note = ann.split(SEP2, maxsplit=1)
-                                misc[BRAT_TAG + ann_id] = \
-                                    tid + SEP3 + unmask(note)
-                            else:
-                                raise ValueError('ERROR: Unknown annotation '
-                                                 'type')
-                        #misc[BRAT_TAG + ann] = 'Yes'
+                    for _, fields in anns:
+                        misc.update(fields)
                     sent_.append(token)
             yield sent_, meta
 
@@ -489,9 +508,204 @@ def make_ne_tags(corpus, save_to=None, keep_originals=True):
     else:
         return res
 
+def _get_brat_fields(doc, entity):
+    """Return the MISC fields that keep the text-bound annotation *entity*
+    and the annotations of the *doc* (``BratDocument``) that refer to it.
+    The fields are the same as ``postprocess_brat_conllu()`` makes
+
+    :rtype: list(tuple(str, str))
+    """
+    tid = entity.id
+    res = [(BRAT_TAG + tid, entity.name)]
+    referrers = doc.referrers(tid)
+    for ann_type in 'R*EAN#':
+        for ann, role in referrers:
+            if ann.type != ann_type:
+                continue
+            val = tid + SEP3 + ann.name if ann_type in 'R*EA' else tid
+            if ann_type == 'R' or (ann_type == 'E' and role):
+                val += SEP3 + role
+            elif ann_type == 'A' and ann.value:
+                val += SEP3 + ann.value
+            elif ann_type == 'N':
+                val += SEP3 + ann.value + SEP3 + ann.text
+            elif ann_type == '#':
+                val += SEP3 + ann.text
+            res.append((BRAT_TAG + ann.id, val))
+    return res
+
+def _locate_tokens(text, wforms):
+    """Find the offsets of the *wforms* (the original forms of the tokens)
+    in the *text*. The forms are searched successively; the ones changed by
+    the normalization get the part of the text between the found neighbours
+
+    :rtype: list(tuple(int, int))
+    """
+    res, pos = [], 0
+    for wform in wforms:
+        # the gap limit saves from jumping to the far repeat of the form if
+        # the previous ones are not found
+        i = text.find(wform, pos, pos + len(wform) + 64) if wform else -1
+        # the punctuation may be changed by the normalization, so it's not
+        # searched beyond the next word
+        if i > pos and not re.search(r'\w', wform) \
+                   and re.search(r'\w', text[pos:i]):
+            i = -1
+        if i >= 0:
+            pos = i + len(wform)
+            res.append((i, pos))
+        else:
+            res.append(None)
+    i, prev_end = 0, 0
+    while i < len(res):
+        if res[i]:
+            prev_end = res[i][1]
+            i += 1
+            continue
+        j = i + 1
+        while j < len(res) and not res[j]:
+            j += 1
+        end = res[j][0] if j < len(res) else len(text)
+        # if the number of the words in the gap is the same as the number of
+        # the tokens, each token gets its word; elsewise, all the tokens get
+        # the whole gap
+        words = [(x.start(), x.end())
+                     for x in re.finditer(r'\S+', text[prev_end:end])]
+        if len(words) == j - i:
+            res[i:j] = [(prev_end + x, prev_end + y) for x, y in words]
+        else:
+            res[i:j] = [(prev_end + words[0][0], prev_end + words[-1][1])
+                            if words else
+                        (prev_end, prev_end)] * (j - i)
+        i = j
+    return res
+
+def _brat_to_conllu_by_offsets(tp, txt_fn, ann_fn, **kwargs):
+    """Process the brat txt file with the *tp* (``TextPreprocessor``) and
+    project the annotations of the *ann_fn* file onto the tokens by their
+    offsets in the text (see ``brat_to_conllu()``)
+
+    :return: Parsed CoNLL-U data
+    """
+    doc = BratDocument(ann_fn)
+    line_starts, line_start = {}, 0
+    with io.open(txt_fn, 'rt', encoding='utf-8', newline='') as f:
+        for line in f:
+            # the same as embed_brat_annotations() makes: each line is a
+            # separate document
+            doc_id = tp.new_doc()
+            tp.new_par(line.rstrip(), doc_id=doc_id)
+            line_starts[doc_id] = line_start
+            line_start += len(line)
+    tp.do_all(**kwargs)
+    tag_names = set(x[len(tp.CHAR_DELIM):] for x in tp.TAG_MASKS)
+    tag_names.add(tp.TAG_SHORTCUT[len(tp.CHAR_DELIM) * 2:])
+
+    def annotate(sents, text, line_start):
+        # the multiword tokens are skipped, but the empty ones (e.g., emoji)
+        # are located, too
+        tokens = [x for sent, _ in sents for x in sent if '-' not in x['ID']]
+        # the tagged tokens keep their original forms in MISC
+        spans = _locate_tokens(text, [
+            next((y for x, y in token['MISC'].items() if x in tag_names),
+                 token['FORM'])
+                for token in tokens
+        ])
+        for token, (start, end) in zip(tokens, spans):
+            if token['FORM'] is None or end <= start:
+                continue
+            start, end = line_start + start, line_start + end
+            anns = []
+            for ann in doc.find(start, end):
+                span = min((x, -y) for x, y in ann.spans
+                                       if x < end and y > start)
+                anns.append((span, ann.line_no, ann))
+            for _, _, ann in sorted(anns, key=lambda x: x[:2]):
+                fields_ = fields.get(ann.id)
+                if fields_ is None:
+                    fields_ = fields[ann.id] = _get_brat_fields(doc, ann)
+                token['MISC'].update(fields_)
+        return sents
+
+    def process():
+        # the tokens are located in the whole paragraph, so its sentences
+        # are collected first
+        sents, par_text, line_start = [], None, 0
+        for sent, meta in tp.save():
+            if 'par_text' in meta:
+                if sents:
+                    for sent_ in annotate(sents, par_text, line_start):
+                        yield sent_
+                sents, par_text = [], meta['par_text']
+                if 'newdoc id' in meta:
+                    line_start = line_starts[meta['newdoc id']]
+            sents.append((sent, meta))
+        if sents:
+            for sent_ in annotate(sents, par_text, line_start):
+                yield sent_
+
+    fields = {}
+    return process()
+
+def _brat_to_conllu(tp, txt_fn, ann_fn, keep_tokens='smart', make_ne=False,
+                    keep_originals=True, store_raw_to=None, use_offsets=False,
+                    **kwargs):
+    """Convert the brat files with the *tp* (``TextPreprocessor``). The
+    params are the same as of ``brat_to_conllu()``. The *tp* may be reused
+    after its corpus is cleared
+
+    :return: Parsed CoNLL-U data
+    """
+    if use_offsets:
+        res = _brat_to_conllu_by_offsets(tp, txt_fn, ann_fn, **kwargs)
+    else:
+        def tag_brat_annotations(text, delim):
+            def process(match):
+                tag_start, tag_end = match.group(1), match.group(2)
+                return ' {}{}{} ' \
+                           .format(tag_start or tag_end, delim,
+                                   BRAT_START_TAG if tag_start else
+                                   BRAT_END_TAG)
+            #'\[(?P<ID>T\d+)>>](.+?)\[<<(?P=ID)]'
+            text = RE_BRAT.sub(process, text)
+            return text
+
+        sents = embed_brat_annotations(txt_fn, ann_fn,
+                                       keep_tokens=keep_tokens)
+        f = open(store_raw_to, 'wt', encoding='utf-8') if store_raw_to else \
+            None
+        try:
+            for sent in sents:
+                if f:
+                    print(sent, file=f)
+                tp.new_par(sent)
+        finally:
+            if f:
+                f.close()
+        for tag in [BRAT_START_TAG, BRAT_END_TAG]:
+            if tp.CHAR_DELIM + tag not in tp.TAG_MASKS:
+                tp.register_tag(tag)
+
+        post_tag = kwargs.get('post_tag')
+        kwargs['chars_allowed'] = False
+        kwargs['tag_date'] = False
+        kwargs['tag_hashtag'] = False
+        kwargs['post_tag'] = \
+            (lambda text, delim: \
+                 post_tag(tag_brat_annotations(text, delim), delim)) \
+                if post_tag else \
+            tag_brat_annotations
+        if kwargs.get('is_tokenized') != 'fast':
+            kwargs['is_tokenized'] = True
+
+        tp.do_all(**kwargs)
+        res = postprocess_brat_conllu(tp.save())
+    return make_ne_tags(res, keep_originals=keep_originals) if make_ne else \
+           res
+
 def brat_to_conllu(txt_fn, ann_fn=None, save_to=None, keep_tokens='smart',
                    make_ne=False, keep_originals=True, cdict_path=None,
-                   store_raw_to=None, **kwargs):
+                   store_raw_to=None, use_offsets=False, **kwargs):
     """Converts txt and ann files generated by brat to CoNLL-U file with brat
     annotations placed to the MISC:brat fields.
 
@@ -520,6 +734,14 @@ def brat_to_conllu(txt_fn, ann_fn=None, save_to=None, keep_tokens='smart',
     :param store_raw_to: a path where to save the result of the brat files
                          processing (intermediate result before converting to
                          CoNLL-U). Might need for debug use only.
+    :param use_offsets: if ``True``, the annotations are not embedded into the
+                        text. Instead, the clean text is processed with any
+                        options of the ``TextPreprocessor``, and the
+                        annotations are projected onto the tokens by their
+                        offsets in the text. The tokens are never split: the
+                        token gets the annotation if any part of it is
+                        annotated (*keep_tokens* and *store_raw_to* are
+                        ignored). Default ``False``.
     Also, the function receives other parameters that fit for Toxine's
     ``TextPreprocessor.do_all()`` method."""
     fn, fe = os.path.splitext(txt_fn)
@@ -531,46 +753,138 @@ def brat_to_conllu(txt_fn, ann_fn=None, save_to=None, keep_tokens='smart',
     if fe != '.ann':
         print('WARNING: Extension of ann_fn must be ".ann"', file=sys.stderr)
 
-    def tag_brat_annotations(text, delim):
-        def process(match):
-            tag_start, tag_end = match.group(1), match.group(2)
-            return ' {}{}{} ' \
-                       .format(tag_start or tag_end, delim,
-                               BRAT_START_TAG if tag_start else BRAT_END_TAG)
-        #'\[(?P<ID>T\d+)>>](.+?)\[<<(?P=ID)]'
-        text = RE_BRAT.sub(process, text)
-        return text
-
-    sents = embed_brat_annotations(txt_fn, ann_fn, keep_tokens=keep_tokens)
-    tp = TextPreprocessor(cdict_restore_from=cdict_path)
+    res = _brat_to_conllu(
+        TextPreprocessor(cdict_restore_from=cdict_path), txt_fn, ann_fn,
+        keep_tokens=keep_tokens, make_ne=make_ne,
+        keep_originals=keep_originals, store_raw_to=store_raw_to,
+        use_offsets=use_offsets, **kwargs
+    )
+    if save_to:
+        Conllu.save(res, save_to, fix=False)
+    else:
+        return res
+
+def _init_brat_worker(cdict_path=None, params=None):
+    global _tp, _params
+    _tp = TextPreprocessor(cdict_restore_from=cdict_path)
+    _params = params or {}
+
+def _convert_brat_file(task):
+    """Convert one pair of brat files with the preprocessor of the worker.
+    The *source* name is added to the metadata of each document. Returns the
+    CoNLL-U text and the number of sentences or, if the conversion is failed,
+    ``None`` and the error message"""
+    txt_fn, ann_fn, source = task
     try:
-        f = open(store_raw_to, 'wt', encoding='utf-8') if store_raw_to else \
-            None
-        for sent in sents:
-            if f:
-                print(sent, file=f)
-            tp.new_par(sent)
+        sents = list(_brat_to_conllu(_tp, txt_fn, ann_fn, **_params))
+        for _, meta in sents:
+            if 'newdoc id' in meta:
+                # the same place as the document metadata of Toxine has
+                items = list(meta.items())
+                meta.clear()
+                for key, val in items:
+                    meta[key] = val
+                    if key == 'newdoc id':
+                        meta['source'] = source
+        return ''.join(Conllu.get_as_text(sents, fix=False, log_file=None)), \
+               len(sents)
+    except Exception as e:
+        return None, '{}: {}'.format(type(e).__name__, e)
+    finally:
+        _tp.clear_corpus()
+
+def brat_dir_to_conllu(src_dir, save_to, recursive=True, per_file=False,
+                       keep_tokens='smart', make_ne=False,
+                       keep_originals=True, cdict_path=None,
+                       use_offsets=False, workers=None, max_pending=None,
+                       silent=False, **kwargs):
+    """Runs `brat_to_conllu()` for all txt-files in the directory *src_dir*.
+    The directory must also contain corresponding ann-files.
+
+    The files are converted in the pool of *workers* processes. Each worker
+    creates the ``TextPreprocessor`` once and reuses it for all its files.
+    The files are processed in the order of their sorted paths, so the
+    result is the same for each run and for any number of workers.
+
+    :param save_to: a path to the CoNLL-U file where all the result will be
+                    stored. If the path has ".gz", ".bz2" or ".xz" extension,
+                    the file will be compressed. If *per_file* is ``True``,
+                    it's a path to the directory where the result of each
+                    file will be stored separately (with the same relative
+                    path and the ".conllu" extension)
+    :param recursive: if ``True`` (default), search the txt-files in the
+                      subdirectories of *src_dir*, too.
+    :param workers: number of worker processes. If ``None`` or less than
+                    ``2``, the files are processed in the current process
+    :param max_pending: max number of files that are sent to the workers but
+                        not yet returned. Default is ``workers * 4``
+    :param silent: suppress output.
+    Params *keep_tokens*, *make_ne*, *keep_originals*, *cdict_path* and
+    *use_offsets* are the same as of ``brat_to_conllu()``. Also, the
+    function receives other parameters that fit for Toxine's
+    ``TextPreprocessor.do_all()`` method.
+
+    The name of the source txt-file (relative to *src_dir*) is stored in the
+    "source" metadata of each document of the result, so the documents of
+    the merged result can be mapped back to their files.
+
+    The errors don't abort the run: the file that can't be converted is
+    skipped (with *per_file* = ``False``, it's just absent in the result).
+
+    :return: the files that were not converted along with the errors
+    :rtype: list(tuple(str, str))
+    """
+    txt_fns = sorted(glob.glob(
+        src_dir + ('/**/*.txt' if recursive else '/*.txt'),
+        recursive=recursive
+    ))
+    kwargs['silent'] = True
+    params = dict(keep_tokens=keep_tokens, make_ne=make_ne,
+                  keep_originals=keep_originals, use_offsets=use_offsets,
+                  **kwargs)
+    if not silent:
+        print('Convert brat files', file=LOG_FILE)
+    f = None if per_file else open_file(save_to, 'wt')
+    errors, file_no, sent_no, step = [], 0, 0, max(len(txt_fns) // 60, 1)
+    try:
+        for txt_fn, (text, res) in zip(txt_fns, imap_ordered(
+            _convert_brat_file, ((x, x[:-4] + '.ann',
+                                  os.path.relpath(x, src_dir))
+                                     for x in txt_fns),
+            workers=workers, initializer=_init_brat_worker,
+            initargs=(cdict_path, params), max_pending=max_pending
+        )):
+            file_no += 1
+            if text is None:
+                errors.append((txt_fn, res))
+                if not silent:
+                    print('\nERROR: Can\'t convert the file "{}": {}'
+                              .format(txt_fn, res), file=LOG_FILE)
+            else:
+                sent_no += res
+                if per_file:
+                    fn = os.path.join(
+                        save_to, os.path.relpath(txt_fn, src_dir)[:-4]
+                               + '.conllu'
+                    )
+                    os.makedirs(os.path.dirname(fn), exist_ok=True)
+                    with io.open(fn, 'wt', encoding='utf-8',
+                                 newline='\n') as f_out:
+                        f_out.write(text)
+                else:
+                    f.write(text)
+            if not silent:
+                print_progress(file_no, end_value=len(txt_fns), step=step,
+                               file=LOG_FILE)
     finally:
         if f:
             f.close()
-    tp.register_tag(BRAT_START_TAG)
-    tp.register_tag(BRAT_END_TAG)
-
-    kwargs['chars_allowed'] = False
-    kwargs['tag_date'] = False
-    kwargs['tag_hashtag'] = False
-    kwargs['post_tag'] = \
-        (lambda text, delim: \
-             kwargs['post_tag'](tag_brat_annotations(text, delim))) \
-            if 'post_tag' in kwargs else \
-        tag_brat_annotations
-    kwargs['is_tokenized'] = True
-
-    tp.do_all(**kwargs)
-    return make_ne_tags(postprocess_brat_conllu(tp.save()), save_to=save_to,
-                        keep_originals=keep_originals) \
-               if make_ne else \
-           postprocess_brat_conllu(tp.save(), save_to=save_to)
+    if not silent:
+        print('Brat files have been converted: {} files, {} sentences, '
+              '{} errors'.format(file_no - len(errors), sent_no,
+                                 len(errors)),
+              file=LOG_FILE)
+    return errors
 
 def conllu_to_brat(corpus, txt_fn, ann_fn=None, spaces=3, short_spaces=1):
     """Converts *corpus* in CoNLL-U format to txt and ann files used by brat.
@@ -634,6 +948,126 @@ def conllu_to_brat(corpus, txt_fn, ann_fn=None, spaces=3, short_spaces=1):
                     short_end = None
                 print(form, end='', file=out_f)
 
+# the units of the hierarchical diff of _get_transfer_map(): lines, then
+# words (with the following spaces)
+RE_DIFF_UNITS = [re.compile(r'[^\n]*\n|[^\n]+'), re.compile(r'\s+|\S+\s*')]
+
+def _match_units(a, b):
+    """Find the equal items of the sequences *a* and *b* as patience diff
+    does: the common head and tail are matched, then the items that are
+    unique in both sequences are used as anchors (in their longest common
+    order), and the gaps between the anchors are processed the same way.
+
+    :return: the (i, j) indices of the matched items in ascending order
+    :rtype: list(tuple(int, int))
+    """
+    res, ranges = [], [(0, len(a), 0, len(b))]
+    while ranges:
+        a_lo, a_hi, b_lo, b_hi = ranges.pop()
+        while a_lo < a_hi and b_lo < b_hi and a[a_lo] == b[b_lo]:
+            res.append((a_lo, b_lo))
+            a_lo += 1
+            b_lo += 1
+        while a_lo < a_hi and b_lo < b_hi and a[a_hi - 1] == b[b_hi - 1]:
+            a_hi -= 1
+            b_hi -= 1
+            res.append((a_hi, b_hi))
+        if a_lo == a_hi or b_lo == b_hi:
+            continue
+        uniq_a, uniq_b = {}, {}
+        for i in range(a_lo, a_hi):
+            uniq_a[a[i]] = None if a[i] in uniq_a else i
+        for j in range(b_lo, b_hi):
+            if uniq_a.get(b[j]) is not None:
+                uniq_b[b[j]] = None if b[j] in uniq_b else j
+        anchors = sorted((uniq_a[x], j) for x, j in uniq_b.items()
+                                            if j is not None)
+        # the longest increasing subsequence of the j indices
+        tails, tail_js, prevs = [], [], []
+        for k, (_, j) in enumerate(anchors):
+            pos = bisect_left(tail_js, j)
+            prevs.append(tails[pos - 1] if pos else None)
+            if pos == len(tails):
+                tails.append(k)
+                tail_js.append(j)
+            else:
+                tails[pos], tail_js[pos] = k, j
+        k = tails[-1] if tails else None
+        while k is not None:
+            i, j = anchors[k]
+            res.append((i, j))
+            ranges.append((i + 1, a_hi, j + 1, b_hi))
+            a_hi, b_hi = i, j
+            k = prevs[k]
+        if tails:
+            ranges.append((a_lo, a_hi, b_lo, b_hi))
+    res.sort()
+    return res
+
+def _get_transfer_map(old_txt, new_txt):
+    """Return the list that maps each position of the *old_txt* (and its
+    end) to the corresponding position of the *new_txt* or to ``None`` if
+    the symbol was deleted.
+
+    The texts are compared hierarchically: the equal lines are matched
+    first, then the words of the changed lines, and only the rest is
+    compared symbol by symbol with ``Levenshtein.editops()``. So, for the
+    usual edits, the time is near linear instead of quadratic."""
+    from Levenshtein import editops
+
+    transfer_map = [None] * (len(old_txt) + 1)
+    transfer_map[-1] = len(new_txt)
+
+    def transfer_symbols(i0, i1, j0, j1):
+        idx_map, shift, prev_idx = list(range(j0, j0 + i1 - i0)), 0, 0
+        for op, idx_src, idx_dst in editops(old_txt[i0:i1], new_txt[j0:j1]):
+            if shift:
+                for idx in range(prev_idx, idx_src):
+                    idx_map[idx] += shift
+            if op == 'insert':
+                shift += 1
+                prev_idx = idx_src
+            elif op == 'replace':
+                idx_map[idx_src] += shift
+                prev_idx = idx_src + 1
+            elif op == 'delete':
+                idx_map[idx_src] = None
+                shift -= 1
+                prev_idx = idx_src + 1
+            else:
+                raise ValueError('ERROR: Unknown operation "{}"'.format(op))
+        if shift:
+            for idx in range(prev_idx, i1 - i0):
+                idx_map[idx] += shift
+        transfer_map[i0:i1] = idx_map
+
+    # (i0, i1, j0, j1, level) of the changed parts of the texts
+    hunks = [(0, len(old_txt), 0, len(new_txt), 0)]
+    while hunks:
+        i0, i1, j0, j1, level = hunks.pop()
+        if i0 == i1:
+            continue
+        if j0 == j1:
+            continue  # all the symbols are deleted
+        if level == len(RE_DIFF_UNITS):
+            transfer_symbols(i0, i1, j0, j1)
+            continue
+        a = RE_DIFF_UNITS[level].findall(old_txt, i0, i1)
+        b = RE_DIFF_UNITS[level].findall(new_txt, j0, j1)
+        i, j, i_, j_ = i0, j0, 0, 0
+        for i_next, j_next in _match_units(a, b) + [(len(a), len(b))]:
+            # the gap before the matched unit
+            i_gap = i + sum(len(x) for x in a[i_:i_next])
+            j_gap = j + sum(len(x) for x in b[j_:j_next])
+            if i_gap > i:
+                hunks.append((i, i_gap, j, j_gap, level + 1))
+            i, j, i_, j_ = i_gap, j_gap, i_next, j_next
+            if i_ < len(a):
+                len_unit = len(a[i_])
+                transfer_map[i:i + len_unit] = range(j, j + len_unit)
+                i, j, i_, j_ = i + len_unit, j + len_unit, i_ + 1, j_ + 1
+    return transfer_map
+
 def renew_ann(old_txt_fn, old_ann_fn, new_txt_fn, save_new_ann_to,
               rewrite=False):
     """If we have a brat annotation for some txt-file already done, and we
@@ -651,8 +1085,6 @@ def renew_ann(old_txt_fn, old_ann_fn, new_txt_fn, save_new_ann_to,
         'ERROR: use `rewrite=True` param if you really want to change ' \
         'original ann-file'
 
-    from Levenshtein import editops
-
     with io.open(old_txt_fn, 'rt', encoding='utf-8', newline='') as f:
         old_txt = f.read()
     with io.open(new_txt_fn, 'rt', encoding='utf-8', newline='') as f:
@@ -662,229 +1094,117 @@ def renew_ann(old_txt_fn, old_ann_fn, new_txt_fn, save_new_ann_to,
                   'symbols that may cause errors ("nonprintable characters") '
                   'in brat engine. Consider to remove "CR" symbols from new '
                   'txt file and renew annotations again'.format(new_txt_fn))
-    with open(old_ann_fn, 'rt', encoding='utf-8') as f:
-        old_ann = f.read().split('\n')
-    transfer_map, shift, prev_idx = list(range(len(old_txt) + 1)), 0, 0
-    for op, idx_src, idx_dst in editops(old_txt, new_txt):
-        if shift:
-            for idx in range(prev_idx, idx_src):
-                transfer_map[idx] += shift
-        if op == 'insert':
-            shift += 1
-            prev_idx = idx_src
-        elif op == 'replace':
-            transfer_map[idx_src] += shift
-            prev_idx = idx_src + 1
-        elif op == 'delete':
-            transfer_map[idx_src] = None
-            shift -= 1
-            prev_idx = idx_src + 1
-        else:
-            raise ValueError('ERROR: Unknown operation "{}"'.format(op))
-    if shift:
-        for idx in range(prev_idx, len(old_txt) + 1):
-            transfer_map[idx] += shift
-    new_ann = []
+    doc = BratDocument(old_ann_fn)
+    transfer_map = _get_transfer_map(old_txt, new_txt)
     len_old_txt, len_new_txt = len(old_txt), len(new_txt)
-    old_aids, new_aids, aid_map, all_spans = set(), set(), {}, {}
-    for line_no, ann in enumerate(old_ann, start=1):
-        ann = ann.split('\t')
-        if not ann:
-            continue
-        aid = ann[0]
-        old_aids.add(aid)
-        chunks_old = ann[1].split(';') if len(ann) >= 2 else []
-        chunks_new, spans, fragments = [], [], []
-        for chunk_old in chunks_old:
-            chunk_new, span, idx0 = [], [], None
-            for token in chunk_old.split():
-                if token.isdigit():
-                    idx_ = int(token)
-                    assert idx_ <= len_old_txt, \
-                        'ERROR: Position "{}" in line {} is outside of ' \
-                        'bounds of the file {}' \
-                            .format(idx_, line_no, old_ann_fn)
-                    # if we have a start of the fragment
-                    if not span:
-                        # search for transfer not to None
-                        for idx in transfer_map[idx_:]:
-                            if idx is not None:
-                                idx0 = idx
-                                if idx == len_new_txt:
-                                    idx = None
-                                else:
-                                    # if the old fragment starts after ' ',
-                                    # the new one should do, too
-                                    if idx_ == 0 \
-                                    or old_txt[idx_ - 1].isspace():
-                                        for i in range(idx, 0, -1):
-                                            if new_txt[i - 1].isspace():
-                                                idx = i
-                                                break
-                                        else:
-                                            idx = 0
-                                    # anyway, we can't point to ' '
-                                    for i in range(idx, len_new_txt):
-                                        if not new_txt[i].isspace():
-                                            idx = i
-                                            break
-                                    else:
-                                        idx = None
-                                    #idx0 = idx
-                                if idx is None:
-                                    token = None
-                                else:
-                                    span.append(idx)
-                                    token = str(idx)
-                                break
-                        else:
-                            break
-                    # end of the fragment
-                    else:
-                        for idx in reversed(transfer_map[:idx_ + 1]):
-                            if idx is not None:
-                                if idx <= idx0:
-                                    idx = span = None
-                                else:
-                                    # if the old fragment ends with ' ',
-                                    # the new one should do, too
-                                    if idx_ == len_old_txt \
-                                    or old_txt[idx_].isspace():
-                                        for i in range(idx, len_new_txt):
-                                            if new_txt[i].isspace():
-                                                idx = i
-                                                break
-                                        else:
-                                            idx = len_new_txt
-                                    # anyway, we don't want to have ' '
-                                    # in the end
-                                    for i in range(idx, 0, -1):
-                                        if not new_txt[i - 1].isspace():
-                                            idx = i
-                                            break
-                                    else:
-                                        idx = None
-                                if idx is None:
-                                    token = None
-                                else:
-                                    span.append(idx)
-                                    token = str(idx)
-                                break
-                        else:
-                            break
-                if token is None or (token in old_aids
-                                 and token not in new_aids):
-                    token = aid_map.get(token)
-                    if not token:
-                        chunk_new = None
-                        break
-                chunk_new.append(token)
-            if span:
-                if len(span) != 2:
-                    print(span)
-                assert len(span) == 2, 'ERROR: Invalid line {} in {} file' \
-                                           .format(line_no, old_ann_fn)
-                for span_ in spans:
-                    if span[0] >= span_[0] and span[0] < span_[1]:
-                        span[0] = span_[1]
-                    if span[1] > span_[0] and span[1] <= span_[1]:
-                        span[1] = span_[0]
-                if span[1] > span[0]:
-                    for i, span_ in enumerate(reversed(spans), start=1):
-                        if span[0] == span_[1]:
-                            span_[1] = span[1]
-                        elif span[1] == span_[0]:
-                            span_[0] = span[0]
-                        else:
-                            continue
-                        ###
-                        frag_start, frag_end = span
-                        frags_ = new_txt[frag_start:frag_end].split('\n')
-                        fragment = ''
-                        chunk_new = [str(frag_start), str(frag_end)]
-                        for i, frag in enumerate(frags_):
-                            frag_len = len(frag)
-                            if frag_len:
-                                frag_end = frag_start + frag_len
-                                frag_start = frag_end + 1
-                                chunk_new[0] += ' ' + str(frag_end) + \
-                                                ';' + str(frag_start)
-                                fragment += frag + ' '
-                        fragment += frags_[-1]
-                        chunks_new[-i][-2:] = chunk_new
-                        fragments[-i] = fragment
-                        ###
-                        #chunks_new[-i][-2:] = [str(span_[0]), str(span_[1])]
-                        #fragments[-i] = new_txt[span_[0]:span_[1]]
-                        chunk_new = None
-                        break
+
+    def transfer_span(start, end, line_no):
+        """Return the span of the new text that corresponds to the span
+        [*start*, *end*) of the old one, or ``None``"""
+        assert end <= len_old_txt, \
+            'ERROR: Position "{}" in line {} is outside of ' \
+            'bounds of the file {}'.format(end, line_no, old_ann_fn)
+        # search for transfer not to None (the end of the text is never
+        # deleted)
+        i = start
+        while transfer_map[i] is None:
+            i += 1
+        idx0 = idx = transfer_map[i]
+        if idx == len_new_txt:
+            return None
+        # if the old fragment starts after ' ', the new one should do, too
+        if start == 0 or old_txt[start - 1].isspace():
+            while idx > 0 and not new_txt[idx - 1].isspace():
+                idx -= 1
+        # anyway, we can't point to ' '
+        while idx < len_new_txt and new_txt[idx].isspace():
+            idx += 1
+        if idx == len_new_txt:
+            return None
+        span = [idx]
+
+        i = end
+        while i >= 0 and transfer_map[i] is None:
+            i -= 1
+        if i < 0 or transfer_map[i] <= idx0:
+            return None
+        idx = transfer_map[i]
+        # if the old fragment ends with ' ', the new one should do, too
+        if end == len_old_txt or old_txt[end].isspace():
+            while idx < len_new_txt and not new_txt[idx].isspace():
+                idx += 1
+        # anyway, we don't want to have ' ' in the end
+        while idx > 0 and new_txt[idx - 1].isspace():
+            idx -= 1
+        span.append(idx)
+        return span if span[1] > span[0] else None
+
+    def renew_entity(ann):
+        spans = []
+        for start, end in ann.spans:
+            span = transfer_span(start, end, ann.line_no)
+            if span is None:
+                continue
+            for span_ in spans:
+                if span[0] >= span_[0] and span[0] < span_[1]:
+                    span[0] = span_[1]
+                if span[1] > span_[0] and span[1] <= span_[1]:
+                    span[1] = span_[0]
+            if span[1] > span[0]:
+                for span_ in reversed(spans):
+                    if span[0] == span_[1]:
+                        span_[1] = span[1]
+                    elif span[1] == span_[0]:
+                        span_[0] = span[0]
                     else:
-                        spans.append(span)
-                        if len(chunk_new) > 2:
-                            chunks_new.append(chunk_new[:-2])
-                        ###
-                        frag_start, frag_end = span
-                        frags_ = new_txt[frag_start:frag_end].split('\n')
-                        fragment = ''
-                        chunk_new = [str(frag_start), str(frag_end)]
-                        for i, frag in enumerate(frags_[:-1]):
-                            frag_len = len(frag)
-                            if frag_len:
-                                frag_end = frag_start + frag_len
-                                frag_start = frag_end + 1
-                                chunk_new[0] += ' ' + str(frag_end) + \
-                                                ';' + str(frag_start)
-                                fragment += frag + ' '
-                        fragment += frags_[-1]
-                        fragments.append(fragment)
-                        ###
-                        #chunk_new = [str(span[0]), str(span[1])]
-                        #fragments.append(new_txt[span[0]:span[1]])
-                else:
-                    chunk_new = None
-            if chunk_new is None:
-                if not chunks_new:
+                        continue
                     break
-            else:
-                chunks_new.append(chunk_new)
-        if spans:
-            order_ = [i for _, i in sorted((x, i) for i, x in enumerate(spans))]
-            spans = [spans[i] for i in order_]
-            chunk_ = ' '.join(chunks_new[0])
-            chunks_new_ = [chunks_new[i + 1] for i in order_]
-            fragments_ = [fragments[i] for i in order_]
-            end_pos = None
-            chunks_new, fragments = [], []
-            for span, chunk_new, fragment in zip(spans, chunks_new_, fragments_):
-                if end_pos:
-                    for c in new_txt[end_pos:span[0]]:
-                        if c != ' ':
-                            chunks_new.append(chunk_new)
-                            fragments.append(fragment)
-                            break
-                    else:
-                        chunks_new[-1][1] = chunk_new[1]
-                        fragments[-1] += ' ' * (span[0] - end_pos) + fragment
                 else:
-                    chunks_new.append(chunk_new)
-                    fragments.append(fragment)
-                end_pos = span[1]
-            chunks_new[0].insert(0, chunk_)
-        if chunks_old and chunks_new:
-            if chunks_new:
-                chunks_new = ';'.join(' '.join(x) for x in chunks_new)
-                if chunks_new in all_spans:
-                    aid_map[aid] = all_spans[chunks_new]
-                    continue
-                all_spans[chunks_new] = aid
-                chunks_new = [chunks_new]
+                    spans.append(span)
+        if not spans:
+            return None
+        # the fragments delimited by spaces only are joined
+        spans_ = []
+        for span in sorted(spans):
+            if spans_ and not new_txt[spans_[-1][1]:span[0]].strip(' '):
+                spans_[-1][1] = span[1]
             else:
-                chunks_new = []
-            new_ann.append(
-                '\t'.join([aid] + chunks_new
-                                + ([' '.join(fragments)] if fragments else
-                                   ann[2:])))
-            new_aids.add(aid)
+                spans_.append(span)
+        # brat doesn't allow LF inside the fragment
+        spans, fragments = [], []
+        for start, end in spans_:
+            for frag in new_txt[start:end].split('\n'):
+                if frag:
+                    spans.append((start, start + len(frag)))
+                    fragments.append(frag)
+                start += len(frag) + 1
+        return ann._replace(spans=tuple(spans), text=' '.join(fragments))
+
+    # old id -> new id (the duplicates of the other annotations are mapped
+    # to them) or None, if the annotation is removed
+    new_anns, new_ids, all_anns = {}, {}, {}
+
+    def renew(ann_id):
+        if ann_id not in new_ids:
+            new_ids[ann_id] = None  # for the case of the circular reference
+            ann = doc[ann_id]
+            if ann.type == 'T':
+                ann = renew_entity(ann)
+            else:
+                refs = tuple((role, renew(x)) for role, x in ann.refs)
+                ann = ann._replace(refs=refs) \
+                          if all(x for _, x in refs) else \
+                      None
+            if ann:
+                key = BratDocument.format_ann(ann).split('\t')[1]
+                ann_id_ = all_anns.setdefault(key, ann_id)
+                if ann_id_ == ann_id:
+                    new_anns[ann_id] = ann
+                new_ids[ann_id] = ann_id_
+        return new_ids[ann_id]
+
+    new_ann = [BratDocument.format_ann(new_anns[x.id])
+                   for x in doc if renew(x.id) == x.id]
     with io.open(save_new_ann_to, 'wt', encoding='utf=8', newline='\n') as f:
         if new_ann:
             f.write('\n'.join(new_ann) + '\n')
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+# Toxine project: Caches for the processing results
+#
+# Copyright (C) 2019-present by Sergei Ternovykh
+# License: BSD, see LICENSE for details
+"""
+Caches that allow to reuse the results of ``TextPreprocessor.process_text()``
+for texts that have already been processed with the same options.
+"""
+from collections import OrderedDict
+import os
+import pickle
+import sqlite3
+import time
+
+
+class BaseCache:
+    """Base class for the caches of processing results. Keeps the hit
+    statistics. Subclasses must implement ``_get()`` and ``_put()``"""
+
+    def __init__(self):
+        self.hits = self.misses = 0
+
+    def _get(self, key):
+        raise NotImplementedError()
+
+    def _put(self, key, value):
+        raise NotImplementedError()
+
+    def get(self, key):
+        """Return the value stored for the *key* or ``None`` if the value is
+        absent"""
+        value = self._get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            value = pickle.loads(value)
+        return value
+
+    def put(self, key, value):
+        """Store the *value* for the *key*"""
+        self._put(key, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+
+    def flush(self):
+        """Make stored values persistent (if the cache supports it)"""
+        pass
+
+    @property
+    def hit_ratio(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.
+
+    def stats(self):
+        """Return the cache statistics.
+
+        :rtype: dict
+        """
+        return {'hits': self.hits, 'misses': self.misses,
+                'hit_ratio': self.hit_ratio}
+
+
+class MemoryCache(BaseCache):
+    """Bounded in-memory LRU cache. Use it with
+    ``TextPreprocessor.process_text()`` for the streams of short texts where
+    the same messages occur many times (chats, forums)."""
+
+    def __init__(self, maxsize=10000, ttl=None):
+        """
+        :param maxsize: max number of stored values. When it is exceeded, the
+                        least recently used value is removed
+        :param ttl: time to live of the values, in seconds. If ``None``
+                    (default), the values don't expire
+        :type ttl: float
+        """
+        super().__init__()
+        assert maxsize > 0, 'ERROR: maxsize must be positive'
+        self.maxsize, self.ttl = maxsize, ttl
+        self._data = OrderedDict()
+        self.evictions = self.expirations = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def _get(self, key):
+        item = self._data.get(key)
+        if item is not None:
+            expires, value = item
+            if expires is not None and expires < time.monotonic():
+                del self._data[key]
+                self.expirations += 1
+                return None
+            self._data.move_to_end(key)
+            return value
+        return None
+
+    def _put(self, key, value):
+        self._data[key] = (None if self.ttl is None else
+                           time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        """Remove all the values from the cache"""
+        self._data.clear()
+
+    def stats(self):
+        res = super().stats()
+        res.update({'size': len(self._data), 'evictions': self.evictions,
+                    'expirations': self.expirations})
+        return res
+
+
+class DiskCache(BaseCache):
+    """Persistent cache stored in the SQLite database. Use it with
+    ``TextPreprocessor.do_all()`` to process only paragraphs that have been
+    changed since the last run."""
+
+    def __init__(self, path, commit_every=1000):
+        """
+        :param path: path to the database file. It will be created if it
+                     doesn't exist
+        :param commit_every: number of new values after which the changes are
+                             committed to the disk
+        """
+        super().__init__()
+        dname = os.path.dirname(path)
+        if dname and not os.path.isdir(dname):
+            os.makedirs(dname)
+        self._db = sqlite3.connect(path)
+        self._db.execute('CREATE TABLE IF NOT EXISTS cache '
+                         '(key TEXT PRIMARY KEY, value BLOB)')
+        self._commit_every = commit_every
+        self._uncommitted = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return self._db.execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+
+    def _get(self, key):
+        row = self._db.execute('SELECT value FROM cache WHERE key = ?',
+                               (key,)).fetchone()
+        return row[0] if row else None
+
+    def _put(self, key, value):
+        self._db.execute('INSERT OR REPLACE INTO cache (key, value) '
+                         'VALUES (?, ?)', (key, value))
+        self._uncommitted += 1
+        if self._uncommitted >= self._commit_every:
+            self.flush()
+
+    def flush(self):
+        self._db.commit()
+        self._uncommitted = 0
+
+    def close(self):
+        """Commit the changes and close the database"""
+        if self._db:
+            self.flush()
+            self._db.close()
+            self._db = None
@@ -0,0 +1,284 @@
+# -*- coding: utf-8 -*-
+# Toxine project: Command-line interface
+#
+# Copyright (C) 2019-present by Sergei Ternovykh
+# License: BSD, see LICENSE for details
+"""
+Command-line interface for the TextPreprocessor. Reads text from files or
+stdin and streams the result in CoNLL-U format to stdout.
+
+Usage: python -m toxine [options] [FILE ...]
+"""
+import argparse
+from collections import OrderedDict
+from corpuscula import Conllu
+from corpuscula.utils import LOG_FILE
+import json
+import os
+import sys
+import time
+import uuid
+
+from toxine._version import __version__
+from toxine.utils import imap_ordered, open_file
+
+TAGGERS = ['emoji', 'xml', 'email', 'uri', 'phone', 'date', 'hashtag',
+           'nametag']
+FORMATS = ['text', 'lines', 'jsonl']
+
+_tp = None
+
+
+def _init_worker(cdict_path):
+    global _tp
+    from toxine.text_preprocessor import TextPreprocessor
+    _tp = TextPreprocessor(cdict_restore_from=cdict_path)
+
+
+def _process_batch(task):
+    """Process one batch of paragraphs of the document. Returns CoNLL-U text
+    of the batch without the document header along with the batch position
+    and numbers of sentences and tokens produced."""
+    doc_id, par_no_start, pars, kwargs = task
+    tp_doc_id = _tp.new_doc()
+    try:
+        _tp.new_pars(pars, doc_id=tp_doc_id)
+        _tp.do_all(tp_doc_id, silent=True, **kwargs)
+        sents = []
+        tokens_cnt = 0
+        for tokens, meta in _tp.save(doc_id=tp_doc_id):
+            meta_ = OrderedDict()
+            for key, val in meta.items():
+                if key == 'newpar id':
+                    par_no = int(val.rsplit('-p', 1)[1]) + par_no_start - 1
+                    val = '{}-p{}'.format(doc_id, par_no)
+                elif key == 'sent_id':
+                    par_no, sent_no = val.rsplit('-p', 1)[1].split('-s')
+                    val = '{}-p{}-s{}'.format(
+                        doc_id, int(par_no) + par_no_start - 1, sent_no
+                    )
+                elif key == 'newdoc id':
+                    continue
+                meta_[key] = val
+            sents.append((tokens, meta_))
+            tokens_cnt += len(tokens)
+        text = ''.join(Conllu.get_as_text(sents, fix=False, log_file=None))
+    finally:
+        _tp.remove_doc(tp_doc_id)
+    return doc_id, par_no_start, text, len(sents), tokens_cnt
+
+
+def read_text(f):
+    """Read paragraphs delimited by empty lines"""
+    lines = []
+    for line in f:
+        if line.strip():
+            lines.append(line)
+        elif lines:
+            yield ''.join(lines).strip()
+            lines = []
+    if lines:
+        yield ''.join(lines).strip()
+
+
+def read_lines(f):
+    """Read paragraphs placed one per line"""
+    for line in f:
+        line = line.strip()
+        if line:
+            yield line
+
+
+def read_jsonl(f, text_field='text', id_field='id', eop=r'\n'):
+    """Read documents from JSON Lines. Returns tuples (doc_id, paragraphs)"""
+    from toxine.text_preprocessor import TextPreprocessor
+    for line_no, line in enumerate(f, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            doc = json.loads(line)
+            text = doc[text_field]
+        except (ValueError, KeyError, TypeError):
+            raise ValueError('ERROR: Invalid JSON document in line {}'
+                                 .format(line_no))
+        doc_id = doc.get(id_field)
+        yield None if doc_id is None else str(doc_id), \
+              TextPreprocessor.text_to_pars(text, eop=eop)
+
+
+def make_tasks(docs, batch_size, kwargs):
+    """Split documents into batches of paragraphs"""
+    for doc_id, pars in docs:
+        if doc_id is None:
+            doc_id = str(uuid.uuid4())
+        par_no_start, batch = 1, []
+        for par in pars:
+            batch.append(par)
+            if len(batch) >= batch_size:
+                yield doc_id, par_no_start, batch, kwargs
+                par_no_start += len(batch)
+                batch = []
+        if batch:
+            yield doc_id, par_no_start, batch, kwargs
+
+
+def _get_docs(fnames, fmt, args):
+    for fname in fnames or ['-']:
+        if fname == '-':
+            f, doc_id = sys.stdin, None
+        else:
+            f, doc_id = open(fname, 'rt', encoding='utf-8-sig'), \
+                        os.path.basename(fname)
+        try:
+            if fmt == 'jsonl':
+                yield from read_jsonl(f, text_field=args.text_field,
+                                      id_field=args.id_field, eop=args.eop)
+            else:
+                yield doc_id, read_text(f) if fmt == 'text' else \
+                              read_lines(f)
+        finally:
+            if f is not sys.stdin:
+                f.close()
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        prog='toxine',
+        description='Preprocess and tokenize Russian text. Output is '
+                    'written in CoNLL-U format.'
+    )
+    parser.add_argument('files', metavar='FILE', nargs='*',
+                        help='input files. If absent or "-", stdin is read')
+    parser.add_argument('-o', '--output', metavar='PATH',
+                        help='output file. If it has ".gz", ".bz2" or ".xz" '
+                             'extension, it will be compressed. Default is '
+                             'stdout')
+    parser.add_argument('-f', '--format', choices=FORMATS, default='text',
+                        help='input format: "text" - paragraphs are '
+                             'separated by empty lines (default); "lines" '
+                             '- one paragraph per line; "jsonl" - one '
+                             'document per line in JSON Lines format')
+    parser.add_argument('--text-field', default='text',
+                        help='jsonl: field with the text of the document')
+    parser.add_argument('--id-field', default='id',
+                        help='jsonl: field with the id of the document')
+    parser.add_argument('--eop', default=r'\n',
+                        help='jsonl: regex to split the text of the document '
+                             'into paragraphs')
+    parser.add_argument('--cdict', metavar='PATH',
+                        help='path to the CorpusDict backup file')
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--chars-allowed', metavar='CHARS',
+                       help='allowed charset (content of "[]" regex)')
+    group.add_argument('--all-chars', action='store_true',
+                       help='allow all symbols')
+    parser.add_argument('--no-unescape-html', action='store_true',
+                        help="don't convert html entities")
+    for tagger in TAGGERS:
+        parser.add_argument('--no-tag-' + tagger, action='store_true',
+                            help="don't run {} tagger".format(tagger))
+    parser.add_argument('--split-unk', action='store_true',
+                        help='split tokens with disallowed chars at the '
+                             'borders')
+    parser.add_argument('--no-tag-unk', action='store_true',
+                        help="don't tag tokens with disallowed chars")
+    parser.add_argument('--is-tokenized', action='store_true',
+                        help='input is already tokenized: sentences are '
+                             'separated by LF, words - by spaces')
+    parser.add_argument('--fast-tokenized', action='store_true',
+                        help='input is strictly tokenized: one sentence per '
+                             'line, tokens are separated by spaces. Only '
+                             'tokens that look like entities are tagged')
+    parser.add_argument('--norm-punct', action='store_true',
+                        help='normalize punctuation')
+    parser.add_argument('--no-lf-eos', action='store_true',
+                        help="norm-punct: LF doesn't mark end of sentence")
+    parser.add_argument('--no-tab-eos', action='store_true',
+                        help="norm-punct: TAB doesn't mark end of sentence")
+    parser.add_argument('--ignore-case', action='store_true',
+                        help='norm-punct: ignore character case')
+    parser.add_argument('--add-global-columns', action='store_true',
+                        help='add CoNLL-U Plus "global.columns" metadata')
+    parser.add_argument('-w', '--workers', type=int, default=1,
+                        help='number of worker processes. Default is 1')
+    parser.add_argument('-b', '--batch-size', type=int, default=100,
+                        help='number of paragraphs in one task. Default is '
+                             '100')
+    parser.add_argument('--progress', action='store_true',
+                        help='report throughput to stderr')
+    parser.add_argument('-V', '--version', action='version',
+                        version='%(prog)s ' + __version__)
+    return parser
+
+
+def get_kwargs(args):
+    """Convert command-line *args* to params of ``TextPreprocessor.do_all()``
+    """
+    kwargs = {
+        'chars_allowed': False if args.all_chars else args.chars_allowed,
+        'unescape_html': not args.no_unescape_html,
+        'split_unk': args.split_unk,
+        'tag_unk': not args.no_tag_unk,
+        'is_tokenized': 'fast' if args.fast_tokenized else
+                        args.is_tokenized,
+        'norm_punct': args.norm_punct,
+        'islf_eos': not args.no_lf_eos,
+        'istab_eos': not args.no_tab_eos,
+        'ignore_case': args.ignore_case
+    }
+    for tagger in TAGGERS:
+        kwargs['tag_' + tagger] = not getattr(args, 'no_tag_' + tagger)
+    return kwargs
+
+
+def run(args, out_f):
+    """Process the input according to the command-line *args* and write the
+    result to *out_f*"""
+    assert args.batch_size > 0, 'ERROR: batch size must be positive'
+    tasks = make_tasks(_get_docs(args.files, args.format, args),
+                       args.batch_size, get_kwargs(args))
+
+    time0 = time_ = time.time()
+    sents_cnt = tokens_cnt = 0
+    is_first, has_header = True, False
+    for doc_id, par_no_start, text, n_sents, n_tokens in imap_ordered(
+        _process_batch, tasks, workers=args.workers,
+        initializer=_init_worker, initargs=(args.cdict,)
+    ):
+        if par_no_start == 1:
+            has_header = False
+        if text:
+            if not has_header:
+                if is_first and args.add_global_columns:
+                    print('# global.columns = ID FORM LEMMA UPOS XPOS FEATS '
+                          'HEAD DEPREL DEPS MISC', file=out_f)
+                print('# newdoc id = {}'.format(doc_id), file=out_f)
+                is_first, has_header = False, True
+            out_f.write(text)
+        sents_cnt += n_sents
+        tokens_cnt += n_tokens
+        if args.progress:
+            time1 = time.time()
+            if time1 - time_ >= 1.:
+                time_ = time1
+                print('\r{} sentences, {} tokens: {:.1f} sents/sec'
+                          .format(sents_cnt, tokens_cnt,
+                                  sents_cnt / (time1 - time0)),
+                      end='', file=LOG_FILE)
+                LOG_FILE.flush()
+    if args.progress:
+        time1 = time.time() - time0
+        print('\r{} sentences, {} tokens: {:.1f} sents/sec, {:.1f} sec'
+                  .format(sents_cnt, tokens_cnt,
+                          sents_cnt / time1 if time1 else 0., time1),
+              file=LOG_FILE)
+
+
+def main(argv=None):
+    args = get_parser().parse_args(argv)
+    if args.output:
+        with open_file(args.output, 'wt') as out_f:
+            run(args, out_f)
+    else:
+        run(args, sys.stdout)
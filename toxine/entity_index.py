@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+# Toxine project: Inverted index of the entities
+#
+# Copyright (C) 2019-present by Sergei Ternovykh
+# License: BSD, see LICENSE for details
+"""
+Inverted index that maps the entities found by the taggers (tag and
+normalized value) to their positions in the processed corpus.
+"""
+import os
+import re
+import sqlite3
+
+
+def norm_default(value):
+    return ' '.join(value.split()).lower()
+
+
+def norm_phone(value):
+    # the same form as the phone tagger makes: 7XXXXXXXXXX
+    phone = re.sub(r'\D', '', value)
+    if len(phone) == 11 and phone[0] in ('7', '8'):
+        phone = phone[1:]
+    return '7' + phone if len(phone) == 10 else phone
+
+
+NORMALIZERS = {'EntityPhone': norm_phone}
+
+
+class EntityIndex:
+    """Inverted index of entities stored in the SQLite database. Pass its
+    instance as the *index* param of ``TextPreprocessor.do_all()`` to fill
+    it during the processing. Positions of the entities are tuples (doc_id,
+    par_no, sent_no, token_id) where numbers of the paragraphs and the
+    sentences are the same as in ``sent_id`` of the ``save()`` result:
+    ``'{doc_id}-p{par_no}-s{sent_no}'``."""
+
+    def __init__(self, path=None, normalizers=None, commit_every=10000):
+        """
+        :param path: path to the database file. It will be created if it
+                     doesn't exist. If ``None``, the index is kept in memory
+        :param normalizers: functions that convert the values of the
+                            certain tags to the normal form, in addition to
+                            the default ones (see ``NORMALIZERS``). The values
+                            of other tags are lowercased, and their spaces are
+                            collapsed
+        :type normalizers: dict({<tag>: callable})
+        :param commit_every: number of new entries after which the changes are
+                             committed to the disk
+        """
+        if path:
+            dname = os.path.dirname(path)
+            if dname and not os.path.isdir(dname):
+                os.makedirs(dname)
+        self._db = sqlite3.connect(path or ':memory:')
+        self._db.executescript('''
+            CREATE TABLE IF NOT EXISTS vals (
+                id INTEGER PRIMARY KEY, tag TEXT, value TEXT,
+                UNIQUE (tag, value)
+            );
+            CREATE TABLE IF NOT EXISTS docs (
+                id INTEGER PRIMARY KEY, doc_id TEXT UNIQUE
+            );
+            CREATE TABLE IF NOT EXISTS postings (
+                val INTEGER, doc INTEGER, par INTEGER, sent INTEGER,
+                token TEXT, PRIMARY KEY (val, doc, par, sent, token)
+            ) WITHOUT ROWID;
+        ''')
+        self.normalizers = dict(NORMALIZERS)
+        if normalizers:
+            self.normalizers.update(normalizers)
+        self._commit_every = commit_every
+        self._uncommitted = 0
+        self._val_ids, self._doc_ids = {}, {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return self._db.execute('SELECT COUNT(*) FROM postings').fetchone()[0]
+
+    def normalize(self, tag, value):
+        """Return the normal form of the *value* of the *tag*"""
+        return self.normalizers.get(tag, norm_default)(value)
+
+    def _get_id(self, table, cache, keys, vals):
+        id_ = cache.get(vals)
+        if id_ is None:
+            cond = ' AND '.join(x + ' = ?' for x in keys)
+            row = self._db.execute(
+                'SELECT id FROM {} WHERE {}'.format(table, cond), vals
+            ).fetchone()
+            if row:
+                id_ = row[0]
+            else:
+                id_ = self._db.execute(
+                    'INSERT INTO {} ({}) VALUES ({})'.format(
+                        table, ', '.join(keys), ', '.join('?' * len(keys))
+                    ), vals
+                ).lastrowid
+            cache[vals] = id_
+        return id_
+
+    def add(self, tag, value, doc_id, par_no, sent_no, token_id):
+        """Add the entity to the index"""
+        val = self._get_id('vals', self._val_ids, ('tag', 'value'),
+                           (tag, self.normalize(tag, value)))
+        doc = self._get_id('docs', self._doc_ids, ('doc_id',), (doc_id,))
+        self._db.execute('INSERT OR IGNORE INTO postings '
+                         '(val, doc, par, sent, token) VALUES (?, ?, ?, ?, ?)',
+                         (val, doc, par_no, sent_no, token_id))
+        self._uncommitted += 1
+        if self._uncommitted >= self._commit_every:
+            self.flush()
+
+    def add_sents(self, doc_id, par_no, sents, tags):
+        """Add the entities of the sentences of one paragraph.
+
+        :param sents: sentences in Parsed CoNLL-U format without metadata
+        :param tags: names of the tags to index
+        :type tags: set(str)
+        """
+        for sent_no, tokens in enumerate(sents, start=1):
+            for token in tokens:
+                misc = token['MISC']
+                if misc:
+                    for tag in misc:
+                        if tag in tags:
+                            self.add(tag, misc[tag], doc_id, par_no,
+                                     sent_no, token['ID'])
+
+    def find(self, tag, value):
+        """Return positions of the entity.
+
+        :return: tuples (doc_id, par_no, sent_no, token_id)
+        :rtype: list(tuple)
+        """
+        return self._db.execute('''
+            SELECT d.doc_id, p.par, p.sent, p.token
+            FROM vals v
+            JOIN postings p ON p.val = v.id
+            JOIN docs d ON d.id = p.doc
+            WHERE v.tag = ? AND v.value = ?
+            ORDER BY p.doc, p.par, p.sent
+        ''', (tag, self.normalize(tag, value))).fetchall()
+
+    def find_docs(self, tag, value):
+        """Return ids of the documents that contain the entity.
+
+        :rtype: set(str)
+        """
+        return set(x[0] for x in self._db.execute('''
+            SELECT DISTINCT d.doc_id
+            FROM vals v
+            JOIN postings p ON p.val = v.id
+            JOIN docs d ON d.id = p.doc
+            WHERE v.tag = ? AND v.value = ?
+        ''', (tag, self.normalize(tag, value))))
+
+    def docs_all(self, *entities):
+        """Return ids of the documents that contain all the *entities*.
+
+        :param entities: tuples (tag, value)
+        :rtype: set(str)
+        """
+        res = None
+        for tag, value in entities:
+            docs = self.find_docs(tag, value)
+            res = docs if res is None else res & docs
+            if not res:
+                break
+        return res or set()
+
+    def docs_any(self, *entities):
+        """Return ids of the documents that contain any of the *entities*.
+
+        :param entities: tuples (tag, value)
+        :rtype: set(str)
+        """
+        res = set()
+        for tag, value in entities:
+            res |= self.find_docs(tag, value)
+        return res
+
+    def values(self, tag=None):
+        """Return all the entities of the index with their numbers of
+        occurences.
+
+        :param tag: if specified, return only entities of that tag
+        :return: tuples (tag, value, count)
+        :rtype: iter(tuple)
+        """
+        return self._db.execute('''
+            SELECT v.tag, v.value, COUNT(*)
+            FROM vals v
+            JOIN postings p ON p.val = v.id
+            {}
+            GROUP BY v.id
+            ORDER BY v.tag, v.value
+        '''.format('' if tag is None else 'WHERE v.tag = ?'),
+            () if tag is None else (tag,))
+
+    def merge(self, other):
+        """Add the content of the *other* index to this index. Entries that
+        are already present are skipped.
+
+        :param other: the index or a path to its database
+        :type other: EntityIndex|str
+        """
+        if isinstance(other, EntityIndex):
+            for row in other._db.execute('''
+                SELECT v.tag, v.value, d.doc_id, p.par, p.sent, p.token
+                FROM postings p
+                JOIN vals v ON v.id = p.val
+                JOIN docs d ON d.id = p.doc
+            '''):
+                tag, value, doc_id, par_no, sent_no, token_id = row
+                val = self._get_id('vals', self._val_ids, ('tag', 'value'),
+                                   (tag, value))
+                doc = self._get_id('docs', self._doc_ids, ('doc_id',),
+                                   (doc_id,))
+                self._db.execute('INSERT OR IGNORE INTO postings '
+                                 '(val, doc, par, sent, token) '
+                                 'VALUES (?, ?, ?, ?, ?)',
+                                 (val, doc, par_no, sent_no, token_id))
+            self.flush()
+            return
+        path = other
+        self.flush()
+        self._db.execute('ATTACH DATABASE ? AS other', (path,))
+        try:
+            self._db.executescript('''
+                INSERT OR IGNORE INTO vals (tag, value)
+                    SELECT tag, value FROM other.vals;
+                INSERT OR IGNORE INTO docs (doc_id)
+                    SELECT doc_id FROM other.docs;
+                INSERT OR IGNORE INTO postings (val, doc, par, sent, token)
+                    SELECT v.id, d.id, p.par, p.sent, p.token
+                    FROM other.postings p
+                    JOIN other.vals ov ON ov.id = p.val
+                    JOIN vals v ON v.tag = ov.tag AND v.value = ov.value
+                    JOIN other.docs od ON od.id = p.doc
+                    JOIN docs d ON d.doc_id = od.doc_id;
+            ''')
+            self._db.commit()
+        finally:
+            self._db.execute('DETACH DATABASE other')
+
+    def remove_doc(self, doc_id):
+        """Remove all the entries of the document from the index. Use it
+        before adding the new version of the document"""
+        self._db.execute('DELETE FROM postings WHERE doc IN '
+                         '(SELECT id FROM docs WHERE doc_id = ?)', (doc_id,))
+        self._uncommitted += 1
+
+    def flush(self):
+        """Commit the changes to the disk"""
+        self._db.commit()
+        self._uncommitted = 0
+
+    def close(self):
+        """Commit the changes and close the database"""
+        if self._db:
+            self.flush()
+            self._db.close()
+            self._db = None
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+# Toxine project: Incremental processing of a growing text
+#
+# Copyright (C) 2019-present by Sergei Ternovykh
+# License: BSD, see LICENSE for details
+"""
+Session for the incremental processing of a text that grows by appending
+(e.g., a chat conversation). Only the unfinished tail of the text is
+reprocessed, so the time of each append doesn't depend on the length of the
+text processed so far.
+"""
+
+
+class IncrementalSession:
+    """Incremental processor of one growing paragraph. Each call of
+    ``append()`` reprocesses the last (unfinished) sentence together with the
+    appended text, so the sentence boundaries and ``norm_punct()`` handling
+    of LF and TAB symbols are the same as if the whole text was processed by
+    ``TextPreprocessor.process_text()``. The sentences that are followed by
+    another sentence are considered finished and never reprocessed. Note,
+    that the taggers that look at the context beyond the sentence (emoji,
+    quotations) may give slightly different results."""
+
+    def __init__(self, tp, max_tail=10000, **kwargs):
+        """
+        :param tp: the preprocessor to use
+        :type tp: toxine.TextPreprocessor
+        :param max_tail: max length of the unfinished tail, in chars. If the
+                         text grows without closing its last sentence, the
+                         tail is considered finished when it gets longer,
+                         and the further text starts a new sentence. If
+                         ``None``, the tail is not limited
+        :type max_tail: int
+        Also, the session receives the params of ``process_text()`` that
+        affect the processing (*silent*, *sent_no*, *cache* and *stats* are
+        not supported).
+        """
+        assert kwargs.get('cache') is None and kwargs.get('stats') is None, \
+            'ERROR: cache and stats are not supported in the session'
+        kwargs.pop('silent', None)
+        kwargs.pop('sent_no', None)
+        kwargs.pop('cache', None)
+        kwargs.pop('stats', None)
+        assert max_tail is None or max_tail > 0, \
+            'ERROR: max_tail must be positive'
+        self._tp = tp
+        self._max_tail = max_tail
+        self._kwargs = kwargs
+        self.reset()
+
+    def reset(self):
+        """Start a new text"""
+        self.sents = []
+        self._pending = ''
+        self._tail_no = 0
+
+    def append(self, text):
+        """Append the *text* and process the unfinished tail.
+
+        :return: tuples (sent_no, tokens, text) of the sentences that are new
+                 or changed since the previous call. *sent_no* is the index of
+                 the sentence in the ``sents`` attribute; if it's less than
+                 the previous length of ``sents``, the sentence replaces the
+                 one emitted earlier. If the reprocessed tail gives less
+                 sentences than before, the ones emitted earlier that are
+                 removed from ``sents`` are reported as (sent_no, None, None)
+        :rtype: list(tuple(int, list, str))
+        """
+        tp, kwargs = self._tp, self._kwargs
+        text = self._pending + text
+        is_tokenized = kwargs.get('is_tokenized', False)
+        tags = {}
+        if is_tokenized:
+            sents = tp.process_text(text, silent=True, tags=tags, **kwargs)
+            # each line is a sentence, so only the last line is unfinished
+            cut = text.rfind('\n') + 1
+            num_done = len(sents) - (1 if text[cut:].strip() else 0)
+        else:
+            sents = tp._split_sents(text, tags=tags, **kwargs)
+            cut, num_done = 0, 0
+            if len(sents) > 1:
+                starts = [x[0] for x in tp._locate_sents(text, sents, tags)]
+                # some taggers (e.g., emoji) look at the whole line, so we
+                # prefer to cut the text at the start of the line
+                for i in range(len(sents) - 1, 0, -1):
+                    lf = text.rfind('\n', 0, starts[i])
+                    if lf >= 0 and not text[lf + 1:starts[i]].strip():
+                        cut, num_done = starts[i], i
+                        break
+                else:
+                    if starts[-1] > 0:
+                        cut, num_done = starts[-1], len(sents) - 1
+            sents = tp._make_sents(sents, silent=True, tags=tags)
+
+        res, tail_no = [], self._tail_no
+        for sent_no, sent in enumerate(sents, start=tail_no):
+            if sent_no < len(self.sents):
+                if self.sents[sent_no] == sent:
+                    continue
+                self.sents[sent_no] = sent
+            else:
+                self.sents.append(sent)
+            res.append((sent_no,) + sent)
+        # the reprocessed tail may give less sentences than before
+        for sent_no in range(tail_no + len(sents), len(self.sents)):
+            res.append((sent_no, None, None))
+        del self.sents[tail_no + len(sents):]
+        # the tail that is never finished is frozen to keep the time bounded
+        if self._max_tail is not None and len(text) - cut > self._max_tail:
+            self._tail_no = tail_no + len(sents)
+            self._pending = ''
+        elif num_done:
+            self._tail_no = tail_no + num_done
+            self._pending = text[cut:]
+        else:
+            self._pending = text
+        return res
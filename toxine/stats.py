@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+# Toxine project: Processing statistics
+#
+# Copyright (C) 2019-present by Sergei Ternovykh
+# License: BSD, see LICENSE for details
+"""
+Collector of the statistics of ``TextPreprocessor.process_text()``: wall time
+of the stages, numbers of matches of the taggers, numbers of calls of the
+expensive functions and the slowest paragraphs.
+"""
+from collections import defaultdict
+from hashlib import sha1
+import heapq
+from time import perf_counter
+
+
+class ProcessingStats:
+    """Opt-in collector of the processing statistics. Pass its instance as the
+    *stats* param of ``TextPreprocessor.process_text()`` or
+    ``TextPreprocessor.do_all()``. If the *stats* param is ``None`` (default),
+    nothing is measured."""
+
+    def __init__(self, top_slowest=10, callback=None):
+        """
+        :param top_slowest: number of the slowest paragraphs to keep
+        :param callback: the function that will be invoked after each
+                         processed paragraph:
+
+                         callback(par_stats)
+
+                         where par_stats is a dict with "hash", "chars",
+                         "secs", "sents", "tokens" and "stages" keys
+        :type callback: callable
+        """
+        assert callback is None or callable(callback), \
+            'ERROR: callback must be either callable or None'
+        self.top_slowest = top_slowest
+        self.callback = callback
+        self.reset()
+
+    def reset(self):
+        """Clear all the collected statistics"""
+        self.pars = self.chars = self.sents = self.tokens = 0
+        self.secs = 0.
+        self.stages = defaultdict(float)
+        self.matches = defaultdict(int)
+        self.calls = defaultdict(int)
+        self._slowest = []
+        self._par_text = None
+        self._par_stages = None
+        self._time0 = self._time = None
+
+    def start(self, text):
+        """Start measuring of the paragraph *text*"""
+        self._par_text = text
+        self._par_stages = defaultdict(float) if self.callback else None
+        self._time0 = self._time = perf_counter()
+
+    def lap(self, stage):
+        """Add the time passed since the previous lap to the *stage*"""
+        time_ = perf_counter()
+        secs = time_ - self._time
+        self.stages[stage] += secs
+        if self._par_stages is not None:
+            self._par_stages[stage] += secs
+        self._time = time_
+
+    def add_matches(self, tagger, num):
+        """Add *num* matches of the *tagger*"""
+        self.matches[tagger] += num
+
+    def count_calls(self, name, func):
+        """Return the wrapper of the *func* that counts its calls under the
+        *name*"""
+        calls = self.calls
+
+        def wrapper(*args, **kwargs):
+            calls[name] += 1
+            return func(*args, **kwargs)
+
+        return wrapper
+
+    def finish(self, sents):
+        """Finish measuring of the current paragraph.
+
+        :param sents: the result of the paragraph processing
+        """
+        secs = perf_counter() - self._time0
+        text = self._par_text
+        num_sents, num_tokens = len(sents), sum(len(x[0]) for x in sents)
+        self.pars += 1
+        self.chars += len(text)
+        self.sents += num_sents
+        self.tokens += num_tokens
+        self.secs += secs
+        par_hash = None
+        if self.top_slowest > 0 and (
+            len(self._slowest) < self.top_slowest
+         or secs > self._slowest[0][0]
+        ):
+            par_hash = self._hash(text)
+            item = (secs, self.pars, par_hash, len(text))
+            if len(self._slowest) < self.top_slowest:
+                heapq.heappush(self._slowest, item)
+            else:
+                heapq.heapreplace(self._slowest, item)
+        if self.callback:
+            self.callback({
+                'hash': par_hash or self._hash(text), 'chars': len(text),
+                'secs': secs, 'sents': num_sents, 'tokens': num_tokens,
+                'stages': dict(self._par_stages)
+            })
+        self._par_text = self._par_stages = None
+
+    @staticmethod
+    def _hash(text):
+        return sha1(text.encode('utf-8')).hexdigest()
+
+    def snapshot(self):
+        """Return the collected statistics.
+
+        :rtype: dict
+        """
+        return {
+            'pars': self.pars, 'chars': self.chars,
+            'sents': self.sents, 'tokens': self.tokens, 'secs': self.secs,
+            'chars_per_sec': self.chars / self.secs if self.secs else 0.,
+            'stages': dict(self.stages), 'matches': dict(self.matches),
+            'calls': dict(self.calls),
+            'slowest': [{'hash': x[2], 'chars': x[3], 'secs': x[0]}
+                            for x in sorted(self._slowest, reverse=True)]
+        }
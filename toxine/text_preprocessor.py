@@ -12,18 +12,23 @@ Tokenization.
 import datetime
 from collections import OrderedDict
 from functools import reduce
+from hashlib import sha1
 from html import unescape
 from nltk import sent_tokenize as nltk_sent_tokenize, \
                  word_tokenize as nltk_word_tokenize
+from nltk.tokenize.punkt import PunktLanguageVars
+from os.path import commonprefix
 from pymorphy2 import MorphAnalyzer
 from re import compile as re_compile, findall as re_findall, \
-               match as re_match, search as re_search, split as re_split, \
-               sub as re_sub
+               escape as re_escape, match as re_match, search as re_search, \
+               split as re_split, sub as re_sub
 import sys
 import uuid
 
 from corpuscula import Conllu, CorpusDict
 from corpuscula.utils import LOG_FILE, print_progress
+from toxine._version import __version__
+from toxine.utils import open_file
 
 word_is_known = MorphAnalyzer().word_is_known
 
@@ -56,6 +61,9 @@ class TextPreprocessor:
 
         self.CHAR_DELIM = '|'
         re_char_delim = '\\' + self.CHAR_DELIM
+        # separator of the texts in process_batch(). Patterns of the taggers
+        # that may span several lines exclude it, so matches can't cross it
+        self.CHAR_SEP = '\uE000'
 
         self.CHARS_PUNCT_ASIS = '+.,:;!?-'
         self.CHARS_PUNCT = '()/"\'«»“”„‟' + self.CHARS_PUNCT_ASIS
@@ -76,6 +84,14 @@ class TextPreprocessor:
         self._REGU = '[' + self.CHARS_REGULAR + ']'
         self._CARE = self._CAPS + self._REGU
 
+        # potential sentence ends as NLTK Punkt sees them. If the text has
+        # none, Punkt returns it as is
+        self.RE_PUNKT_CANDIDATE = PunktLanguageVars().period_context_re()
+        # sentence of plain words which NLTK word tokenizer just splits by
+        # spaces, separating commas and the final punctuation
+        self.RE_PLAIN_SENT = re_compile(
+            r'[ЁА-Яёа-я0-9]+(?:,? +[ЁА-Яёа-я0-9]+)* *[.?!]?'
+        )
         self.RE_LF = re_compile(r'([' + self.CHARS_PUNCT_ASIS + '])\n+')
         self.RE_LF2 = re_compile(r'([^' + self.CHARS_PUNCT_ASIS + '])\n+\s*('
                                + self._NOCA + r')')
@@ -109,9 +125,11 @@ class TextPreprocessor:
                 (^|[^)(:;=-])                             # 11
                 (\)\)+ | \(\(+)                           # 12
             )|(?:
-                (^[^(]*) (^|[^)(:;=-]) (\)+)              # 13-15
+                (^[^(''' + self.CHAR_SEP + ''']*)
+                (^|[^)(:;=-]) (\)+)                       # 13-15
             )|(?:
-                (\(+) ([^)(:;=-]|$) ([^)]*$)              # 16-18
+                (\(+) ([^)(:;=-]|$)
+                ([^)''' + self.CHAR_SEP + ''']*$)         # 16-18
             )|(?:
                 <img\sclass='emoji\scode(\d\d\d\d)'[^>]+>
                 \sЯндекс\sУсловия\sиспользования\s*$      # 19
@@ -154,12 +172,14 @@ class TextPreprocessor:
             )
         (?!\S*''' + re_char_delim + ''')''')
         self.TAG_EMAIL = self.register_tag('EntityEmail', mask='адрес')
+        self.SUB_EMAIL = r' \g<1>@\g<2>' + self.TAG_EMAIL + ' '
         self.RE_XML = re_compile(r'''(?ximu)
             (?:
                 <
                     (?:               # вначале символ "<" (открыли тэг); за ним либо:
                         ([a-z:]+)     #     буквы и знак ":" (имя тэга)
-                        (?:\s[^>]+)?  #     потом м.б. пробел и дальше всё кроме ">",
+                        (?:\s[^>''' + self.CHAR_SEP + r''']+)?
+                                      #     потом м.б. пробел и дальше всё кроме ">",
                     >                 #     а ">" завершает тэг
                     (?:
                         .*            #     потом любые символы,
@@ -170,6 +190,7 @@ class TextPreprocessor:
             )                               # (типа, конец есть, а начало потерялось)
         (?!\S*''' + re_char_delim + ''')''')
         self.TAG_XML = self.register_tag('EntityXml')
+        self.SUB_XML = r' \g<1>\g<2>' + self.TAG_XML + ' '
         # scheme <sss>:[//]
         re_1 = r'''[^\s:]*[^a-z:+.-]'''  # garbage
         re_2 = r'''[a-z][0-9a-z+.-]*'''
@@ -259,12 +280,15 @@ class TextPreprocessor:
 #          + r'{,138})\b(?!\S*' + re_char_delim + ')'
         )
         self.TAG_HASHTAG = self.register_tag('EntityHashtag')
+        self.SUB_HASHTAG = r'\g<1> \g<2>' + self.TAG_HASHTAG + ' '
         self.RE_NAMETAG = re_compile(
             r'(?mu)(^|[\s(])(@[A-Za-z0-9._]'# + self.CHAR_ALPHA + self.CHAR_ALNUM_
           + r'{,138})\b(?!\S*' + re_char_delim + ')'
         )
         self.TAG_NAMETAG = self.register_tag('EntityNametag', mask='ссылка')
-        re_1 = r'\s*[A-ZЁА-Я][^{0}]+[.!?](?:\s*[A-ZЁА-Я][^{0}])*'
+        self.SUB_NAMETAG = r'\g<1> \g<2>' + self.TAG_NAMETAG + ' '
+        re_1 = r'\s*[A-ZЁА-Я][^{0}' + self.CHAR_SEP + r']+[.!?]' \
+               r'(?:\s*[A-ZЁА-Я][^{0}' + self.CHAR_SEP + r'])*'
         self.RE_QUOTATION = re_compile(r'''(?xmu)
             (?:(")({0})("))|    # 1 - 3
             (?:(``)({1})(''))|  # 4 - 6
@@ -284,6 +308,42 @@ class TextPreprocessor:
         self.SHORTCUTS = []
         self.TAG_SHORTCUT = self.CHAR_DELIM + self.CHAR_DELIM + 'Shortcut'
 
+        self.SUBS = [
+            #кавычки
+            #('\u00AB\u00BB\u2039\u203A\u201E\u201A\u201C\u201F\u2018\u201B'
+            # "\u201D\u2019'", '"'),
+            # тире
+            ('\u2012\u2013\u2014\u2015\u203E\u0305\u00AF', ' - '),
+            # дефис
+            ('\u2010\u2011\u2212', '-'),
+            # софт дефис - удалить
+            ('\u00AD', ''),
+            # пробел
+            ('\u2000\u2001\u2002\u2003\u2004\u2005\u2006\u2007\u2008\u2009'
+             '\u200A\u202F\u205F\u2060\u3000', ' '),
+            # пробел нулевой длины
+            ('\u200B\uFEFF', ''),
+            # остальное - десятичный разделитель, булит, диакритические точки,
+            # интерпункт
+            ('\u02CC\u0307\u0323\u2022\u2023\u2043\u204C\u204D\u2219\u25E6'
+             '\u00B7\u00D7\u22C5\u2219\u2062', '.'),
+            # астериск --> звездочка
+            ('\u2217', '*'),
+            # многоточие --> три точки
+            ('…', '...'),
+            # тильда
+            ('\u2241\u224B\u2E2F\u0483', '~'),
+            # скобки
+            ('[{', '('),
+            (']}', ')'),
+            # лишние символы
+            #('*_', ' ')
+        ]
+        self.RE_NOSPACE = re_compile(r'\S+')
+
+        self.TAGGERS = ['pre_tag', 'emoji', 'xml', 'email', 'uri', 'phone',
+                        'date', 'hashtag', 'nametag', 'quotation', 'post_tag']
+
     def add_shortcut(self, orig, subst):
         res = ''
         for subst_ in subst.split():
@@ -327,7 +387,7 @@ class TextPreprocessor:
         :return: number of a paragraph created
         :rtype: int
         """
-        return self.new_pars([text], doc_id)[0]
+        return self.new_pars([text], doc_id=doc_id)[0]
 
     def new_pars(self, pars, eop=r'\n', doc_id=None):
         """Add a list of text blocks as paragraphs to the document. Empty
@@ -439,180 +499,182 @@ class TextPreprocessor:
         You need to change them prior. For default *delim* symbol just run
         ``preprocess_emoji_default()`` before ``remove_delims()``
         TODO: Need to add more complete emojis support"""
-        text = self.RE_EMOJI.sub(
-            lambda x:
-                (x.group(1) + ' ' + x.group(2) + self.TAG_EMOJI + ' '
-                                                                  + x.group(3)
-                     if x.group(2) else '')
-              + (x.group(4) + x.group(5) + self.TAG_EMOJI + ' ' + x.group(6)
-                     if x.group(5) else '')
-              + (x.group(7) + ' ' + x.group(8) + self.TAG_EMOJI + ' '
-                                                                  + x.group(9)
-                     if x.group(8) else '')
-              + (' ' + x.group(10) + self.TAG_EMOJI + ' '
-                     if x.group(10) else '')
-              + (x.group(11) + ' ' + x.group(12) + self.TAG_EMOJI + ' '
-                     if x.group(12) else '')
-              + (x.group(13) + x.group(14) + ' ' + x.group(15)
-                                                        + self.TAG_EMOJI + ' '
-                     if x.group(15) else '')
-              + (' ' + x.group(16) + self.TAG_EMOJI + ' ' + x.group(17)
-                                                                 + x.group(18)
-                     if x.group(16) else '')
-              + (' yandex_' + x.group(19) + self.TAG_EMOJI
-                     if x.group(19) else ''),
-            text
-        )
+        text = self.RE_EMOJI.sub(self._sub_emoji, text)
         return text
 
+    def _sub_emoji(self, x):
+        return (x.group(1) + ' ' + x.group(2) + self.TAG_EMOJI + ' '
+                                                              + x.group(3)
+                    if x.group(2) else '') \
+             + (x.group(4) + x.group(5) + self.TAG_EMOJI + ' ' + x.group(6)
+                    if x.group(5) else '') \
+             + (x.group(7) + ' ' + x.group(8) + self.TAG_EMOJI + ' '
+                                                              + x.group(9)
+                    if x.group(8) else '') \
+             + (' ' + x.group(10) + self.TAG_EMOJI + ' '
+                    if x.group(10) else '') \
+             + (x.group(11) + ' ' + x.group(12) + self.TAG_EMOJI + ' '
+                    if x.group(12) else '') \
+             + (x.group(13) + x.group(14) + ' ' + x.group(15)
+                                                    + self.TAG_EMOJI + ' '
+                    if x.group(15) else '') \
+             + (' ' + x.group(16) + self.TAG_EMOJI + ' ' + x.group(17)
+                                                             + x.group(18)
+                    if x.group(16) else '') \
+             + (' yandex_' + x.group(19) + self.TAG_EMOJI
+                    if x.group(19) else '')
+
     def _tag_email(self, text):
-        text = self.RE_EMAIL.sub(r' \g<1>@\g<2>' + self.TAG_EMAIL + ' ', text)
+        text = self.RE_EMAIL.sub(self.SUB_EMAIL, text)
         return text
 
     def _tag_xml(self, text):
-        text = self.RE_XML.sub(r' \g<1>\g<2>' + self.TAG_XML + ' ', text)
+        text = self.RE_XML.sub(self.SUB_XML, text)
         return text
 
     def _tag_uri(self, text):
-        def process(match):
-            uri, garbage, scheme, scheme_tail, user_login, user_passwd, \
-                host, port, path, params, query, fragment = match.groups()
-            scnt = scheme.count(':') if scheme else -1
-            hcnt =   host.count('.') if   host else -1
-            isuri = (
-                scheme and (path or query)
-            ) or (
-                # есть схема, а в хосте хотя бы одна точка, и при этом
-                # в домене хоста либо только латинские буквы, либо конкретные
-                # доменные зоны, либо хост - это ровно 4 числа (ip-адрес)
-                ((scheme and hcnt >= 0) or hcnt >= 2) and re_search(r'''(?xiu)
-                    ^
+        text = self.RE_URI.sub(self._sub_uri, text)
+        return text
+
+    def _sub_uri(self, match):
+        uri, garbage, scheme, scheme_tail, user_login, user_passwd, \
+            host, port, path, params, query, fragment = match.groups()
+        # without scheme, neither uri nor english name can be dotless
+        if not scheme and '.' not in uri:
+            return match.group(0)
+        scnt = scheme.count(':') if scheme else -1
+        hcnt =   host.count('.') if   host else -1
+        isuri = (
+            scheme and (path or query)
+        ) or (
+            # есть схема, а в хосте хотя бы одна точка, и при этом
+            # в домене хоста либо только латинские буквы, либо конкретные
+            # доменные зоны, либо хост - это ровно 4 числа (ip-адрес)
+            ((scheme and hcnt >= 0) or hcnt >= 2) and re_search(r'''(?xiu)
+                ^
+                (?:
                     (?:
+                        (?: [ёа-я]+ [.-]? )?                         # head
+                        # only ascii
+                        (?: [0-9a-z][0-9a-z-]*\. )*
+                        (?: [a-z][a-z-]+ )           # java errors included
+                                    # '{1,10}' instead of '+' for http uris
+                    )|(?:
+                        # known cyrillic zones
                         (?:
-                            (?: [ёа-я]+ [.-]? )?                         # head
-                            # only ascii
-                            (?: [0-9a-z][0-9a-z-]*\. )*
-                            (?: [a-z][a-z-]+ )           # java errors included
-                                        # '{1,10}' instead of '+' for http uris
-                        )|(?:
-                            # known cyrillic zones
                             (?:
-                                (?:
-                                     [0-9a-z][0-9a-z-]*
-                                |
-                                    [0-9ёа-я][0-9ёа-я-]*
-                                )
-                                \.
-                            )+
-                            (?: бг | бел | рф | срб | укр )  # don't add 'ru'!
-                        )
-                    )
-                    (?: [.-] [ёа-я]+ )?                                  # tail
-                    $
-                ''', host)
-            ) or (
-                # <scheme>://<ip-addr>
-                scheme and scheme_tail and hcnt == 3
-            and not re_search('[^0-9.]', host)
-            and reduce(lambda y, x: x >= 0 and x <= 255 and y,
-                       map(int, re_findall(r'\b(\d{1,3})\b', host)), True)
-            ) or (
-                # поддерживаем urn'ы
-                scnt >= 2 and host
-            )
-            # workaround for english names:
-            toks = match.group(0).split('.')
-            if re_match('(?:[A-Z]\.){1,4}[A-Z][A-Za-z]+', match.group(0)):
-                res = match.group(0).replace('.', '. ')
-            elif isuri:
-                head = tail = None
-                if host and not (scheme and user_login and user_passwd):
-                    head = re_search('^([ёа-я]+[.-]?)[0-9a-z]', host)
-                    if head:
-                        head = head.group(1)
-                        uri = uri[len(head):]
-                if path or params or query or fragment:
-                    tail = re_search('(?i)([.,:;!()-]+[ёа-я]*)$', uri)
-                elif host:
-                    tail = re_search(
-                        '(?i)(?=(?!\.(?:бг|бел|рф|срб|укр)$))([.-][ёа-я]+)$',
-                        uri
+                                 [0-9a-z][0-9a-z-]*
+                            |
+                                [0-9ёа-я][0-9ёа-я-]*
+                            )
+                            \.
+                        )+
+                        (?: бг | бел | рф | срб | укр )  # don't add 'ru'!
                     )
-                if tail:
-                    tail = tail.group(1)
-                    #uri = uri.rsplit(tail, 1)[0]
-                    uri = uri[:-len(tail)]
-                if garbage:
-                    uri = uri[len(garbage):]
-                res = (garbage if garbage else '') \
-                    + (head if head else '') \
-                    + ' ' + uri + self.TAG_URI + ' ' \
-                    + (tail if tail else '')
-            else:
-                res = match.group(0)
-            return res
-        text = self.RE_URI.sub(process, text)
-        return text
+                )
+                (?: [.-] [ёа-я]+ )?                                  # tail
+                $
+            ''', host)
+        ) or (
+            # <scheme>://<ip-addr>
+            scheme and scheme_tail and hcnt == 3
+        and not re_search('[^0-9.]', host)
+        and reduce(lambda y, x: x >= 0 and x <= 255 and y,
+                   map(int, re_findall(r'\b(\d{1,3})\b', host)), True)
+        ) or (
+            # поддерживаем urn'ы
+            scnt >= 2 and host
+        )
+        # workaround for english names:
+        toks = match.group(0).split('.')
+        if re_match('(?:[A-Z]\.){1,4}[A-Z][A-Za-z]+', match.group(0)):
+            res = match.group(0).replace('.', '. ')
+        elif isuri:
+            head = tail = None
+            if host and not (scheme and user_login and user_passwd):
+                head = re_search('^([ёа-я]+[.-]?)[0-9a-z]', host)
+                if head:
+                    head = head.group(1)
+                    uri = uri[len(head):]
+            if path or params or query or fragment:
+                tail = re_search('(?i)([.,:;!()-]+[ёа-я]*)$', uri)
+            elif host:
+                tail = re_search(
+                    '(?i)(?=(?!\.(?:бг|бел|рф|срб|укр)$))([.-][ёа-я]+)$',
+                    uri
+                )
+            if tail:
+                tail = tail.group(1)
+                #uri = uri.rsplit(tail, 1)[0]
+                uri = uri[:-len(tail)]
+            if garbage:
+                uri = uri[len(garbage):]
+            res = (garbage if garbage else '') \
+                + (head if head else '') \
+                + ' ' + uri + self.TAG_URI + ' ' \
+                + (tail if tail else '')
+        else:
+            res = match.group(0)
+        return res
 
     def _tag_phone(self, text):
-        def process(match):
-            pre, p1, p2, p3, p4, p5, post = match.groups()
-            if p1 not in ('', '+7', '7', '8'):
-                res = match.group(0)
-            else:
-                phone = p2 + p3 + p4 + p5
-                if len(phone) == 11 and phone[0] in ('7', '8'):
-                    phone = phone[1:]
-                res = '{} +7{}{} '.format(pre, phone, self.TAG_PHONE) \
-                    if len(phone) == 10 else match.group(0)
-            return res
-        text = self.RE_PHONE.sub(process, text)
+        text = self.RE_PHONE.sub(self._sub_phone, text)
         return text
 
-    def _tag_date(self, text):
-        def process(match):
+    def _sub_phone(self, match):
+        pre, p1, p2, p3, p4, p5, post = match.groups()
+        if p1 not in ('', '+7', '7', '8'):
             res = match.group(0)
-            d, m, y = int(match.group(1)), int(match.group(2)), match.group(3)
-            if len(y) == 2: y = '20' + y
-            y = int(y)
-            end = match.group(4)
-            try:
-                if y > 1900 and y < 2030:
-                    res = ' ' + str(datetime.date(y, m, d)) + self.TAG_DATE + \
-                          ' ' + (end if end else '')
-            except ValueError:
-                pass
-            return res
-        text = self.RE_DATE.sub(process, text)
+        else:
+            phone = p2 + p3 + p4 + p5
+            if len(phone) == 11 and phone[0] in ('7', '8'):
+                phone = phone[1:]
+            res = '{} +7{}{} '.format(pre, phone, self.TAG_PHONE) \
+                if len(phone) == 10 else match.group(0)
+        return res
+
+    def _tag_date(self, text):
+        text = self.RE_DATE.sub(self._sub_date, text)
         return text
 
+    def _sub_date(self, match):
+        res = match.group(0)
+        d, m, y = int(match.group(1)), int(match.group(2)), match.group(3)
+        if len(y) == 2: y = '20' + y
+        y = int(y)
+        end = match.group(4)
+        try:
+            if y > 1900 and y < 2030:
+                res = ' ' + str(datetime.date(y, m, d)) + self.TAG_DATE + \
+                      ' ' + (end if end else '')
+        except ValueError:
+            pass
+        return res
+
     def _tag_hashtag(self, text):
-        text = self.RE_HASHTAG.sub(
-            r'\g<1> \g<2>' + self.TAG_HASHTAG + ' ', text
-        )
+        text = self.RE_HASHTAG.sub(self.SUB_HASHTAG, text)
         return text
 
     def _tag_nametag(self, text):
-        text = self.RE_NAMETAG.sub(
-            r'\g<1> \g<2>' + self.TAG_NAMETAG + ' ', text
-        )
+        text = self.RE_NAMETAG.sub(self.SUB_NAMETAG, text)
         return text
 
     def _tag_quotation(self, text):
-        def process(match):
-            res = match.group(0)
-            for i in range(1, 12, 3):
-                q1 = match.group(i)
-                if q1:
-                    q2, q3 = match.group(i + 1), match.group(i + 2)
-                    res = q1 + self.TAG_QUOTATION_START + ' ' \
-                        + q2 + ' ' \
-                        + q3 + self.TAG_QUOTATION_END + ' '
-                    break
-            return res
-        text = self.RE_QUOTATION.sub(process, text)
+        text = self.RE_QUOTATION.sub(self._sub_quotation, text)
         return text
 
+    def _sub_quotation(self, match):
+        res = match.group(0)
+        for i in range(1, 12, 3):
+            q1 = match.group(i)
+            if q1:
+                q2, q3 = match.group(i + 1), match.group(i + 2)
+                res = q1 + self.TAG_QUOTATION_START + ' ' \
+                    + q2 + ' ' \
+                    + q3 + self.TAG_QUOTATION_END + ' '
+                break
+        return res
+
     def norm_punct(self, text, islf_eos=True, istab_eos=True,
                    ignore_case=False):
         """Some heuristics to normalize Russian punctuation. Use it for chat
@@ -900,11 +962,67 @@ class TextPreprocessor:
 
         :rtype: list
         """
-        text = text.replace('«', '``').replace('“', '``').replace('„', "``") \
-                   .replace('»', "''").replace('”', "''").replace('‟', "''")
+        text = self._replace_quotes(text)
+        sents_ = nltk_sent_tokenize(text, language='russian') \
+                     if self.RE_PUNKT_CANDIDATE.search(text) else \
+                 [text.rstrip()] if text.strip() else \
+                 []
+        return self._postprocess_sents(sents_, kill_empty=kill_empty)
+
+    def _sent_tokenize_batch(self, texts, kill_empty=True):
+        """Return sentence-tokenized copies of the *texts*. The sentence
+        tokenizer is run once over all the *texts* joined with a separator;
+        the result is the same as of ``sent_tokenize()`` for each text. The
+        *texts* must not contain ``CHAR_SEP``.
+
+        :rtype: list(list)
+        """
+        char_sep = self.CHAR_SEP
+        # Punkt sees a potential sentence end in a period that is followed by
+        # another token only, so the separator makes the end of a text the
+        # candidate, too. That is harmless unless the last word of the text
+        # contains another candidate that Punkt would join with it (e.g.
+        # 'word!!!'); such texts are tokenized separately
+        re_unsafe = re_compile(r'[.?!][)";}\]*:@\'({\[!?]\S*[.?!]$')
+        sents, joined = [None] * len(texts), []
+        for i, text in enumerate(texts):
+            if re_unsafe.search(text.rstrip()):
+                sents[i] = nltk_sent_tokenize(self._replace_quotes(text),
+                                              language='russian')
+            else:
+                sents[i] = []
+                joined.append(i)
+        if joined:
+            idx = iter(joined)
+            i = next(idx)
+            for sent in nltk_sent_tokenize(
+                self._replace_quotes(('\n' + char_sep + '\n')
+                                         .join(texts[x] for x in joined)),
+                language='russian'
+            ):
+                parts = sent.split(char_sep)
+                last = len(parts) - 1
+                for j, part in enumerate(parts):
+                    if j:
+                        # the next text starts after LF of the separator
+                        i = next(idx)
+                        part = part[1:]
+                    if j < last:
+                        # the last sentence of the text is stripped by the
+                        # tokenizer
+                        part = part.rstrip()
+                    if part:
+                        sents[i].append(part)
+        return [self._postprocess_sents(x, kill_empty=kill_empty)
+                    for x in sents]
 
-        sents_ = nltk_sent_tokenize(text, language='russian')
+    @staticmethod
+    def _replace_quotes(text):
+        return text.replace('«', '``').replace('“', '``').replace('„', "``") \
+                   .replace('»', "''").replace('”', "''").replace('‟', "''")
 
+    def _postprocess_sents(self, sents_, kill_empty=True):
+        """Fix the result of NLTK sentence tokenizer"""
         re_ellipsis = re_compile(r'(\.\.\.)\s+([0-9A-ZЁА-Я])')
         def parse_el(sent):
             sents = []
@@ -990,6 +1108,15 @@ class TextPreprocessor:
                    + tokens[idx + 2:]
         return tokens
 
+    def _word_tokenize(self, text):
+        """The same as ``word_tokenize()``, but the sentences of plain words
+        are split without NLTK"""
+        if self.RE_PLAIN_SENT.fullmatch(text):
+            return text[:-1].replace(',', ' , ').split() + [text[-1]] \
+                       if text[-1] in '.?!' else \
+                   text.replace(',', ' , ').split()
+        return self.word_tokenize(text)
+
     @staticmethod
     def tokenize(text, kill_empty=True):
         """Return tokenized copy of *text*
@@ -1016,125 +1143,42 @@ class TextPreprocessor:
         self.TAG_MASKS[tag_] = mask
         return tag_
 
-    def process_text(self, text, chars_allowed=None, unescape_html=True,
-                     pre_tag=None, tag_emoji=True, tag_xml=True,
-                     tag_email=True, tag_uri=True, tag_phone=True,
-                     tag_date=True, tag_hashtag=True, tag_nametag=True,
-                     post_tag=None, split_unk=False, tag_unk=True,
-                     is_tokenized=False, norm_punct=False, islf_eos=True,
-                     istab_eos=True, ignore_case=False, silent=False,
-                     sent_no=0, tags={}):
-        """Make preprocessing (including tokenization) for the given *text*
-
-        :param chars_allowed: allowed charset (all allowed symbols for use in
-                              "[]" regex). If ``False``, all symbols are
-                              allowed. `None` means default charset (see
-                              sources).
-        :type chars_allowed: str|False
-
-        :param unescape_html: do we need to make back transformation from
-                              escaped html
-
-        :param pre_tag: external tagger (or just preprocessor) that will be
-                        run before all internal taggers:
-
-                        text = pre_tag(text, delim)
-
-                        where delim is a character to separate tag signature
-        :type pre_tag: callable
-
-        :param tag_date:
-        :param tag_email:
-        :param tag_emoji:
-        :param tag_hashtag:
-        :param tag_nametag:
-        :param tag_phone:
-        :param tag_uri:
-        :param tag_xml:
-        Preprocessors we want to run. They will be started exactly in that
-        order. May be callable with the same signature as for *pre_tag*.
-
-        :param post_tag: external tagger (or just preprocessor) that will be
-                         run after all internal taggers. The signature is the
-                         same as for *pre_tag*: text = post_tag(text, delim).
-        :type post_tag: callable
-        :param split_unk: split tokens with disallowed chars, if these chars
-                          placed only at the begin or/and at the end of the
-                          token
-        :param tag_unk: add special tag to the tokens with disallowed chars
-        :param is_tokenized: ``True`` meant that sentences may be splitted by
-                            the LF symbol, and words may be splitted by spaces
-        :param norm_punct: normalize punctuations. Use it if you process
-                           text chats or forum messages
-
-        Params for ``norm_punct()``:
-        :param islf_eos: LF symbol marks end of sentence; replace to "."
-        :param istab_eos: TAB symbol marks end of sentence; replace to "."
-        :param ignore_case: do not consider character case during processing
-
-        :param silent: suppress log
-        :param sent_no: init value for the progress indicator (has effect if
-                        silent is False)
-        :param tags: storage for found tags
-        :type tags: dict(tag, value)
-        """
-        assert pre_tag is None or callable(pre_tag), \
-            'ERROR: ext_pre must be either callable or None'
-        assert post_tag is None or callable(post_tag), \
-            'ERROR: ext_post must be either callable or None'
-
-        if chars_allowed != False:
-            chars_allowed = r'\s' + (chars_allowed if chars_allowed else
-                                     self.CHARS_ALLOWED)
-        SUBS = [
-            #кавычки
-            #('\u00AB\u00BB\u2039\u203A\u201E\u201A\u201C\u201F\u2018\u201B'
-            # "\u201D\u2019'", '"'),
-            # тире
-            ('\u2012\u2013\u2014\u2015\u203E\u0305\u00AF', ' - '),
-            # дефис
-            ('\u2010\u2011\u2212', '-'),
-            # софт дефис - удалить
-            ('\u00AD', ''),
-            # пробел
-            ('\u2000\u2001\u2002\u2003\u2004\u2005\u2006\u2007\u2008\u2009'
-             '\u200A\u202F\u205F\u2060\u3000', ' '),
-            # пробел нулевой длины
-            ('\u200B\uFEFF', ''),
-            # остальное - десятичный разделитель, булит, диакритические точки,
-            # интерпункт
-            ('\u02CC\u0307\u0323\u2022\u2023\u2043\u204C\u204D\u2219\u25E6'
-             '\u00B7\u00D7\u22C5\u2219\u2062', '.'),
-            # астериск --> звездочка
-            ('\u2217', '*'),
-            # многоточие --> три точки
-            ('…', '...'),
-            # тильда
-            ('\u2241\u224B\u2E2F\u0483', '~'),
-            # скобки
-            ('[{', '('),
-            (']}', ')'),
-            # лишние символы
-            #('*_', ' ')
-        ]
-
-        RE_NOSPACE = re_compile(r'\S+')
-
-        def process_re_tag(match):
+    def _process_tags(self, text, tags):
+        """Replace tokens tagged by taggers to their numbers in the *tags*
+        storage"""
+        def process(match):
             token, tag = match.groups()
             taglist = tags.setdefault(tag, [])
             tag = str(len(taglist)) + self.CHAR_DELIM + tag 
             taglist.append(token)
             return tag
 
-        def process_re_nospace(match):
+        return self.RE_TAG.sub(process, text)
+
+    def _process_nospace(self, text, chars_allowed, split_unk, tag_unk, tags):
+        """Normalize symbols of the *text* tokens and tag tokens with
+        disallowed chars.
+
+        :param chars_allowed: allowed charset already prepared for "[]" regex
+                              or ``False``
+        """
+        re_subs = re_compile('[{}]'.format(
+            re_escape(''.join(x[0] for x in self.SUBS))
+        ))
+        re_unk = re_compile(r'[^ ' + chars_allowed + ']') \
+                     if chars_allowed else \
+                 None
+        _TAG_UNK = self.TAG_UNK.replace(self.CHAR_DELIM, '')
+
+        def process(match):
 
             token = match.group(0)
             if self.CHAR_DELIM not in token:
-                for search, replace in SUBS:
-                    for c in search:
-                       if c in token:
-                           token = token.replace(c, replace)
+                if re_subs.search(token):
+                    for search, replace in self.SUBS:
+                        for c in search:
+                           if c in token:
+                               token = token.replace(c, replace)
                 # извращения
                 if '<<' in token:
                     token = re_sub(r'<<<+', r' . ', token)
@@ -1143,11 +1187,7 @@ class TextPreprocessor:
                     token = re_sub(r'>>>+', r' . ', token)
                     token = token.replace('>>', ' " ')
 
-                _TAG_UNK = self.TAG_UNK.replace(self.CHAR_DELIM, '')
-
-                isunk = re_search(r'[^ ' + chars_allowed + ']', token) \
-                            if chars_allowed else \
-                        False
+                isunk = re_unk.search(token) if re_unk else False
                 if isunk:
                     # если вначале и/или в конце знаки пунктуации, то сохраняем их
                     p1 = p2 = ''
@@ -1201,20 +1241,21 @@ class TextPreprocessor:
                     token = p1 + ' ' + token + ' ' + p2
             return token
 
-        if unescape_html:
-            text = unescape_html(text) \
-                       if callable(unescape_html) else \
-                   self._unescape_html(text)
-
-        text = self._remove_delims(text)
+        return self.RE_NOSPACE.sub(process, text)
 
+    def _run_taggers(self, text, pre_tag=None, tag_emoji=True, tag_xml=True,
+                     tag_email=True, tag_uri=True, tag_phone=True,
+                     tag_date=True, tag_hashtag=True, tag_nametag=True,
+                     post_tag=None, stats=None):
+        """Run the chain of taggers over the *text*"""
         def run_tagger(tagger, default_tagger):
             return tagger(text, self.CHAR_DELIM) if callable(tagger) else \
                    default_tagger(text) if tagger else \
                    text
 
         tag_quotation = True
-        for tagger, default_tagger in zip(
+        for name, tagger, default_tagger in zip(
+            self.TAGGERS,
             [pre_tag, tag_emoji, tag_xml, tag_email,
              tag_uri, tag_phone, tag_date, tag_hashtag,
              tag_nametag, tag_quotation, post_tag],
@@ -1222,18 +1263,482 @@ class TextPreprocessor:
              self._tag_uri, self._tag_phone, self._tag_date, self._tag_hashtag,
              self._tag_nametag, self._tag_quotation, lambda x: x]
          ):
-            text = run_tagger(tagger, default_tagger)
+            if stats is None:
+                text = run_tagger(tagger, default_tagger)
+            elif tagger:
+                # the text is cleared of delims before tagging, so each delim
+                # marks a tag added by some tagger
+                num_delims = text.count(self.CHAR_DELIM)
+                text = run_tagger(tagger, default_tagger)
+                stats.lap('tag_' + name)
+                stats.add_matches(name,
+                                  text.count(self.CHAR_DELIM) - num_delims)
+        return text
+
+    def _make_sent(self, wforms, tags):
+        """Convert the list of *wforms* into Parsed CoNLL-U sentence with
+        restoring of the tagged tokens.
+
+        :return: tokens of the sentence and its text
+        :rtype: tuple(list, str)
+        """
+        if any('\u00AD' in x for x in wforms):
+            tokens = Conllu.from_sentence(wforms)
+        else:
+            # the same as Conllu.from_sentence() makes, but much faster
+            tokens = [{'ID': str(i), 'FORM': x, 'LEMMA': None, 'UPOS': None,
+                       'XPOS': None, 'FEATS': OrderedDict(), 'HEAD': None,
+                       'DEPREL': None, 'DEPS': None, 'MISC': OrderedDict()}
+                          for i, x in enumerate(wforms, start=1)]
+        text = ''
+        space_before = False
+        for i, token in enumerate(tokens):
+            wform = token['FORM']
+            delim_pos = wform.find(self.CHAR_DELIM)
+            misc = token['MISC']
+            if delim_pos >= 0:
+                idx = int(wform[:delim_pos])
+                tag = wform[delim_pos:]
+                if tag == self.TAG_SHORTCUT:
+                    subst, orig = self.SHORTCUTS[idx]
+                    token['FORM'] = subst
+                    misc[self.TAG_SHORTCUT[2:]] = orig
+                else:
+                    mask = self.TAG_MASKS[tag]
+                    tag = tag[1:]
+                    orig = tags[tag][idx]
+                    token['FORM'] = mask
+                    misc[tag] = orig
+                    if space_before:
+                        text += ' '
+                    text += orig
+            elif wform in ['``', '(', '«']:
+                misc['SpaceAfter'] = 'No'
+                if space_before:
+                    text += ' '
+                text += wform
+            elif i > 0 \
+             and wform in ['.', ',', ':', ';', '...',
+                           '!', '?', '!..', '?..', "''", ')', '»']:
+                tokens[i - 1]['MISC']['SpaceAfter'] = 'No'
+                text += wform
+            else:
+                if space_before:
+                    text += ' '
+                text += wform
+            space_before = misc.get('SpaceAfter') != 'No'
+        return tokens, text
+
+    def _get_tagger_subs(self, tag_emoji=True, tag_xml=True, tag_email=True,
+                         tag_uri=True, tag_phone=True, tag_date=True,
+                         tag_hashtag=True, tag_nametag=True):
+        """Return regexes and substitutions of the enabled internal taggers in
+        the order of their execution"""
+        subs = []
+        for tagger, regex, sub in zip(
+            [tag_emoji, tag_xml, tag_email, tag_uri,
+             tag_phone, tag_date, tag_hashtag, tag_nametag],
+            [self.RE_EMOJI, self.RE_XML, self.RE_EMAIL, self.RE_URI,
+             self.RE_PHONE, self.RE_DATE, self.RE_HASHTAG, self.RE_NAMETAG],
+            [self._sub_emoji, self.SUB_XML, self.SUB_EMAIL, self._sub_uri,
+             self._sub_phone, self._sub_date, self.SUB_HASHTAG,
+             self.SUB_NAMETAG]
+        ):
+            assert not callable(tagger), \
+                'ERROR: external taggers are not supported in this mode'
+            if tagger:
+                subs.append((regex, sub if callable(sub) else
+                                    lambda x, sub=sub: x.expand(sub)))
+        return subs
+
+    def extract_entities(self, text, tag_emoji=True, tag_xml=True,
+                         tag_email=True, tag_uri=True, tag_phone=True,
+                         tag_date=True, tag_hashtag=True, tag_nametag=True):
+        """Find entities in the *text* with the internal taggers only,
+        without tokenization. Params are the same as for ``process_text()``;
+        external taggers are not supported.
+
+        Each entity found is replaced with spaces before the next tagger is
+        started (as if it was a separate token), so the offsets are kept and
+        the entity can't be found twice.
+
+        :return: tuples (start, end, tag, value), where *start* and *end* are
+                 offsets of the entity in the *text*, and *value* is the
+                 entity as the tagger normalized it
+        :rtype: list(tuple(int, int, str, str))
+        """
+        delim = self.CHAR_DELIM
+        text = self._remove_delims(text)
+        entities = []
+        for regex, sub in self._get_tagger_subs(
+            tag_emoji=tag_emoji, tag_xml=tag_xml, tag_email=tag_email,
+            tag_uri=tag_uri, tag_phone=tag_phone, tag_date=tag_date,
+            tag_hashtag=tag_hashtag, tag_nametag=tag_nametag
+        ):
+            chunks, pos = [], 0
+            for match in regex.finditer(text):
+                res, orig = sub(match), match.group(0)
+                tag_pos = res.find(delim)
+                if tag_pos < 0:
+                    continue
+                # res = <head> + ' ' + <value> + <tag> + ' ' + <tail>, where
+                # <head> and <tail> are the parts of the match kept as is
+                value_pos = res.rfind(' ', 0, tag_pos) + 1
+                value = res[value_pos:tag_pos]
+                tag_end = res.find(' ', tag_pos)
+                if tag_end < 0:
+                    tag_end = len(res)
+                tag = res[tag_pos + len(delim):tag_end]
+                head, tail = res[:value_pos], res[tag_end + 1:]
+                if head.endswith(' '):
+                    head = head[:-1]
+                start, end = match.span()
+                if head:
+                    start += len(commonprefix([head, orig]))
+                if tail:
+                    end -= len(commonprefix([tail[::-1], orig[::-1]]))
+                while start < end and text[start].isspace():
+                    start += 1
+                while end > start and text[end - 1].isspace():
+                    end -= 1
+                if start == end:
+                    continue
+                entities.append((start, end, tag, value))
+                chunks.append(text[pos:start])
+                chunks.append(' ' * (end - start))
+                pos = end
+            if chunks:
+                chunks.append(text[pos:])
+                text = ''.join(chunks)
+        entities.sort()
+        return entities
+
+    def redact(self, text, masks=None, **kwargs):
+        """Replace the entities in the *text* with their masks (see
+        ``register_tag()``). Only the taggers are run, without tokenization.
+
+        :param masks: masks for the tags to use instead of the registered
+                      ones. If the mask for the tag is empty, the entities of
+                      that tag are kept intact
+        :type masks: dict({<tag>: <mask>})
+        Also, the method receives the params of ``extract_entities()`` to
+        specify the taggers to run.
+        :rtype: str
+        """
+        chunks, pos = [], 0
+        for start, end, tag, _ in self.extract_entities(text, **kwargs):
+            mask = masks.get(tag) if masks and tag in masks else \
+                   self.TAG_MASKS.get(self.CHAR_DELIM + tag)
+            if mask:
+                chunks.append(text[pos:start])
+                chunks.append(mask)
+                pos = end
+        chunks.append(text[pos:])
+        return ''.join(chunks)
+
+    def _split_sents(self, text, chars_allowed=None, unescape_html=True,
+                     pre_tag=None, tag_emoji=True, tag_xml=True,
+                     tag_email=True, tag_uri=True, tag_phone=True,
+                     tag_date=True, tag_hashtag=True, tag_nametag=True,
+                     post_tag=None, split_unk=False, tag_unk=True,
+                     is_tokenized=False, norm_punct=False, islf_eos=True,
+                     istab_eos=True, ignore_case=False, tags={}, stats=None):
+        """Run all the stages of ``process_text()`` up to the sentence
+        tokenization inclusive.
+
+        :return: sentences with tagged tokens replaced by their numbers in the
+                 *tags* storage
+        :rtype: list(str)
+        """
+        if chars_allowed != False:
+            chars_allowed = r'\s' + (chars_allowed if chars_allowed else
+                                     self.CHARS_ALLOWED)
 
-        text = self.RE_TAG.sub(process_re_tag, text)
-        text = RE_NOSPACE.sub(process_re_nospace, text)
+        if unescape_html:
+            text = unescape_html(text) \
+                       if callable(unescape_html) else \
+                   self._unescape_html(text)
+            if stats is not None:
+                stats.lap('unescape_html')
+
+        text = self._remove_delims(text)
+        if stats is not None:
+            stats.lap('remove_delims')
+        text = self._run_taggers(
+            text, pre_tag=pre_tag, tag_emoji=tag_emoji, tag_xml=tag_xml,
+            tag_email=tag_email, tag_uri=tag_uri, tag_phone=tag_phone,
+            tag_date=tag_date, tag_hashtag=tag_hashtag,
+            tag_nametag=tag_nametag, post_tag=post_tag, stats=stats
+        )
+        text = self._process_tags(text, tags)
+        if stats is not None:
+            stats.lap('process_tags')
+        text = self._process_nospace(text, chars_allowed, split_unk, tag_unk,
+                                     tags)
+        if stats is not None:
+            stats.lap('process_nospace')
         if norm_punct:
-            text = self.norm_punct(text, islf_eos=islf_eos,
-                                         istab_eos=istab_eos,
-                                         ignore_case=ignore_case)
+            if stats is None:
+                text = self.norm_punct(text, islf_eos=islf_eos,
+                                             istab_eos=istab_eos,
+                                             ignore_case=ignore_case)
+            else:
+                wform_isknown = self.wform_isknown
+                self.wform_isknown = stats.count_calls('wform_isknown',
+                                                       wform_isknown)
+                try:
+                    text = self.norm_punct(text, islf_eos=islf_eos,
+                                                 istab_eos=istab_eos,
+                                                 ignore_case=ignore_case)
+                finally:
+                    self.wform_isknown = wform_isknown
+                stats.lap('norm_punct')
 
         sents = [x for x in [x.strip() for x in text.split('\n')] if x] \
                     if is_tokenized else \
                 self.sent_tokenize(text, kill_empty=True)
+        if stats is not None:
+            stats.lap('sent_tokenize')
+        return sents
+
+    def _split_tokenized(self, text, chars_allowed=None, unescape_html=True,
+                         pre_tag=None, tag_emoji=True, tag_xml=True,
+                         tag_email=True, tag_uri=True, tag_phone=True,
+                         tag_date=True, tag_hashtag=True, tag_nametag=True,
+                         post_tag=None, split_unk=False, tag_unk=True,
+                         tags={}, stats=None):
+        """Fast lane of ``process_text()`` for the pre-tokenized *text*: each
+        line is a sentence, and its tokens are separated by spaces. External
+        taggers are run over the whole lines, but the internal ones are run
+        over the separate tokens that may be entities only. Lines that
+        contain neither such tokens nor chars to normalize are just splitted.
+
+        :return: wforms of the sentences with tagged tokens replaced by their
+                 numbers in the *tags* storage
+        :rtype: list(list(str))
+        """
+        if chars_allowed != False:
+            chars_allowed = r'\s' + (chars_allowed if chars_allowed else
+                                     self.CHARS_ALLOWED)
+        re_special = '[{}]|<<|>>'.format(
+            re_escape(''.join(x[0] for x in self.SUBS))
+        )
+        if chars_allowed:
+            re_special = '[^{}]|{}'.format(chars_allowed, re_special)
+        re_special = re_compile(re_special)
+        # the single brackets are never tagged here: the emoji patterns
+        # treat the unbalanced ones as smiles, but the balance can't be
+        # checked token by token
+        plain_wforms = {'.', ',', ':', ';', '!', '?', '...', '-', '"',
+                        '«', '»', '``', "''", '(', ')', '[', ']', '{', '}'}
+        is_tagging = any((tag_emoji, tag_xml, tag_email, tag_uri, tag_phone,
+                          tag_date, tag_hashtag, tag_nametag))
+        delim = self.CHAR_DELIM
+
+        if unescape_html:
+            text = unescape_html(text) \
+                       if callable(unescape_html) else \
+                   self._unescape_html(text)
+            if stats is not None:
+                stats.lap('unescape_html')
+        text = self._remove_delims(text)
+        if stats is not None:
+            stats.lap('remove_delims')
+
+        sents = []
+        for sent in text.split('\n'):
+            if pre_tag:
+                sent = pre_tag(sent, delim)
+            wforms = sent.split()
+            if not wforms:
+                continue
+            is_plain = not pre_tag
+            if is_tagging:
+                for i, wform in enumerate(wforms):
+                    if not (wform.isalpha() or wform in plain_wforms):
+                        wforms[i] = self._run_taggers(
+                            wform, tag_emoji=tag_emoji, tag_xml=tag_xml,
+                            tag_email=tag_email, tag_uri=tag_uri,
+                            tag_phone=tag_phone, tag_date=tag_date,
+                            tag_hashtag=tag_hashtag, tag_nametag=tag_nametag
+                        )
+                        is_plain = False
+            if post_tag:
+                sent = post_tag(' '.join(wforms), delim)
+                is_plain = False
+            elif not is_plain:
+                sent = ' '.join(wforms)
+            if not is_plain and delim in sent:
+                sent = self._process_tags(sent, tags)
+            if re_special.search(sent):
+                sent = self._process_nospace(sent, chars_allowed, split_unk,
+                                             tag_unk, tags)
+                is_plain = False
+            sents.append(wforms if is_plain else sent.split())
+        if stats is not None:
+            stats.lap('split_tokenized')
+        return sents
+
+    def process_text(self, text, chars_allowed=None, unescape_html=True,
+                     pre_tag=None, tag_emoji=True, tag_xml=True,
+                     tag_email=True, tag_uri=True, tag_phone=True,
+                     tag_date=True, tag_hashtag=True, tag_nametag=True,
+                     post_tag=None, split_unk=False, tag_unk=True,
+                     is_tokenized=False, norm_punct=False, islf_eos=True,
+                     istab_eos=True, ignore_case=False, silent=False,
+                     sent_no=0, tags={}, cache=None, stats=None):
+        """Make preprocessing (including tokenization) for the given *text*
+
+        :param chars_allowed: allowed charset (all allowed symbols for use in
+                              "[]" regex). If ``False``, all symbols are
+                              allowed. `None` means default charset (see
+                              sources).
+        :type chars_allowed: str|False
+
+        :param unescape_html: do we need to make back transformation from
+                              escaped html
+
+        :param pre_tag: external tagger (or just preprocessor) that will be
+                        run before all internal taggers:
+
+                        text = pre_tag(text, delim)
+
+                        where delim is a character to separate tag signature
+        :type pre_tag: callable
+
+        :param tag_date:
+        :param tag_email:
+        :param tag_emoji:
+        :param tag_hashtag:
+        :param tag_nametag:
+        :param tag_phone:
+        :param tag_uri:
+        :param tag_xml:
+        Preprocessors we want to run. They will be started exactly in that
+        order. May be callable with the same signature as for *pre_tag*.
+
+        :param post_tag: external tagger (or just preprocessor) that will be
+                         run after all internal taggers. The signature is the
+                         same as for *pre_tag*: text = post_tag(text, delim).
+        :type post_tag: callable
+        :param split_unk: split tokens with disallowed chars, if these chars
+                          placed only at the begin or/and at the end of the
+                          token
+        :param tag_unk: add special tag to the tokens with disallowed chars
+        :param is_tokenized: ``True`` meant that sentences may be splitted by
+                            the LF symbol, and words may be splitted by spaces.
+                            ``'fast'`` meant that each line is exactly one
+                            sentence, and spaces are exactly the borders of
+                            the tokens. In that mode, internal taggers are
+                            run only over the tokens that may be entities
+                            (one by one), so entities that contain spaces are
+                            not found, and single brackets are never taken
+                            for smiles; *norm_punct* is ignored
+        :param norm_punct: normalize punctuations. Use it if you process
+                           text chats or forum messages
+
+        Params for ``norm_punct()``:
+        :param islf_eos: LF symbol marks end of sentence; replace to "."
+        :param istab_eos: TAB symbol marks end of sentence; replace to "."
+        :param ignore_case: do not consider character case during processing
+
+        :param silent: suppress log
+        :param sent_no: init value for the progress indicator (has effect if
+                        silent is False)
+        :param tags: storage for found tags
+        :type tags: dict(tag, value)
+        :param cache: storage for the results of the processing (see
+                      ``toxine.cache``). If the same *text* has already been
+                      processed with the same params, the stored result will
+                      be returned. Note, that external taggers are
+                      distinguished by their names only, and anonymous ones
+                      (lambdas, local functions) can't be used with cache
+        :type cache: toxine.cache.BaseCache
+        :param stats: collector of the processing statistics. If ``None``
+                      (default), nothing is measured
+        :type stats: toxine.stats.ProcessingStats
+        """
+        assert pre_tag is None or callable(pre_tag), \
+            'ERROR: ext_pre must be either callable or None'
+        assert post_tag is None or callable(post_tag), \
+            'ERROR: ext_post must be either callable or None'
+
+        if cache is not None:
+            key = self._get_cache_key(text, (
+                chars_allowed, unescape_html, pre_tag, tag_emoji, tag_xml,
+                tag_email, tag_uri, tag_phone, tag_date, tag_hashtag,
+                tag_nametag, post_tag, split_unk, tag_unk, is_tokenized,
+                norm_punct, islf_eos, istab_eos, ignore_case
+            ))
+            if stats is not None:
+                stats.start(text)
+            res = cache.get(key)
+            if res is None:
+                tags_ = {}
+                sents = self.process_text(
+                    text, chars_allowed=chars_allowed,
+                    unescape_html=unescape_html, pre_tag=pre_tag,
+                    tag_emoji=tag_emoji, tag_xml=tag_xml,
+                    tag_email=tag_email, tag_uri=tag_uri,
+                    tag_phone=tag_phone, tag_date=tag_date,
+                    tag_hashtag=tag_hashtag, tag_nametag=tag_nametag,
+                    post_tag=post_tag, split_unk=split_unk, tag_unk=tag_unk,
+                    is_tokenized=is_tokenized, norm_punct=norm_punct,
+                    islf_eos=islf_eos, istab_eos=istab_eos,
+                    ignore_case=ignore_case, silent=silent, sent_no=sent_no,
+                    tags=tags_, stats=stats
+                )
+                cache.put(key, (sents, tags_))
+            else:
+                sents, tags_ = res
+                if stats is not None:
+                    stats.lap('cache')
+                    stats.finish(sents)
+            # the tags found continue the caller's numeration
+            if tags is not None:
+                for tag, vals in tags_.items():
+                    tags.setdefault(tag, []).extend(vals)
+            return sents
+
+        if stats is not None:
+            stats.start(text)
+
+        if is_tokenized == 'fast':
+            sents = self._split_tokenized(
+                text, chars_allowed=chars_allowed,
+                unescape_html=unescape_html, pre_tag=pre_tag,
+                tag_emoji=tag_emoji, tag_xml=tag_xml, tag_email=tag_email,
+                tag_uri=tag_uri, tag_phone=tag_phone, tag_date=tag_date,
+                tag_hashtag=tag_hashtag, tag_nametag=tag_nametag,
+                post_tag=post_tag, split_unk=split_unk, tag_unk=tag_unk,
+                tags=tags, stats=stats
+            )
+        else:
+            sents = self._split_sents(
+                text, chars_allowed=chars_allowed,
+                unescape_html=unescape_html, pre_tag=pre_tag,
+                tag_emoji=tag_emoji, tag_xml=tag_xml, tag_email=tag_email,
+                tag_uri=tag_uri, tag_phone=tag_phone, tag_date=tag_date,
+                tag_hashtag=tag_hashtag, tag_nametag=tag_nametag,
+                post_tag=post_tag, split_unk=split_unk, tag_unk=tag_unk,
+                is_tokenized=is_tokenized, norm_punct=norm_punct,
+                islf_eos=islf_eos, istab_eos=istab_eos,
+                ignore_case=ignore_case, tags=tags, stats=stats
+            )
+        sents_ = self._make_sents(sents, is_tokenized=is_tokenized,
+                                  silent=silent, sent_no=sent_no, tags=tags,
+                                  stats=stats)
+        if stats is not None:
+            stats.finish(sents_)
+        return sents_
+
+    def _make_sents(self, sents, is_tokenized=False, silent=False, sent_no=0,
+                    tags={}, stats=None):
+        """Tokenize the *sents* and convert them into Parsed CoNLL-U format
+
+        :return: tokens and text of each sentence
+        :rtype: list(tuple(list, str))
+        """
         sents_ = []
         #del par['text']
         for sent in sents:
@@ -1241,50 +1746,295 @@ class TextPreprocessor:
                 print_progress(sent_no, end_value=None, step=1000,
                                file=LOG_FILE)
             sent_no += 1
-            wforms = [x for x in [x.strip() for x in re_split(r'\s+', text)]
-                        if x] if is_tokenized else \
-                     self.word_tokenize(sent)
-            tokens = Conllu.from_sentence(wforms)
-            text = ''
-            space_before = False
-            for i, token in enumerate(tokens):
-                wform = token['FORM']
-                delim_pos = wform.find(self.CHAR_DELIM)
-                misc = token['MISC']
-                if delim_pos >= 0:
-                    idx = int(wform[:delim_pos])
-                    tag = wform[delim_pos:]
-                    if tag == self.TAG_SHORTCUT:
-                        subst, orig = self.SHORTCUTS[idx]
-                        token['FORM'] = subst
-                        misc[self.TAG_SHORTCUT[2:]] = orig
-                    else:
-                        mask = self.TAG_MASKS[tag]
-                        tag = tag[1:]
-                        orig = tags[tag][idx]
-                        token['FORM'] = mask
-                        misc[tag] = orig
-                        if space_before:
-                            text += ' '
-                        text += orig
-                elif wform in ['``', '(', '«']:
-                    misc['SpaceAfter'] = 'No'
-                    if space_before:
-                        text += ' '
-                    text += wform
-                elif i > 0 \
-                 and wform in ['.', ',', ':', ';', '...',
-                               '!', '?', '!..', '?..', "''", ')', '»']:
-                    tokens[i - 1]['MISC']['SpaceAfter'] = 'No'
-                    text += wform
-                else:
-                    if space_before:
-                        text += ' '
-                    text += wform
-                space_before = misc.get('SpaceAfter') != 'No'
+            wforms = sent if is_tokenized == 'fast' else \
+                     sent.split() if is_tokenized else \
+                     self._word_tokenize(sent)
+            if stats is not None:
+                stats.lap('word_tokenize')
+            tokens, text = self._make_sent(wforms, tags)
+            if stats is not None:
+                stats.lap('make_sent')
             sents_.append((tokens, text))
         return sents_
 
+    def process_batch(self, texts, chars_allowed=None, unescape_html=True,
+                      pre_tag=None, tag_emoji=True, tag_xml=True,
+                      tag_email=True, tag_uri=True, tag_phone=True,
+                      tag_date=True, tag_hashtag=True, tag_nametag=True,
+                      post_tag=None, split_unk=False, tag_unk=True,
+                      is_tokenized=False, norm_punct=False, islf_eos=True,
+                      istab_eos=True, ignore_case=False, silent=False,
+                      sent_no=0, tags=None):
+        """Make preprocessing for each of the *texts*. The result is the same
+        as of ``process_text()`` called for each text separately, but the
+        internal taggers and the sentence tokenizer are run once over all the
+        *texts* joined with a separator they can't cross. Use it for the
+        streams of short texts (e.g., chat messages), where the per-call
+        overhead dominates.
+
+        :type texts: list(str)
+        :param tags: storage for found tags of all the *texts*
+        :type tags: dict(tag, value)
+        Other params are the same as for ``process_text()``.
+
+        :return: results of ``process_text()`` for each of the *texts*
+        :rtype: list
+        """
+        assert pre_tag is None or callable(pre_tag), \
+            'ERROR: ext_pre must be either callable or None'
+        assert post_tag is None or callable(post_tag), \
+            'ERROR: ext_post must be either callable or None'
+
+        if tags is None:
+            tags = {}
+        delim = self.CHAR_DELIM
+        texts_ = list(texts)
+        if len(texts_) < 2 or is_tokenized == 'fast' \
+                           or any(self.CHAR_SEP in x for x in texts_):
+            texts = None
+        else:
+            texts = texts_
+            sep = '\n' + self.CHAR_SEP + '\n'
+            if unescape_html:
+                texts = [unescape_html(x) for x in texts] \
+                            if callable(unescape_html) else \
+                        self._unescape_html(sep.join(texts)).split(sep)
+            if pre_tag:
+                texts = [pre_tag(self._remove_delims(x), delim)
+                             for x in texts]
+            else:
+                texts = self._remove_delims(sep.join(texts)).split(sep)
+            text = self._run_taggers(
+                sep.join(texts), tag_emoji=tag_emoji, tag_xml=tag_xml,
+                tag_email=tag_email, tag_uri=tag_uri, tag_phone=tag_phone,
+                tag_date=tag_date, tag_hashtag=tag_hashtag,
+                tag_nametag=tag_nametag
+            )
+            texts = text.split(sep)
+            if len(texts) != len(texts_) \
+            or text.count(self.CHAR_SEP) != len(texts) - 1:
+                # the separator is damaged by some tagger or restored by
+                # unescape_html
+                texts = None
+
+        if texts is None:
+            res = []
+            for text in texts_:
+                sents = self.process_text(
+                    text, chars_allowed=chars_allowed,
+                    unescape_html=unescape_html, pre_tag=pre_tag,
+                    tag_emoji=tag_emoji, tag_xml=tag_xml, tag_email=tag_email,
+                    tag_uri=tag_uri, tag_phone=tag_phone, tag_date=tag_date,
+                    tag_hashtag=tag_hashtag, tag_nametag=tag_nametag,
+                    post_tag=post_tag, split_unk=split_unk, tag_unk=tag_unk,
+                    is_tokenized=is_tokenized, norm_punct=norm_punct,
+                    islf_eos=islf_eos, istab_eos=istab_eos,
+                    ignore_case=ignore_case, silent=silent, sent_no=sent_no,
+                    tags=tags
+                )
+                sent_no += len(sents)
+                res.append(sents)
+            return res
+
+        if chars_allowed != False:
+            chars_allowed = r'\s' + (chars_allowed if chars_allowed else
+                                     self.CHARS_ALLOWED)
+        for i, text in enumerate(texts):
+            if post_tag:
+                text = post_tag(text, delim)
+            text = self._process_tags(text, tags)
+            text = self._process_nospace(text, chars_allowed, split_unk,
+                                         tag_unk, tags)
+            if norm_punct:
+                text = self.norm_punct(text, islf_eos=islf_eos,
+                                             istab_eos=istab_eos,
+                                             ignore_case=ignore_case)
+            texts[i] = text
+        sents = [[x for x in [x.strip() for x in x.split('\n')] if x]
+                     for x in texts] if is_tokenized else \
+                self._sent_tokenize_batch(texts, kill_empty=True)
+        res = []
+        for sents_ in sents:
+            res.append(self._make_sents(sents_, is_tokenized=is_tokenized,
+                                        silent=silent, sent_no=sent_no,
+                                        tags=tags))
+            sent_no += len(sents_)
+        return res
+
+    def make_interactive(self, **kwargs):
+        """Return the function for the low-latency processing of single short
+        texts (e.g., chat messages for real-time classification):
+
+            sents = process(text)
+
+        The function is ``process_text()`` with the *kwargs* params, but the
+        progress is never logged, and each call has its own *tags* storage.
+        All that the processing uses (NLTK Punkt model, dictionaries, compiled
+        regexes) is loaded here by the warm-up run, so the first call is not
+        slower than others.
+
+        Note, that there is nothing else to skip: ``process_text()`` never
+        runs ``Conllu.fix()`` (only ``save()`` does), so the latency of each
+        call is the same as of ``process_text()`` with the warm model.
+        Typically, the median is below 1 ms for a 50-300 chars message, but
+        p99 is about 1.5-2 ms (see ``benchmarks/bench_latency.py``), i.e.,
+        the sub-millisecond target is not guaranteed.
+
+        The method receives the params of ``process_text()`` (*silent*,
+        *sent_no* and *tags* are ignored).
+
+        :rtype: callable
+        """
+        kwargs['silent'] = True
+        kwargs.pop('sent_no', None)
+        kwargs.pop('tags', None)
+        self.process_text(
+            'Привет, мир! Т.е. это <b>тест</b> :) Пишите на info@example.com '
+            'или http://example.com/page?id=1, звоните 8 (900) 123-45-67. '
+            "Встреча 01.02.2020 #новости @user «Цитата». Don't stop...",
+            tags={}, **dict(kwargs, cache=None, stats=None)
+        )
+
+        def process(text):
+            return self.process_text(text, tags={}, **kwargs)
+
+        return process
+
+    def _restore_sent(self, sent, tags):
+        """Restore tagged tokens of the *sent* to their original form and
+        remove spaces before punctuation like ``_make_sent()`` does"""
+        delim = self.CHAR_DELIM
+        text, space_before = '', False
+        for wform in sent.split():
+            delim_pos = wform.find(delim)
+            if delim_pos > 0 and wform[:delim_pos].isdigit():
+                idx = int(wform[:delim_pos])
+                tag = wform[delim_pos:]
+                if tag == self.TAG_SHORTCUT:
+                    # multiword substitutions keep the original in the first
+                    # word only
+                    wform = self.SHORTCUTS[idx][1].strip()
+                    if not wform:
+                        continue
+                elif tag in self.TAG_MASKS:
+                    wform = tags[tag[len(delim):]][idx]
+            elif wform in ['.', ',', ':', ';', '...',
+                           '!', '?', '!..', '?..', "''", ')', '»']:
+                space_before = False
+            if space_before:
+                text += ' '
+            text += wform
+            space_before = wform not in ['``', '(', '«']
+        return text
+
+    def segment_text(self, text, tags=None, **kwargs):
+        """Split the *text* into sentences only, without word tokenization
+        and building of CoNLL-U structures. Tagging, symbol normalization and
+        ``norm_punct()`` are applied as configured, so the boundaries are
+        the same as ``process_text()`` makes.
+
+        :param tags: storage for found tags. If ``None``, a temporary one is
+                     used
+        :type tags: dict(tag, value)
+        Also, the method receives the params of ``process_text()`` that
+        affect the processing (*silent*, *sent_no*, *cache* and *stats* are
+        not supported).
+
+        :return: tuples (start, end, sent), where *sent* is the text of the
+                 sentence with the tagged tokens restored to their original
+                 form, and *start* and *end* are its approximate offsets in
+                 the *text* (words of the sentence are searched in the
+                 *text* successively; the ones changed by the normalization
+                 are skipped)
+        :rtype: list(tuple(int, int, str))
+        """
+        if tags is None:
+            tags = {}
+        sents = self._split_sents(text, tags=tags, **kwargs)
+        return self._locate_sents(text, sents, tags)
+
+    def _locate_sents(self, text, sents, tags):
+        """Restore the *sents* made by ``_split_sents()`` and find their
+        approximate offsets in the *text* (see ``segment_text()``)
+
+        :rtype: list(tuple(int, int, str))
+        """
+        res, pos, len_text = [], 0, len(text)
+        for sent in sents:
+            sent = self._restore_sent(sent, tags)
+            start = end = None
+            sent_pos = pos
+            for word in re_findall(r'\w+', sent):
+                # the gap limit saves from jumping to the far repeat of the
+                # word if the previous ones are not found
+                i = text.find(word, pos, pos + len(word) + 64)
+                if i >= 0:
+                    if start is None:
+                        start = i
+                    pos = end = i + len(word)
+            if start is not None:
+                # the sentence may start with punctuation, e.g. "#tag" or
+                # "... word"
+                num_lead = len(''.join(re_split(r'\w', sent, 1)[0].split()))
+                i = start
+                while i > sent_pos and num_lead:
+                    i -= 1
+                    if not text[i].isspace():
+                        start = i
+                        num_lead -= 1
+                while start > sent_pos and not text[start - 1].isspace():
+                    start -= 1
+            else:
+                start = pos
+                while start < len_text and text[start].isspace():
+                    start += 1
+                end = start
+            res.append([start, end, sent])
+        # a sentence ends where the next one starts
+        for i, (start, end, sent) in enumerate(res):
+            next_start = res[i + 1][0] if i + 1 < len(res) else len_text
+            while next_start > end and text[next_start - 1].isspace():
+                next_start -= 1
+            res[i] = (start, max(end, next_start), sent)
+        return res
+
+    def _get_cdict_fingerprint(self):
+        """Return the hash of the words known to the internal CorpusDict. It
+        is calculated once, on the first call"""
+        res = getattr(self, '_cdict_fingerprint', None)
+        if res is None:
+            cdict = self._cdict
+            res = self._cdict_fingerprint = '' if cdict.isempty() else \
+                sha1('\n'.join(sorted(cdict._wforms_id)
+                              + [''] + sorted(cdict._lemmata_id))
+                         .encode('utf-8')).hexdigest()
+        return res
+
+    def _get_cache_key(self, text, options):
+        """Return the key for the cache of processing results. The key
+        depends on the *text*, the processing *options*, the registered tags,
+        the char and shortcut tables, the loaded CorpusDict and the version
+        of the package.
+
+        External taggers are identified by their module and qualified names,
+        so anonymous (lambdas, local functions, ``functools.partial``) ones
+        are not allowed"""
+        options_ = []
+        for x in options:
+            if callable(x):
+                name = getattr(x, '__qualname__', None)
+                if not name or '<' in name:
+                    raise ValueError('ERROR: Anonymous tagger {} cannot be '
+                                     'used with cache. Define it as a module '
+                                     'level function'.format(x))
+                x = '{}.{}'.format(getattr(x, '__module__', None), name)
+            options_.append(x)
+        key = repr((__version__, self.CHAR_DELIM,
+                    sorted(self.TAG_MASKS.items()), self.CHARS_ALLOWED,
+                    self.CHARS_PUNCT, self.SHORTCUTS,
+                    self._get_cdict_fingerprint(), tuple(options_)))
+        return sha1((key + '\n' + text).encode('utf-8')).hexdigest()
+
     def do_all(self, doc_id=None, **kwargs):
         """Make preprocessing (including tokenization) for the specified
         document
@@ -1294,79 +2044,179 @@ class TextPreprocessor:
         :type doc_id: str
 
         Also, the function receives other parameters that fit for
-        ``process_text()`` method"""
+        ``process_text()`` method. E.g., with the *cache* param set to
+        ``toxine.cache.DiskCache`` instance, the paragraphs that have been
+        already processed during previous runs will be taken from the cache.
+        With the *stats* param set to ``toxine.stats.ProcessingStats``
+        instance, the statistics of the processing will be collected.
+
+        :param index: the index of the entities found. The previous entries of
+                      the processed documents are removed from it
+        :type index: toxine.entity_index.EntityIndex
+        :param max_sents: max number of sentences of each document. As soon as
+                          it's reached, the processing of the document stops,
+                          and the rest of its sentences and paragraphs are
+                          removed
+        :type max_sents: int"""
         assert doc_id is None or doc_id in self._corpus, \
             'ERROR: document "{}" has not exist'.format(doc_id)
 
         silent = kwargs.get('silent', False)
+        cache = kwargs.get('cache')
+        index = kwargs.pop('index', None)
+        max_sents = kwargs.pop('max_sents', None)
+        if index is not None:
+            index_tags = set(x[len(self.CHAR_DELIM):] for x in self.TAG_MASKS
+                                 if x not in [self.TAG_QUOTATION_START,
+                                              self.TAG_QUOTATION_END,
+                                              self.TAG_UNK])
+        if cache is not None:
+            hits, misses = cache.hits, cache.misses
         if not silent:
             print('Preprocess corpus', file=LOG_FILE)
-        corpus = self._corpus.values() if doc_id is None else \
-                 [self._corpus[doc_id]]
+        corpus = self._corpus.items() if doc_id is None else \
+                 [(doc_id, self._corpus[doc_id])]
         docs_cnt = len(corpus)
         pars_cnt = sents_cnt = tokens_cnt = 0
-        for doc in corpus:
+        for doc_id, doc in corpus:
             tags = doc['tags'] = {}
-            for par in doc.get('pars', []):
+            if index is not None:
+                index.remove_doc(doc_id)
+            pars, doc_sents = doc.get('pars', []), 0
+            for par_no, par in enumerate(pars, start=1):
                 sents = self.process_text(
                     par['text'], **kwargs, sent_no=sents_cnt, tags=tags
                 )
+                is_full = max_sents is not None \
+                      and doc_sents + len(sents) >= max_sents
+                if is_full:
+                    sents = sents[:max_sents - doc_sents]
+                    del pars[par_no:]
+                if index is not None:
+                    index.add_sents(doc_id, par_no, (x[0] for x in sents),
+                                    index_tags)
                 par['sents'] = []
                 for tokens, text in sents:
                     par['sents'].append({'text': text, 'tokens': tokens})
                     tokens_cnt += len(tokens)
                 sents_cnt += len(sents)
+                doc_sents += len(sents)
                 pars_cnt += 1
+                if is_full:
+                    break
+        if cache is not None:
+            cache.flush()
+        if index is not None:
+            index.flush()
         if not silent and sents_cnt >= 0:
             print_progress(sents_cnt, end_value=0, step=1000, file=LOG_FILE)
             print('Corpus has been processed: '
                   '{} documents, {} paragraphs, {} sentences, {} tokens'
                       .format(docs_cnt, pars_cnt, sents_cnt, tokens_cnt),
                   file=LOG_FILE)
+            if cache is not None:
+                hits, misses = cache.hits - hits, cache.misses - misses
+                print('Cache: {} hits, {} misses (hit ratio {:.1%})'
+                          .format(hits, misses, hits / (hits + misses)
+                                                    if hits + misses else
+                                                0.),
+                      file=LOG_FILE)
+
+    def segment_all(self, doc_id=None, **kwargs):
+        """Split the specified document into sentences only (see
+        ``segment_text()``). The corpus is not changed.
+
+        :param doc_id: id of the document. If None then all the corpus
+                       will be processed
+        :type doc_id: str
+        Also, the method receives the params of ``segment_text()``.
 
-    def save(self, path=None, doc_id=None, add_global_columns=False):
+        :return: tuples (doc_id, par_no, start, end, sent), where *par_no* is
+                 the number of the paragraph in the document (starting from
+                 1), and *start* and *end* are offsets in the paragraph
+        :rtype: iter(tuple(str, int, int, int, str))
+        """
+        assert doc_id is None or doc_id in self._corpus, \
+            'ERROR: document "{}" has not exist'.format(doc_id)
+        corpus = self._corpus.items() if doc_id is None else \
+                 [(doc_id, self._corpus[doc_id])]
+        for doc_id, doc in corpus:
+            tags = {}
+            for par_no, par in enumerate(doc.get('pars', []), start=1):
+                for start, end, sent in self.segment_text(par['text'],
+                                                          tags=tags,
+                                                          **kwargs):
+                    yield doc_id, par_no, start, end, sent
+
+    def save(self, path=None, doc_id=None, add_global_columns=False,
+             append=False, binary=False):
         """Save corpus to CoNLL-U format.
 
         :param path: path to the file to store result to. If you don't need to
-                     store result on disk, keep it None
+                     store result on disk, keep it None. If the path has
+                     ".gz", ".bz2" or ".xz" extension, the file will be
+                     compressed. The sentences are written as soon as they
+                     are ready, so the whole output is never kept in memory
         :type path: str
         :param doc_id: id of the document. If None then all the corpus 
                        will be processed
         :type doc_id: str
         :param add_global_columns: if True, the first line of output will be
                                    CoNLL-U Plus "global.columns" metadata
-        :return: the result of the processing
+        :param append: if True, add the result to the end of the existing
+                       file *path* instead of rewriting it
+        :param binary: if True, the result will be stored to *path* in the
+                       binary format with random access to the sentences
+                       (see ``toxine.binary``)
+        :return: the result of the processing. It is always a generator;
+                 if *path* is specified, it builds the sentences again on
+                 demand. If you need to index or reuse the result, wrap it in
+                 ``list()``
         :rtype: Parsed CoNLL-U
         """
         assert doc_id is None or doc_id in self._corpus, \
             'ERROR: document "{}" has not exist'.format(doc_id)
-        sents = []
-        for doc_id, doc in self._corpus.items() if doc_id is None else \
-            [(doc_id, self._corpus[doc_id])]:
+        assert not binary or (path and not append), \
+            'ERROR: binary format requires path and can not be appended'
+        docs = list(self._corpus.items()) if doc_id is None else \
+               [(doc_id, self._corpus[doc_id])]
+        for doc_id, doc in docs:
             assert 'pars' in doc, \
                    'ERROR: document {} does not have any data'.format(doc_id)
-            for par_no, par in enumerate(doc['pars'], start=1):
-                par_id = '{}-p{}'.format(doc_id, par_no)
-                for sent_no, sent in enumerate(par['sents'], start=1):
-                    sent_id = '{}-s{}'.format(par_id, sent_no)
-                    tokens = sent['tokens']
-                    meta = OrderedDict()
-                    if par_no == 1 and sent_no == 1:
-                        if add_global_columns:
-                            meta['global.columns'] = \
-                                'ID FORM LEMMA UPOS XPOS FEATS ' \
-                                                   'HEAD DEPREL DEPS MISC'
-                        meta['newdoc id'] = doc_id
-                        meta.update(doc['meta'])
-                    if sent_no == 1:
-                        meta.update([('newpar id', par_id),
-                                     ('par_text', par['text'])])
-                    meta.update([('sent_id', sent_id), ('text', sent['text'])])
-                    sents.append((tokens, meta))
-        sents = Conllu.fix(sents, split_multi=True)
+
+        def process():
+            for doc_id, doc in docs:
+                for par_no, par in enumerate(doc['pars'], start=1):
+                    par_id = '{}-p{}'.format(doc_id, par_no)
+                    for sent_no, sent in enumerate(par['sents'], start=1):
+                        sent_id = '{}-s{}'.format(par_id, sent_no)
+                        tokens = sent['tokens']
+                        meta = OrderedDict()
+                        if par_no == 1 and sent_no == 1:
+                            if add_global_columns:
+                                meta['global.columns'] = \
+                                    'ID FORM LEMMA UPOS XPOS FEATS ' \
+                                                       'HEAD DEPREL DEPS MISC'
+                            meta['newdoc id'] = doc_id
+                            meta.update(doc['meta'])
+                        if sent_no == 1:
+                            meta.update([('newpar id', par_id),
+                                         ('par_text', par['text'])])
+                        meta.update([('sent_id', sent_id),
+                                     ('text', sent['text'])])
+                        yield tokens, meta
+
+        sents = Conllu.fix(process(), split_multi=True)
+        if binary:
+            from toxine.binary import save_binary
+            save_binary(sents, path)
+        elif path:
+            with open_file(path, 'at' if append else 'wt') as f:
+                for line in Conllu.get_as_text(sents, fix=False):
+                    f.write(line)
         if path:
-            sents = list(sents)
-            Conllu.save(sents, path, fix=False)
+            # the result is regenerated on demand instead of being kept
+            sents = Conllu.fix(process(), split_multi=True)
         return sents
 
     def unmask_tokens(self, corpus, save_to=None, keep_empty=True,
@@ -1376,7 +2226,11 @@ class TextPreprocessor:
         :param corpus: path to CoNLL-U file or array of Parsed CoNLL-U
         :type corpus: str|Iterable
         :param save_to: path to the file to store result to. If you don't need
-                        to store result on disk, keep it None
+                        to store result on disk, keep it None. The file is
+                        compressed if it has ".gz", ".bz2" or ".xz" extension.
+                        If specified, the corpus is processed and written at
+                        once, in one pass, and the result is a generator that
+                        reads the written file back
         :type save_to: str
         :param keep_empty: if True, entities with no replacement mask stay as
                            is
@@ -1388,6 +2242,10 @@ class TextPreprocessor:
         :return: the result of the processing
         :rtype: Parsed CoNLL-U
         """
+        # tag without delim -> whether its token must be replaced
+        masks = {x[len(self.CHAR_DELIM):]: bool(y) or not keep_empty
+                     for x, y in self.TAG_MASKS.items()}
+
         def process(corpus):
             if isinstance(corpus, str):
                 corpus = Conllu.load(corpus)
@@ -1395,12 +2253,13 @@ class TextPreprocessor:
                 for token in sentence[0] if isinstance(sentence, tuple) else \
                              sentence:
                     misc = token['MISC']
-                    for tag, form in list(misc.items()):
-                        tag_ = self.CHAR_DELIM + tag
-                        if tag_ in self.TAG_MASKS:
-                            subst = self.TAG_MASKS[tag_]
-                            if subst or not keep_empty:
-                                token['FORM'] = form
+                    if not misc:
+                        continue
+                    for tag in misc:
+                        is_subst = masks.get(tag)
+                        if is_subst is not None:
+                            if is_subst:
+                                token['FORM'] = misc[tag]
                             if not keep_tags:
                                 misc.pop(tag)
                             if entity_map:
@@ -1415,6 +2274,15 @@ class TextPreprocessor:
         corpus = process(corpus)
 
         if save_to:
-            Conllu.save(corpus, save_to, fix=False)
-            corpus = Conllu.load(save_to)
+            with open_file(save_to, 'wt') as f:
+                for sentence in corpus:
+                    f.writelines(Conllu.get_as_text([sentence], fix=False,
+                                                    log_file=None))
+
+            def load():
+                with open_file(save_to, 'rt') as f:
+                    for sentence in Conllu.load(f):
+                        yield sentence
+
+            corpus = load()
         return corpus
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+# Toxine project: Utilities
+#
+# Copyright (C) 2019-present by Sergei Ternovykh
+# License: BSD, see LICENSE for details
+"""
+Auxiliary tools shared by the Toxine's modules.
+"""
+from collections import deque
+import io
+import os
+
+
+def imap_ordered(func, iterable, workers=None, initializer=None,
+                 initargs=(), max_pending=None):
+    """Apply *func* to each element of *iterable* in the pool of *workers*
+    processes and return the results in the order of the input.
+
+    Unlike ``multiprocessing.Pool.imap()``, the *iterable* is consumed lazily:
+    no more than *max_pending* tasks are kept in flight, so the memory
+    consumption doesn't depend on the length of the input.
+
+    :param workers: number of worker processes. If ``None`` or less than 2,
+                    all the work is done in the current process
+    :type workers: int
+    :param initializer: the function that will be invoked once in each worker
+                        (or in the current process if *workers* < 2) before
+                        any task
+    :type initializer: callable
+    :param initargs: args for *initializer*
+    :param max_pending: max number of tasks that are sent to the pool but
+                        whose results are not yet returned. Default is
+                        ``workers * 4``
+    :rtype: iter
+    """
+    if not workers or workers < 2:
+        if initializer:
+            initializer(*initargs)
+        for item in iterable:
+            yield func(item)
+        return
+
+    from multiprocessing import Pool
+
+    if not max_pending:
+        max_pending = workers * 4
+    pending = deque()
+    with Pool(workers, initializer, initargs) as pool:
+        for item in iterable:
+            pending.append(pool.apply_async(func, (item,)))
+            if len(pending) >= max_pending:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+
+
+COMPRESSORS = {'.gz': 'gzip', '.bz2': 'bz2', '.xz': 'lzma'}
+
+
+def open_file(path, mode='rt', encoding='utf-8', **kwargs):
+    """Open the file *path*. If the extension of the file is ".gz", ".bz2" or
+    ".xz", the file will be opened via the corresponding stdlib module.
+
+    :param mode: file mode. Text modes only
+    :param kwargs: other params for ``open()``
+    :rtype: file object
+    """
+    assert 'b' not in mode, 'ERROR: only text modes are supported'
+    if 't' not in mode:
+        mode += 't'
+    module = COMPRESSORS.get(os.path.splitext(path)[1].lower())
+    if module:
+        module = __import__(module)
+        return module.open(path, mode, encoding=encoding, **kwargs)
+    return io.open(path, mode, encoding=encoding, **kwargs)
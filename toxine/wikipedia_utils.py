@@ -6,39 +6,580 @@
 """
 Wrapper to get Russian part of Wikipedia tokenized in CoNLL-U format.
 """
+from bz2 import decompress
+from hashlib import sha256
+from html import unescape
+from itertools import islice
+import json
+import os
+from tempfile import NamedTemporaryFile
 
+from corpuscula import Conllu
 from corpuscula.utils import LOG_FILE, print_progress
-from corpuscula.wikipedia_utils import Wikipedia
+from corpuscula.wikipedia_utils import Wikipedia, _get_articles
 from toxine.text_preprocessor import TextPreprocessor
+from toxine.utils import COMPRESSORS, imap_ordered, open_file
+
+MANIFEST = 'manifest.json'
+
+_tp = None
+_filters = None
+
+
+def _init_worker(filters=None):
+    global _tp, _filters
+    _tp = TextPreprocessor()
+    _filters = filters
+
+
+def _filter_article(id_, title, article, filters):
+    """Apply the *filters* (see ``TokenizedWikipedia.__init__()``) to the raw
+    article. Returns the article cut to *max_pars* paragraphs or ``None`` if
+    the article is rejected"""
+    if filters:
+        article_filter, sample_rate, max_pars, _ = filters
+        if article_filter and not article_filter(id_, title, article):
+            return None
+        # the hash of the id makes the sample the same for each run
+        if sample_rate is not None and int(
+            sha256(id_.encode('utf-8')).hexdigest()[:8], 16
+        ) >= sample_rate * 0x100000000:
+            return None
+        if max_pars is not None:
+            article = '\n\n'.join(islice(
+                TextPreprocessor.text_to_pars(article, eop=r'\n\n'),
+                max_pars
+            ))
+    return article
+
+
+def _process_article(task):
+    """Tokenize one article. Returns its sentences in Parsed CoNLL-U format
+    or, if *as_text* is ``True``, its id and CoNLL-U text along with the
+    number of sentences"""
+    id_, title, article, as_text = task
+    _tp.new_doc(doc_id=id_, metadata=[('title', title)])
+    try:
+        _tp.new_pars(article, eop=r'\n\n', doc_id=id_)
+        _tp.do_all(id_, silent=True,
+                   max_sents=_filters[3] if _filters else None)
+        sents = list(_tp.save(doc_id=id_))
+    finally:
+        _tp.remove_doc(id_)
+    if as_text:
+        return id_, \
+               ''.join(Conllu.get_as_text(sents, fix=False, log_file=None)), \
+               len(sents)
+    return sents
+
+
+def _read_streams(fpath, header_end, start, end):
+    """Read the articles of the bz2 streams of the multistream dump *fpath*
+    that are between the *start* and *end* offsets. The header stream
+    (``[0:header_end]``) is prepended, so the namespaces of the dump are
+    known to the parser"""
+    with open(fpath, 'rb') as f:
+        data = f.read(header_end)
+        f.seek(start)
+        data += f.read(end - start if end else -1)
+    # the parser of corpuscula reads only files
+    with NamedTemporaryFile('wb', suffix='.xml', delete=False) as f:
+        f.write(decompress(data))
+    try:
+        return list(_get_articles(f.name, silent=True))
+    finally:
+        os.remove(f.name)
+
+
+def _process_streams(task):
+    """Decompress and tokenize the articles of the bz2 streams of the
+    multistream dump. If *ids* is not ``None``, only the articles with that
+    ids are processed; if *after_id* is not ``None``, the articles up to the
+    one with that id (inclusive) are skipped. The rest are passed through
+    ``_filter_article()``. Returns the list of the results of
+    ``_process_article()``"""
+    fpath, header_end, start, end, ids, after_id, as_text = task
+    res = []
+    for id_, title, article in _read_streams(fpath, header_end, start, end):
+        if after_id is not None:
+            if id_ == after_id:
+                after_id = None
+            continue
+        if ids is None or id_ in ids:
+            article = _filter_article(id_, title, article, _filters)
+            if article is not None:
+                res.append(_process_article((id_, title, article, as_text)))
+    assert after_id is None, \
+        'ERROR: article "{}" is not found in the dump'.format(after_id)
+    return res
+
+
+def _scan_index(index_fpath, ids=None, titles=None):
+    """Read the index of the multistream dump.
+
+    :return: sorted offsets of all the streams and dict {id: offset} of the
+             articles with the given *ids* or *titles*
+    """
+    offsets, found = [], {}
+    with open_file(index_fpath) as f:
+        for line in f:
+            offset, id_, title = line.rstrip('\n').split(':', 2)
+            offset = int(offset)
+            if not offsets or offsets[-1] != offset:
+                offsets.append(offset)
+            if (ids and id_ in ids) or (titles and unescape(title) in titles):
+                found[id_] = offset
+    return offsets, found
 
 
 class TokenizedWikipedia(Wikipedia):
     """Wrapper for Wikipedia corpus"""
 
-    def articles(self, silent=None):
-        """Return tokenized Wikipedia articles in CoNLL-U format"""
+    def __init__(self, lang='RU', fpath=None, silent=False,
+                 index_fpath=None, article_filter=None, sample_rate=None,
+                 max_pars=None, max_sents=None):
+        """
+        :param index_fpath: path to the index of the multistream dump. If
+                            ``None``, the index is searched next to the dump
+                            (for the dump "<name>-multistream.xml.bz2" it's
+                            "<name>-multistream-index.txt.bz2"). If
+                            ``False``, the index is not used
+        :type index_fpath: str
+
+        The next params are applied to the raw articles before any
+        preprocessing, so the articles that are rejected or cut don't cost
+        anything but reading the dump:
+
+        :param article_filter: function that receives the id, the title and
+                               the text of the raw article and returns
+                               ``False`` if the article must be skipped.
+                               With the index of the multistream dump, it's
+                               called in the workers
+        :type article_filter: callable
+        :param sample_rate: the part of the articles to keep, from 0 to 1.
+                            The choice depends on the id of the article only,
+                            so the sample is the same for each run
+        :type sample_rate: float
+        :param max_pars: max number of paragraphs of the article to keep
+        :type max_pars: int
+        :param max_sents: max number of sentences of the article to keep. The
+                          processing of the article stops as soon as they are
+                          made
+        :type max_sents: int
+        Other params are the same as for ``corpuscula.Wikipedia``.
+        """
+        super().__init__(lang=lang, fpath=fpath, silent=silent)
+        assert sample_rate is None or 0 <= sample_rate <= 1, \
+            'ERROR: sample_rate must be from 0 to 1'
+        self._index_fpath = index_fpath
+        self._filters = (article_filter, sample_rate, max_pars, max_sents) \
+                            if article_filter or sample_rate is not None \
+                            or max_pars is not None \
+                            or max_sents is not None else \
+                        None
+
+    def _get_index_fpath(self):
+        """Return the path to the index of the multistream dump or ``None``
+        if there is no index"""
+        index_fpath = self._index_fpath
+        if index_fpath is None:
+            fpath = self._get_fpath()
+            if fpath.lower().endswith('-multistream.xml.bz2'):
+                index_fpath = fpath[:-8] + '-index.txt.bz2'
+                if not os.path.isfile(index_fpath):
+                    index_fpath = None
+        return index_fpath or None
+
+    def _get_stream_tasks(self, index_fpath, as_text, ids=None, titles=None,
+                          last_id=None):
+        """Generate tasks for ``_process_streams()``: one task for each bz2
+        stream of the multistream dump. If *ids* or *titles* is specified,
+        only the streams with that articles are used; if *last_id* is
+        specified, the streams before the one with that article are
+        skipped"""
+        fpath = self._get_fpath()
+        ids_ = set(ids or [])
+        if last_id is not None:
+            ids_.add(last_id)
+        offsets, found = _scan_index(index_fpath, ids=ids_,
+                                     titles=set(titles or []))
+        if last_id is not None:
+            assert last_id in found, \
+                'ERROR: article "{}" is not found in the index' \
+                    .format(last_id)
+            start = found.pop(last_id)
+        header_end = offsets[0] if offsets else 0
+        ids_ = set(found) if ids or titles else None
+        starts = set(found.values())
+        for start_, end in zip(offsets, offsets[1:] + [None]):
+            if last_id is not None:
+                if start_ < start:
+                    continue
+                after_id, last_id = last_id, None
+            else:
+                after_id = None
+            if ids_ is None or start_ in starts:
+                yield fpath, header_end, start_, end, ids_, after_id, as_text
+
+    def _get_tasks(self, as_text, skip=0, last_id=None):
+        """Generate tasks for ``_process_article()``. The first *skip*
+        articles are not processed; the last of them must have *last_id*.
+        The articles rejected by the filters are not counted"""
+        article_no = 0
+        for id_, title, article in super().articles(silent=True):
+            article = _filter_article(id_, title, article, self._filters)
+            if article is None:
+                continue
+            article_no += 1
+            if article_no < skip:
+                continue
+            if article_no == skip:
+                assert id_ == last_id, \
+                    'ERROR: the dump does not match the checkpoint: ' \
+                    'article {} has id "{}" instead of "{}"' \
+                        .format(article_no, id_, last_id)
+                continue
+            yield id_, title, article, as_text
+
+    def _imap_articles(self, as_text, workers=None, max_pending=None, skip=0,
+                       last_id=None, limit=None):
+        """Return the results of ``_process_article()`` for the articles of
+        the dump in their order. If the index of the multistream dump is
+        present, the workers decompress the dump by themselves, and the
+        articles are located by *last_id* only. Otherwise, the dump is read
+        by the current process.
+
+        :param skip: the number of the articles to skip
+        :param last_id: the id of the last skipped article
+        :param limit: max number of the articles to return
+        """
+        index_fpath = self._get_index_fpath()
+        if index_fpath:
+            res = (x for stream in imap_ordered(
+                _process_streams,
+                self._get_stream_tasks(index_fpath, as_text,
+                                       last_id=last_id if skip else None),
+                workers=workers, initializer=_init_worker,
+                initargs=(self._filters,), max_pending=max_pending
+            ) for x in stream)
+            if limit is not None:
+                res = islice(res, limit)
+        else:
+            tasks = self._get_tasks(as_text, skip=skip, last_id=last_id)
+            if limit is not None:
+                tasks = islice(tasks, limit)
+            res = imap_ordered(_process_article, tasks, workers=workers,
+                               initializer=_init_worker,
+                               initargs=(self._filters,),
+                               max_pending=max_pending)
+        return res
+
+    def articles(self, silent=None, workers=None, max_pending=None,
+                 limit=None):
+        """Return tokenized Wikipedia articles in CoNLL-U format
+
+        :param workers: number of worker processes, each with its own
+                        preprocessor. If ``None`` or less than 2, all the
+                        articles are processed in the current process. In
+                        any case, the sentences are returned in the order of
+                        the articles
+        :type workers: int
+        :param max_pending: max number of articles (or bz2 streams of the
+                            multistream dump, if its index is present) that
+                            are sent to the workers but not yet returned.
+                            Default is ``workers * 4``
+        :param limit: max number of articles to process. The reading of the
+                      dump stops as soon as they are found
+        :type limit: int
+        """
         silent = self._silent if silent is None else silent
-        tp = TextPreprocessor()
 
         if not silent:
             print('Process Wikipedia', file=LOG_FILE)
         sent_no, article_no = -1, 0
-        for article_no, (id_, title, article) in enumerate(
-            super().articles(silent=True)
+        for article_no, sents in enumerate(
+            self._imap_articles(False, workers=workers,
+                                max_pending=max_pending, limit=limit),
+            start=1
         ):
-            tp.new_doc(doc_id=id_, metadata=[('title', title)])
-            tp.new_pars(article, eop=r'\n\n', doc_id=id_)
-            tp.do_all(silent=True)
-            for sent in tp.save(doc_id=id_):
+            for sent in sents:
                 sent_no += 1
                 if not silent and not sent_no % 100:
                     print_progress(sent_no, end_value=None, step=1000,
                                    file=LOG_FILE)
                 yield sent
-            tp.remove_doc(id_)
         if not silent and sent_no >= 0:
             sent_no += 1
             print_progress(sent_no, end_value=0, step=1000,
                            file=LOG_FILE)
             print('Wikipedia has been processed: {} sentences, {} articles'
-                      .format(sent_no, article_no, file=LOG_FILE))
+                      .format(sent_no, article_no), file=LOG_FILE)
+
+    def get_articles(self, ids=None, titles=None, silent=None, workers=None,
+                     max_pending=None):
+        """Return the articles with the given *ids* or *titles* tokenized in
+        CoNLL-U format. The articles are located by the index of the
+        multistream dump, so only the bz2 streams that contain them are
+        decompressed. The articles are returned in the order of the dump;
+        the ones that are not found are just skipped.
+
+        :param ids: ids of the articles
+        :type ids: list(str)
+        :param titles: titles of the articles
+        :type titles: list(str)
+        Other params are the same as for ``articles()``.
+        """
+        index_fpath = self._get_index_fpath()
+        assert index_fpath, \
+            'ERROR: the index of the multistream dump is not found'
+        silent = self._silent if silent is None else silent
+        if not (ids or titles):
+            return
+
+        article_no = 0
+        for stream in imap_ordered(
+            _process_streams,
+            self._get_stream_tasks(index_fpath, False, ids=ids or None,
+                                   titles=titles or None),
+            workers=workers, initializer=_init_worker,
+            initargs=(self._filters,), max_pending=max_pending
+        ):
+            for sents in stream:
+                article_no += 1
+                for sent in sents:
+                    yield sent
+        if not silent:
+            print('{} articles have been found'.format(article_no),
+                  file=LOG_FILE)
+
+    def save(self, path, silent=None, workers=None, max_pending=None,
+             limit=None, checkpoint=None, checkpoint_every=1000,
+             resume_from=None):
+        """Save tokenized Wikipedia articles to the CoNLL-U file. Unlike
+        ``Conllu.save(articles())``, the CoNLL-U text is made by the workers,
+        so the current process only writes it.
+
+        :param path: path to the file. If it has ".gz", ".bz2" or ".xz"
+                     extension, the file will be compressed
+        :type path: str
+        :param checkpoint: path to the checkpoint file. If specified, the
+                           number and the id of the last completed article
+                           and the size of the output are stored there after
+                           each *checkpoint_every* articles and in the end.
+                           Compressed output is not supported in that mode
+        :type checkpoint: str
+        :param resume_from: path to the checkpoint file of the previous
+                            interrupted run. The output of that run is
+                            truncated to the size stored in the checkpoint,
+                            the completed articles are skipped without
+                            processing, and the rest is appended to *path*.
+                            Usually, it's the same as *checkpoint*
+        :type resume_from: str
+        Other params are the same as for ``articles()``.
+        """
+        assert not (checkpoint or resume_from) \
+            or os.path.splitext(path)[1].lower() not in COMPRESSORS, \
+            'ERROR: checkpoints are not supported for compressed output'
+        silent = self._silent if silent is None else silent
+
+        sent_no, article_no, last_id, mode = 0, 0, None, 'wt'
+        if resume_from:
+            with open(resume_from, 'rt', encoding='utf-8') as f:
+                state = json.load(f)
+            sent_no, article_no, last_id = \
+                state['sentences'], state['articles'], state['article_id']
+            assert os.path.getsize(path) >= state['offset'], \
+                'ERROR: the output is shorter than the checkpoint states'
+            # drop the output written after the checkpoint, including the
+            # half-written article
+            with open(path, 'r+b') as f:
+                f.truncate(state['offset'])
+            mode = 'at'
+
+        def save_checkpoint(f):
+            f.flush()
+            os.fsync(f.fileno())
+            tmp_path = checkpoint + '.tmp'
+            with open(tmp_path, 'wt', encoding='utf-8') as f_:
+                json.dump({'article_id': last_id, 'articles': article_no,
+                           'sentences': sent_no, 'offset': f.buffer.tell()},
+                          f_)
+            os.replace(tmp_path, checkpoint)
+
+        if not silent:
+            print('Process Wikipedia', file=LOG_FILE)
+        with open_file(path, mode) as f:
+            for article_no, (id_, text, num_sents) in enumerate(
+                self._imap_articles(
+                    True, workers=workers, max_pending=max_pending,
+                    skip=article_no, last_id=last_id,
+                    limit=None if limit is None else
+                          max(limit - article_no, 0)
+                ),
+                start=article_no + 1
+            ):
+                f.write(text)
+                if not silent and (sent_no + num_sents) // 100 \
+                                > (sent_no - 1) // 100:
+                    print_progress(sent_no + num_sents, end_value=None,
+                                   step=1000, file=LOG_FILE)
+                sent_no += num_sents
+                last_id = id_
+                if checkpoint and not article_no % checkpoint_every:
+                    save_checkpoint(f)
+            if checkpoint:
+                save_checkpoint(f)
+        if not silent and sent_no:
+            print_progress(sent_no, end_value=0, step=1000,
+                           file=LOG_FILE)
+            print('Wikipedia has been processed: {} sentences, {} articles'
+                      .format(sent_no, article_no), file=LOG_FILE)
+
+    @staticmethod
+    def _write_shard(path, results, silent, sent_no, max_size=None,
+                     max_articles=None):
+        """Write the *results* of ``_process_article()`` to the shard *path*
+        until one of the limits is reached.
+
+        :return: the shard description for the manifest (without "file"
+                 key), or ``None`` if there are no tasks left
+        """
+        shard, hasher = None, sha256()
+        with open_file(path, 'wt') as f:
+            for id_, text, num_sents in results:
+                data = text.encode('utf-8')
+                f.write(text)
+                hasher.update(data)
+                if shard is None:
+                    shard = {'first_id': id_, 'articles': 0, 'sentences': 0,
+                             'size': 0}
+                shard['last_id'] = id_
+                shard['articles'] += 1
+                shard['sentences'] += num_sents
+                shard['size'] += len(data)
+                if not silent and (sent_no + num_sents) // 100 \
+                                > (sent_no - 1) // 100:
+                    print_progress(sent_no + num_sents, end_value=None,
+                                   step=1000, file=LOG_FILE)
+                sent_no += num_sents
+                if (max_size and shard['size'] >= max_size) or (
+                    max_articles and shard['articles'] >= max_articles
+                ):
+                    break
+        if shard is None:
+            os.remove(path)
+        else:
+            shard['sha256'] = hasher.hexdigest()
+        return shard
+
+    @staticmethod
+    def _save_manifest(path, manifest):
+        fname = os.path.join(path, MANIFEST)
+        with open(fname + '.tmp', 'wt', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        os.replace(fname + '.tmp', fname)
+
+    def save_shards(self, path, max_size=None, max_articles=None,
+                    compression=None, prefix='wiki', silent=None,
+                    workers=None, max_pending=None):
+        """Save tokenized Wikipedia articles to the directory *path* as a
+        number of CoNLL-U files (shards) of limited size, along with the
+        manifest (file "manifest.json") that describes them. The articles
+        are never split between shards.
+
+        :param max_size: max size of the shard in bytes of uncompressed
+                         CoNLL-U text. The shard is closed as soon as its
+                         size reaches that value
+        :type max_size: int
+        :param max_articles: max number of the articles in the shard
+        :type max_articles: int
+        :param compression: compress shards with "gz", "bz2" or "xz"
+        :type compression: str
+        :param prefix: prefix of the names of the shards. The names are
+                       ``'{prefix}-{shard_no:05}.conllu[.{compression}]'``
+        :type prefix: str
+        Other params are the same as for ``articles()``.
+
+        :return: the manifest: dict with the "articles", "sentences" and
+                 "shards" keys. The latter contains dicts with the "file",
+                 "first_article" (number of the first article of the shard in
+                 the dump, starting from 1), "first_id", "last_id",
+                 "articles", "sentences", "size" (in bytes of uncompressed
+                 text), and "sha256" (checksum of uncompressed text) keys
+        """
+        suffix = '.conllu'
+        if compression:
+            suffix += '.' + compression
+            assert os.path.splitext(suffix)[1] in COMPRESSORS, \
+                'ERROR: unknown compression "{}"'.format(compression)
+        silent = self._silent if silent is None else silent
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+        if not silent:
+            print('Process Wikipedia', file=LOG_FILE)
+        manifest = {'articles': 0, 'sentences': 0, 'shards': []}
+        results = self._imap_articles(True, workers=workers,
+                                      max_pending=max_pending)
+        while True:
+            fname = '{}-{:05}{}'.format(prefix, len(manifest['shards']),
+                                        suffix)
+            shard = self._write_shard(
+                os.path.join(path, fname), results, silent,
+                manifest['sentences'], max_size=max_size,
+                max_articles=max_articles
+            )
+            if shard is None:
+                break
+            shard['file'] = fname
+            shard['first_article'] = manifest['articles'] + 1
+            manifest['shards'].append(shard)
+            manifest['articles'] += shard['articles']
+            manifest['sentences'] += shard['sentences']
+            # the manifest of the interrupted run lists the completed shards
+            self._save_manifest(path, manifest)
+        self._save_manifest(path, manifest)
+        if not silent and manifest['sentences']:
+            print_progress(manifest['sentences'], end_value=0, step=1000,
+                           file=LOG_FILE)
+            print('Wikipedia has been processed: {} sentences, {} articles, '
+                  '{} shards'.format(manifest['sentences'],
+                                     manifest['articles'],
+                                     len(manifest['shards'])),
+                  file=LOG_FILE)
+        return manifest
+
+    def regenerate_shard(self, path, shard_no, silent=None, workers=None,
+                         max_pending=None):
+        """Regenerate one shard made by ``save_shards()``. The articles of the
+        previous shards are skipped without processing.
+
+        :param path: the directory with the shards and the manifest
+        :param shard_no: the index of the shard in the manifest
+        Other params are the same as for ``articles()``.
+
+        :return: ``True`` if the checksum of the new shard matches the one
+                 stored in the manifest
+        :rtype: bool
+        """
+        with open(os.path.join(path, MANIFEST), 'rt', encoding='utf-8') as f:
+            manifest = json.load(f)
+        shard = manifest['shards'][shard_no]
+        silent = self._silent if silent is None else silent
+
+        results = self._imap_articles(
+            True, workers=workers, max_pending=max_pending,
+            skip=shard['first_article'] - 1,
+            last_id=manifest['shards'][shard_no - 1]['last_id']
+                        if shard_no else
+                    None,
+            limit=shard['articles']
+        )
+        if not silent:
+            print('Regenerate shard {}'.format(shard['file']), file=LOG_FILE)
+        shard_ = self._write_shard(os.path.join(path, shard['file']),
+                                   results, silent, 0)
+        if not silent and shard_:
+            print_progress(shard_['sentences'], end_value=0, step=1000,
+                           file=LOG_FILE)
+        return bool(shard_) and shard_['sha256'] == shard['sha256']